@@ -0,0 +1,318 @@
+"""
+    python3 benchmark.py [ -g digraph-file ] [ -n queries ] [ --seed seed ]
+    python3 benchmark.py --bfs [ sizes ] [ -n queries ] [ --seed seed ]
+
+Times the least cost path engines in the digraph module against each other
+on cross-city queries, and checks that they all return least cost paths.
+
+If a road file is supplied with -g it is loaded with digraph.graph_from_text,
+otherwise a synthetic city grid is generated so the benchmark can run without
+the Edmonton data.
+
+With --bfs it times digraph.shortest_path against the list based breadth
+first search it replaced, on digraph.random_graph instances of increasing
+size, and checks that the paths have the same number of edges.
+"""
+import argparse
+import math
+import random
+import time
+
+import coordinates
+import digraph
+
+def distance_heuristic(vertices):
+    """
+    Returns a factory that, given a destination, returns the straight line
+    distance heuristic used for A* searches to that destination.
+
+    >>> heuristic = distance_heuristic({1: (0, 0), 2: (3, 4)})(2)
+    >>> heuristic(1)
+    5.0
+    """
+    def heuristic_to(dest):
+        (dest_lat, dest_lon) = vertices[dest]
+
+        def heuristic(v):
+            (lat, lon) = vertices[v]
+            return math.sqrt((lat - dest_lat) ** 2 + (lon - dest_lon) ** 2)
+
+        return heuristic
+
+    return heuristic_to
+
+def path_cost(path, cost):
+    """
+    Returns the total cost of a path, or None if there is no path.
+
+    >>> path_cost([1, 2, 3], lambda e: 2)
+    4
+    >>> path_cost(None, lambda e: 2)
+    """
+    if path is None:
+        return None
+    return sum(cost((path[i], path[i + 1])) for i in range(len(path) - 1))
+
+def synthetic_city(rows, cols, seed = 0, spacing = 100):
+    """
+    Generates a city-like street grid in the same (vertices, edges) format
+    as digraph.graph_from_text.  Coordinates are jittered, most streets are
+    two way, a few are one way and a few blocks are missing.
+
+    >>> (vertices, edges) = synthetic_city(3, 4)
+    >>> len(vertices)
+    12
+    >>> all(e[0] in vertices and e[1] in vertices for e in edges)
+    True
+    """
+    rng = random.Random(seed)
+
+    # roughly the south west corner of Edmonton, in the server's units
+    base_lat = 5340000
+    base_lon = -11360000
+
+    vertices = {}
+    for r in range(rows):
+        for c in range(cols):
+            jitter_lat = rng.randint(-spacing // 4, spacing // 4)
+            jitter_lon = rng.randint(-spacing // 4, spacing // 4)
+            vertices[r * cols + c] = (base_lat + r * spacing + jitter_lat,
+                                      base_lon + c * spacing + jitter_lon)
+
+    edges = set()
+    for r in range(rows):
+        for c in range(cols):
+            v = r * cols + c
+            for (nr, nc) in ((r + 1, c), (r, c + 1)):
+                if nr >= rows or nc >= cols: continue
+                w = nr * cols + nc
+
+                roll = rng.random()
+                if roll < 0.05:
+                    # missing block
+                    continue
+                elif roll < 0.15:
+                    # one way street, either direction
+                    edges.add((v, w) if rng.random() < 0.5 else (w, v))
+                else:
+                    edges.add((v, w))
+                    edges.add((w, v))
+
+    return (vertices, edges)
+
+def cross_city_queries(vertices, n, seed = 0):
+    """
+    Picks n (origin, destination) pairs that start in the south west tenth
+    of the city and end in the north east tenth.
+
+    >>> (vertices, edges) = synthetic_city(10, 10)
+    >>> queries = cross_city_queries(vertices, 3)
+    >>> len(queries)
+    3
+    >>> all(vertices[o] < vertices[d] for (o, d) in queries)
+    True
+    """
+    rng = random.Random(seed)
+    ordered = sorted(vertices, key = lambda v: (sum(vertices[v]), v))
+    tenth = max(1, len(ordered) // 10)
+    south_west = ordered[:tenth]
+    north_east = ordered[-tenth:]
+
+    return [ (rng.choice(south_west), rng.choice(north_east)) for _ in range(n) ]
+
+def time_engine(G, queries, cost, heuristic_to = None, **options):
+    """
+    Runs every query through digraph.least_cost_path with the given options.
+    If heuristic_to is given, it is called with each destination to get the
+    A* heuristic for that query.  Returns (seconds, vertices settled, paths).
+    """
+    paths = []
+    settled = 0
+    stats = {}
+
+    began = time.perf_counter()
+    for (origin, dest) in queries:
+        if heuristic_to:
+            options["heuristic"] = heuristic_to(dest)
+        paths.append(digraph.least_cost_path(G, origin, dest, cost, stats = stats, **options))
+        settled += stats["settled"]
+    elapsed = time.perf_counter() - began
+
+    return (elapsed, settled, paths)
+
+def compare_engines(queries, cost, engines):
+    """
+    Times each engine on the same queries.  engines is a list of
+    (label, graph, options) where options are the keyword options passed
+    to time_engine, and may replace the cost function with "cost" (None
+    to use the weights stored in the graph).  Returns a list of
+    (label, seconds, settled, same paths, same costs) rows, comparing each
+    engine to the first one.
+    """
+    rows = []
+    reference = None
+    for (label, G, options) in engines:
+        options = dict(options)
+        engine_cost = options.pop("cost", cost)
+        (elapsed, settled, paths) = time_engine(G, queries, engine_cost, **options)
+        costs = [ path_cost(p, cost) for p in paths ]
+        if reference is None:
+            reference = (paths, costs)
+        same_costs = all(
+            c == r if c is None or r is None else math.isclose(c, r)
+            for (c, r) in zip(costs, reference[1]) )
+        rows.append((label, elapsed, settled, paths == reference[0], same_costs))
+
+    return rows
+
+# number of vertices of the random graphs for --bfs, each with 3 edges a vertex
+BFS_SIZES = [250, 500, 1000, 2000, 4000]
+
+def list_shortest_path(G, source, dest):
+    """
+    The breadth first search digraph.shortest_path used to be, kept to
+    compare against.  The queue and the visited vertices are lists, so it
+    takes O(V) for each edge.
+
+    >>> list_shortest_path(digraph.Digraph([(1, 2), (2, 3), (1, 3)]), 1, 3)
+    [1, 3]
+    """
+    queue = [source]
+    visited = [source]
+    shortest_path = []
+    parent = {}
+
+    if source == dest:
+        return queue
+
+    while queue:
+        v = queue[0]
+        for x in G.adj_to(v):
+            if x == dest:
+                cur_path = [dest, v]
+                cur = v
+                while source not in cur_path:
+                    cur_path.append(parent[cur])
+                    cur = parent[cur]
+                cur_path.reverse()
+
+                if len(shortest_path) == 0:
+                    shortest_path = cur_path
+
+            elif x not in visited:
+                visited.append(x)
+                queue.append(x)
+                parent[x] = v
+
+        queue.remove(v)
+
+    return shortest_path
+
+def compare_bfs(sizes, num_queries, seed = 0):
+    """
+    Times list_shortest_path and digraph.shortest_path on random pairs of
+    vertices of a random graph of each size.  Returns a list of
+    (vertices, edges, old seconds, new seconds, same hops) rows.
+
+    >>> [ row[-1] for row in compare_bfs([30], 5) ]
+    [True]
+    """
+    rows = []
+    for n in sizes:
+        # random_graph draws from the random module itself, and the queries
+        # carry on from it so they are not the first edges drawn
+        random.seed(seed)
+        G = digraph.random_graph(n, 3 * n)
+        queries = [ (random.randrange(n), random.randrange(n)) for _ in range(num_queries) ]
+
+        timings = []
+        paths = []
+        for search in (list_shortest_path, digraph.shortest_path):
+            began = time.perf_counter()
+            paths.append([ search(G, origin, dest) for (origin, dest) in queries ])
+            timings.append(time.perf_counter() - began)
+
+        same_hops = all(len(old) == len(new) and (not new or G.is_path(new))
+                        for (old, new) in zip(*paths))
+        rows.append((n, G.num_edges(), timings[0], timings[1], same_hops))
+
+    return rows
+
+def print_bfs_rows(rows, num_queries):
+    print("{:>10} {:>10} {:>12} {:>12} {:>10} {:>10}".format(
+        "vertices", "edges", "old ms", "new ms", "speedup", "same hops"))
+    for (n, m, old, new, same_hops) in rows:
+        print("{:>10} {:>10} {:>12.3f} {:>12.3f} {:>9.0f}x {:>10}".format(
+            n, m, 1000 * old / num_queries, 1000 * new / num_queries,
+            old / max(new, 1e-9), str(same_hops)))
+
+def print_rows(rows, num_queries):
+    print("{:<12} {:>12} {:>14} {:>12} {:>12}".format(
+        "engine", "ms/query", "settled/query", "same paths", "same costs"))
+    for (label, elapsed, settled, same_paths, same_costs) in rows:
+        print("{:<12} {:>12.2f} {:>14.1f} {:>12} {:>12}".format(
+            label, 1000 * elapsed / num_queries, settled / num_queries,
+            str(same_paths), str(same_costs)))
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description = 'Benchmark the least cost path engines.')
+    parser.add_argument('-g', '--graph',
+                        help = 'path to road graph (DEFAULT = synthetic grid)',
+                        dest = 'graphname',
+                        default = None)
+    parser.add_argument('--grid',
+                        help = 'size of the synthetic grid (DEFAULT = 60)',
+                        type = int,
+                        default = 60)
+    parser.add_argument('-n', '--queries',
+                        help = 'number of cross-city queries (DEFAULT = 5)',
+                        type = int,
+                        default = 5)
+    parser.add_argument('--bfs',
+                        help = 'benchmark shortest_path on random graphs of these sizes instead (DEFAULT = {})'.format(
+                            " ".join(map(str, BFS_SIZES))),
+                        type = int,
+                        nargs = '*',
+                        default = None)
+    parser.add_argument('--seed',
+                        help = 'random seed for the workload (DEFAULT = 0)',
+                        type = int,
+                        default = 0)
+
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if args.bfs is not None:
+        print_bfs_rows(compare_bfs(args.bfs or BFS_SIZES, args.queries, args.seed), args.queries)
+        exit()
+
+    if args.graphname:
+        (vertices, edges) = digraph.graph_from_text(args.graphname)
+    else:
+        (vertices, edges) = synthetic_city(args.grid, args.grid, args.seed)
+
+    G = digraph.Digraph(edges)
+    cost = coordinates.CoordinateStore(vertices).distance_cost()
+    queries = cross_city_queries(vertices, args.queries, args.seed)
+
+    # the same graph with the edge costs computed up front
+    W = digraph.Digraph(edges)
+    W.set_weights(cost)
+    C = digraph.CSRDigraph(edges, vertices, cost)
+    heuristic_to = distance_heuristic(vertices)
+
+    print("{} vertices, {} edges, {} queries".format(
+        G.num_vertices(), G.num_edges(), len(queries)))
+    print_rows(compare_engines(queries, cost, [
+        ("scan", G, {"queue": "scan"}),
+        ("heap", G, {"queue": "heap"}),
+        ("heap+w", W, {"cost": None}),
+        ("heap+csr", C, {"cost": None}),
+        ("bidir+w", W, {"cost": None, "bidirectional": True}),
+        ("astar", G, {"heuristic_to": heuristic_to}),
+        ("astar+w", W, {"cost": None, "heuristic_to": heuristic_to}),
+        ("astar+csr", C, {"cost": None, "heuristic_to": heuristic_to}),
+        ]), len(queries))
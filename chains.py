@@ -0,0 +1,253 @@
+"""
+    python3 chains.py digraph-file [ --queries n ]
+
+Degree 2 chain compression of the road graph.
+
+Road files carry the shape of every road as vertices, and most of them
+only lead on to the next one: a single edge in and a single edge out, or
+on a two way road, edges to and from the same two neighbours.  Dijkstra
+settles each of them in turn.  ChainGraph collapses every run of these
+vertices into one edge whose cost is the cost of the whole run, and keeps
+the run as its geometry.  The search then runs on the smaller graph and
+the path found is expanded back into the original vertices, so routes
+are the same as on the full graph.
+
+Requests that start or end inside a chain are searched with a few extra
+edges: from the start to the ends it can reach along its chains, and
+from the chain starts that lead to the destination.
+
+Run as a script it reads a road file and reports how many vertices and
+edges the compressed graph keeps, and how many vertices Dijkstra settles
+on random requests on the full and compressed graphs.
+"""
+import argparse
+import random
+
+import digraph
+
+class ChainGraph:
+    """
+    A graph with its chains of degree 2 vertices collapsed into single
+    edges.  If cost is None the weights stored in G are used.  The
+    compressed graph, with its weights stored, is in graph.
+
+    >>> G = digraph.Digraph([(1, 2), (2, 3), (3, 4), (4, 5), (1, 6), (6, 5), (5, 7)])
+    >>> C = ChainGraph(G, lambda e: 1)
+    >>> sorted(C.graph.edges())
+    [(1, 5), (5, 7)]
+    >>> C.least_cost_path(1, 7)
+    [1, 6, 5, 7]
+    >>> C.least_cost_path(2, 5)
+    [2, 3, 4, 5]
+    >>> C.least_cost_path(6, 3)
+
+    Two way roads are chains in both directions
+    >>> G = digraph.Digraph([(1, 2), (2, 1), (2, 3), (3, 2), (3, 4), (4, 3), (4, 5)])
+    >>> C = ChainGraph(G, lambda e: 1)
+    >>> sorted(C.graph.edges())
+    [(1, 4), (4, 1), (4, 5)]
+    >>> (C.least_cost_path(3, 2), C.least_cost_path(2, 5), C.least_cost_path(3, 3))
+    ([3, 2], [2, 3, 4, 5], [3])
+    """
+
+    def __init__(self, G, cost = None):
+        neighbours = digraph.edge_costs(G, cost)
+
+        interior = set()
+        for v in G.vertices():
+            into = set(G.adj_from(v))
+            out = set(G.adj_to(v))
+            if v in out:
+                continue
+            if (len(into) == 1 and len(out) == 1 and into != out) or (len(into) == 2 and into == out):
+                interior.add(v)
+
+        # each chain is its vertices from one kept vertex to the next, and
+        # the cost from its first vertex to each of them
+        self._chains = []
+        self._position = {}
+        best = {}
+
+        def walk(u):
+            for (w, c) in neighbours(u):
+                sequence = [u, w]
+                costs = [0, c]
+                while w in interior:
+                    (prev, v) = sequence[-2:]
+                    (w, c) = next((x, c) for (x, c) in neighbours(v) if x != prev)
+                    sequence.append(w)
+                    costs.append(costs[-1] + c)
+
+                if len(sequence) > 2:
+                    k = len(self._chains)
+                    self._chains.append((tuple(sequence), tuple(costs)))
+                    for p in range(1, len(sequence) - 1):
+                        self._position.setdefault(sequence[p], []).append((k, p))
+                else:
+                    k = None
+
+                # the cheapest of parallel chains and edges is searched
+                e = (u, w)
+                if u != w and (e not in best or costs[-1] < best[e][0]):
+                    best[e] = (costs[-1], k)
+
+        kept = G.vertices() - interior
+        for u in kept:
+            walk(u)
+
+        # rings of interior vertices are entered nowhere, keep one of each
+        for v in sorted(interior):
+            if v not in self._position:
+                interior.discard(v)
+                kept.add(v)
+                walk(v)
+
+        self._kept = kept
+        self.graph = digraph.Digraph(best)
+        for v in kept:
+            self.graph.add_vertex(v)
+        self.graph.set_weights(lambda e: best[e][0])
+
+        self._edge_chain = { e: (k, 0, len(self._chains[k][0]) - 1)
+                             for (e, (_, k)) in best.items() if k is not None }
+
+    def num_chain_vertices(self):
+        """
+        Returns the number of vertices that are only in chains.
+        """
+        return len(self._position)
+
+    def __contains__(self, v):
+        return v in self._kept or v in self._position
+
+    def least_cost_path(self, start, dest, stats = None, heuristic = None,
+                        bidirectional = False, stream = False):
+        """
+        Returns the least cost path from start to dest over the original
+        vertices, or None if there is none, searching the compressed graph
+        with digraph.least_cost_path.  stats, heuristic, bidirectional and
+        stream are passed on to it, and a streamed path is expanded as it
+        is read.
+        """
+        if start not in self or dest not in self:
+            return None
+
+        query = _QueryGraph(self, start, dest)
+        hops = digraph.least_cost_path(query, start, dest, stats = stats,
+                                       heuristic = heuristic,
+                                       bidirectional = bidirectional,
+                                       stream = stream)
+        if hops is None:
+            return None
+
+        path = self._expand(iter(hops), query.geometry)
+        if stream:
+            return path
+        return list(path)
+
+    def _expand(self, hops, geometry):
+        """
+        Generates the original vertices of a path through the compressed
+        graph, with the chain of each edge that has one.
+        """
+        u = next(hops)
+        yield u
+        for w in hops:
+            chain = geometry.get((u, w)) or self._edge_chain.get((u, w))
+            if chain is None:
+                yield w
+            else:
+                (k, a, b) = chain
+                yield from self._chains[k][0][a + 1:b + 1]
+            u = w
+
+class _QueryGraph:
+    """
+    The compressed graph of a ChainGraph as seen by one search, with edges
+    added out of start and into dest when they lie inside chains.
+    geometry holds the part of a chain, (chain, first, last position),
+    each added edge stands for.
+    """
+
+    def __init__(self, C, start, dest):
+        self._graph = C.graph
+        self._kept = C._kept
+        self._out = {}
+        self._into = {}
+        self.geometry = {}
+
+        def add(u, w, k, a, b):
+            (_, costs) = C._chains[k]
+            c = costs[b] - costs[a]
+            if (u, w) not in self.geometry or c < self._out[u][w]:
+                self._out.setdefault(u, {})[w] = c
+                self._into.setdefault(w, {})[u] = c
+                self.geometry[(u, w)] = (k, a, b)
+
+        for (k, a) in C._position.get(start, ()):
+            (sequence, _) = C._chains[k]
+            add(start, sequence[-1], k, a, len(sequence) - 1)
+            for (j, b) in C._position.get(dest, ()):
+                if j == k and b > a:
+                    add(start, dest, k, a, b)
+
+        for (k, b) in C._position.get(dest, ()):
+            (sequence, _) = C._chains[k]
+            add(sequence[0], dest, k, 0, b)
+
+    def _merge(self, stored, added, v):
+        """
+        The (w, cost) pairs of the stored edges at v and the added ones.
+        """
+        pairs = list(stored(v)) if v in self._kept else []
+        if v in added:
+            pairs.extend(added[v].items())
+        return pairs
+
+    def adj_to_weights(self, v):
+        return self._merge(self._graph.adj_to_weights, self._out, v)
+
+    def adj_from_weights(self, v):
+        return self._merge(self._graph.adj_from_weights, self._into, v)
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description = 'Report on degree 2 chain compression of a road file.')
+    parser.add_argument('graphname', help = 'road file')
+    parser.add_argument('--queries',
+                        help = 'number of random requests to report on (DEFAULT = 100)',
+                        type = int,
+                        default = 100)
+
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    import time
+
+    import coordinates
+
+    args = parse_args()
+
+    (G, vertices) = digraph.read_graph(args.graphname)
+    G.set_weights(coordinates.CoordinateStore(vertices).distance_cost())
+
+    began = time.perf_counter()
+    C = ChainGraph(G)
+    seconds = time.perf_counter() - began
+    print("{} vertices and {} edges compressed to {} and {} in {:.1f}s".format(
+        G.num_vertices(), G.num_edges(), C.graph.num_vertices(), C.graph.num_edges(), seconds))
+
+    rng = random.Random(0)
+    ordered = sorted(vertices)
+    settled = { "full": 0, "compressed": 0 }
+    stats = {}
+    for _ in range(args.queries):
+        (start, dest) = (rng.choice(ordered), rng.choice(ordered))
+        digraph.least_cost_path(G, start, dest, stats = stats)
+        settled["full"] += stats["settled"]
+        C.least_cost_path(start, dest, stats = stats)
+        settled["compressed"] += stats["settled"]
+
+    for name in ("full", "compressed"):
+        print("{:<10} {:>10.0f} vertices settled per request".format(
+            name, settled[name] / max(1, args.queries)))
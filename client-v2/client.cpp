@@ -261,6 +261,10 @@ void loop() {
             stop_lon = cursor_lon;
             request_state = 0;
 
+            // ask for the binary route protocol before the first request,
+            // ASCII if the server does not know it
+            serial_negotiate_protocol(1000);
+
             // send out the start and stop coordinates to the server
             Serial.print(start_lat);
             Serial.print(" "); 
@@ -269,6 +273,9 @@ void loop() {
             Serial.print(stop_lat);
             Serial.print(" "); 
             Serial.print(stop_lon);
+            // the map shown, so the server can simplify the route for it
+            Serial.print(" ");
+            Serial.print(current_map_num);
             Serial.println();
 
             // free any existing path
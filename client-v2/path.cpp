@@ -10,7 +10,9 @@
 
 /* path routine error code
    0 no error
-   1 
+   1 path length out of range
+   2 out of memory for the path
+   3 binary frame damaged: bad checksum or length
 */
 int16_t path_errno;
 
@@ -22,6 +24,9 @@ extern Adafruit_ST7735 tft;
 
 // Returns 1 if the call was successful, 0 if not.
 
+static uint8_t read_path_binary(uint16_t *length_p, coord_t *path_p[],
+    uint16_t max_path_size);
+
 uint8_t read_path(uint16_t *length_p, coord_t *path_p[]) {
     // the line to be read, and it size
     const uint8_t line_size = 40;
@@ -49,6 +54,10 @@ uint8_t read_path(uint16_t *length_p, coord_t *path_p[]) {
         Serial.println(max_path_size);
     #endif
 
+    if ( wire_protocol == 1 ) {
+        return read_path_binary(length_p, path_p, max_path_size);
+        }
+
     bytes_read = serial_readline(line, line_size);
 
     // read the number of points, first field
@@ -101,6 +110,93 @@ uint8_t read_path(uint16_t *length_p, coord_t *path_p[]) {
     return 1;
     }
 
+// running Fletcher-16 checksum and byte count of a binary frame payload
+static uint16_t frame_sum1, frame_sum2, frame_remaining;
+
+static uint8_t frame_read_byte() {
+    uint8_t b = serial_read_byte();
+    frame_sum1 = (frame_sum1 + b) % 255;
+    frame_sum2 = (frame_sum2 + frame_sum1) % 255;
+    if ( frame_remaining > 0 ) frame_remaining--;
+    return b;
+    }
+
+static uint32_t frame_read_varint() {
+    uint32_t value = 0;
+    uint8_t shift = 0;
+    uint8_t b;
+    do {
+        b = frame_read_byte();
+        if ( shift < 32 ) value |= (uint32_t) (b & 0x7f) << shift;
+        shift += 7;
+        } while ( b & 0x80 );
+    return value;
+    }
+
+static int32_t unzigzag(uint32_t z) {
+    return (int32_t) (z >> 1) ^ -(int32_t) (z & 1);
+    }
+
+// read a binary route frame, see wire.py on the server: a 2 byte length,
+// a varint point count and zig-zag varint deltas, then a Fletcher-16
+// checksum of the payload.  The points are decoded as they arrive, so
+// the frame is never held in memory.
+static uint8_t read_path_binary(uint16_t *length_p, coord_t *path_p[],
+    uint16_t max_path_size) {
+
+    frame_remaining = serial_read_byte();
+    frame_remaining |= (uint16_t) serial_read_byte() << 8;
+    frame_sum1 = frame_sum2 = 0;
+
+    uint32_t count = frame_read_varint();
+
+    #ifdef DEBUG_PATH
+        Serial.print("Path length ");
+        Serial.print(count);
+        Serial.println();
+    #endif
+
+    // a count we cannot hold still has its frame read, to stay in step
+    // with the server
+    coord_t *tmp_path = 0;
+    if ( count > max_path_size ) {
+        path_errno = 1;
+        }
+    else if ( count > 0 ) {
+        tmp_path = (coord_t *) malloc( count * sizeof(coord_t));
+        if ( !tmp_path ) path_errno = 2;
+        }
+
+    int32_t lat = 0;
+    int32_t lon = 0;
+    for (uint32_t i = 0; i < count && frame_remaining > 0; i++) {
+        lat += unzigzag(frame_read_varint());
+        lon += unzigzag(frame_read_varint());
+        if ( tmp_path ) {
+            tmp_path[i].lat = lat;
+            tmp_path[i].lon = lon;
+            }
+        }
+
+    // skip anything left of a frame we could not use
+    while ( frame_remaining > 0 ) frame_read_byte();
+
+    uint16_t checksum = serial_read_byte();
+    checksum |= (uint16_t) serial_read_byte() << 8;
+    if ( path_errno == 0 && checksum != ((frame_sum2 << 8) | frame_sum1) ) {
+        path_errno = 3;
+        }
+
+    if ( path_errno ) {
+        if ( tmp_path ) free(tmp_path);
+        return 0;
+        }
+
+    *length_p = count;
+    *path_p = tmp_path;
+    return 1;
+    }
+
 uint8_t is_coord_visible(coord_t point) {
     // figure out the x and y positions on the current map of the 
     // given point
@@ -84,3 +84,54 @@ int32_t string_get_int(const char *str) {
 
     return val;
 }
+
+uint8_t wire_protocol = 0;
+
+// set once the server has answered, or failed to answer, the negotiation
+static uint8_t negotiated = 0;
+
+uint8_t serial_negotiate_protocol(uint16_t timeout_ms) {
+    if ( negotiated ) {
+        return wire_protocol;
+        }
+
+    Serial.println("PROTOCOL 1");
+
+    // like serial_readline, but giving up after the timeout
+    const uint8_t line_size = 16;
+    char line[line_size];
+    uint8_t bytes_read = 0;
+    uint32_t start = millis();
+
+    while ( millis() - start < timeout_ms ) {
+        if ( Serial.available() == 0 ) continue;
+
+        char c = (char) Serial.read();
+        if ( c == '\r' || c == '\n' ) {
+            if ( bytes_read == 0 ) continue;
+            break;
+            }
+        if ( bytes_read < line_size - 1 ) {
+            line[bytes_read] = c;
+            bytes_read++;
+            }
+        }
+    line[bytes_read] = '\0';
+
+    if ( strcmp(line, "PROTOCOL 1") == 0 ) {
+        wire_protocol = 1;
+        }
+    else {
+        wire_protocol = 0;
+        }
+    negotiated = 1;
+
+    return wire_protocol;
+}
+
+uint8_t serial_read_byte() {
+    while (Serial.available() == 0) {
+        // Wait until data is available.
+    }
+    return (uint8_t) Serial.read();
+}
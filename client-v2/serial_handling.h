@@ -66,4 +66,30 @@ uint16_t string_read_field(const char *str, uint16_t str_start,
 
 int32_t string_get_int(const char *str);
 
+/*
+ Protocol the server sends routes in, see wire.py on the server side.
+   0  ASCII lines, one "lat lon" per point
+   1  binary frames of zig-zag varint deltas
+ */
+extern uint8_t wire_protocol;
+
+/*
+ Function to ask the server for the binary route protocol.
+
+ Arguments:
+ timeout_ms:  How long to wait for the server's answer.
+
+ Postconditions: wire_protocol is set to the protocol the server agreed
+     to, or left at ASCII if it did not answer in time.  Only the first
+     call asks the server, later calls return the protocol it settled on.
+
+ Returns: the protocol in use.
+ */
+uint8_t serial_negotiate_protocol(uint16_t timeout_ms);
+
+/*
+ Function to read one byte from the serial port, blocking until it arrives.
+ */
+uint8_t serial_read_byte();
+
 #endif
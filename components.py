@@ -0,0 +1,123 @@
+"""
+Strongly connected components of the road graph, for turning down
+requests that have no route without searching for one.
+
+A search between vertices with no route between them settles everything
+reachable from the origin before it gives up, and snapping can easily
+land on a one way stub or an isolated piece of the map.  The components
+are found once, when the graph is loaded, and reachable then answers in
+constant time for the pairs that matter on a road network: within a
+component, and into, out of or through the one giant component.
+"""
+
+import digraph
+
+class ComponentIndex:
+    """
+    The strongly connected components of a graph, numbered in topological
+    order, and which of them can reach the largest one or be reached from
+    it.
+
+    >>> G = digraph.Digraph([(1, 2), (2, 1), (2, 3), (3, 2), (4, 1), (3, 5), (6, 7)])
+    >>> index = ComponentIndex(G)
+    >>> (len(index), index.size(1), index.in_largest(3), index.in_largest(4))
+    (5, 3, True, False)
+
+    True if there is a route, False if there is none
+    >>> [ index.reachable(1, 3), index.reachable(4, 5), index.reachable(5, 1), index.reachable(1, 6) ]
+    [True, True, False, False]
+
+    and None if the components alone cannot tell
+    >>> print(index.reachable(6, 7))
+    None
+    """
+
+    def __init__(self, G):
+        components = digraph.strongly_connected_components(G)
+        self.sizes = [ len(component) for component in components ]
+        self.largest = None
+        if components:
+            self.largest = self.sizes.index(max(self.sizes))
+
+        # on a road network nearly every vertex is in the largest component,
+        # so only the others are stored
+        self._component = {}
+        for (i, component) in enumerate(components):
+            if i != self.largest:
+                for v in component:
+                    self._component[v] = i
+
+        # components the largest can reach, and those that can reach it
+        self._from_largest = bytearray(len(components))
+        self._to_largest = bytearray(len(components))
+        if self.largest is not None:
+            start = components[self.largest][0]
+            for v in _reached(start, G.adj_to):
+                self._from_largest[self.component(v)] = 1
+            for v in _reached(start, G.adj_from):
+                self._to_largest[self.component(v)] = 1
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def component(self, v):
+        """
+        Returns the number of the component of vertex v.  Components are
+        numbered in topological order: no edge goes from a component to
+        one with a smaller number.
+        """
+        return self._component.get(v, self.largest)
+
+    def size(self, v):
+        """
+        Returns the number of vertices in the component of v.
+        """
+        return self.sizes[self.component(v)]
+
+    def in_largest(self, v):
+        """
+        Returns True if v is in the largest component.
+        """
+        return v not in self._component
+
+    def reachable(self, start, dest):
+        """
+        Returns True if there is a path from start to dest, False if there
+        is none, or None if it takes a search to tell.
+        """
+        a = self.component(start)
+        b = self.component(dest)
+
+        if a == b:
+            return True
+        if a > b:
+            return False
+        if self._to_largest[a] and self._from_largest[b]:
+            return True
+
+        # if the largest component reaches start it reaches all that start
+        # does, and if dest reaches it so does everything that reaches dest
+        if self._from_largest[a] and not self._from_largest[b]:
+            return False
+        if self._to_largest[b] and not self._to_largest[a]:
+            return False
+
+        return None
+
+def _reached(start, adjacent):
+    """
+    Returns every vertex reached from start by following adjacent.
+    """
+    visited = { start }
+    todo = [ start ]
+    while todo:
+        cur = todo.pop()
+        for n in adjacent(cur):
+            if n not in visited:
+                visited.add(n)
+                todo.append(n)
+    return visited
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,386 @@
+"""
+    python3 contraction.py digraph-file [ hierarchy-file ]
+
+Contraction hierarchies for fast least cost path queries.
+
+Preprocessing contracts the vertices one at a time, least important first.
+Contracting v removes it from the graph, and for every pair of remaining
+neighbours u -> v -> w whose least cost path goes through v, adds a
+shortcut edge u -> w with the combined cost.  The order a vertex was
+contracted in is its rank.
+
+A query then runs Dijkstra forward from the origin and backward from the
+destination, but only along edges that lead to higher ranked vertices.
+Both searches stay small and meet at the highest ranked vertex of the
+path.  Shortcuts remember the vertex they skip, so the path is unpacked
+back into the original vertices.
+
+Run as a script it reads a road file, builds the hierarchy with the
+straight line edge costs the server uses, and saves it to hierarchy-file
+(the road file name with ".ch" added if not given).
+
+Hierarchy files are written with snapshot.write_section, all little
+endian, every section starting on an 8 byte boundary:
+    header        magic, version, vertex/up/down/shortcut counts,
+                  SHA-256 of the road file
+    ids           int64[n]   vertices, lowest rank first
+    up_offsets    int32[n+1] \\
+    up_targets    int64[u]    | edges to higher ranked vertices, out of
+    up_costs      float64[u] /  each vertex in rank order
+    down_offsets  int32[n+1] \\
+    down_sources  int64[d]    | edges from higher ranked vertices into
+    down_costs    float64[d] /  each vertex in rank order
+    shortcuts     int64[3s]  (u, w, skipped vertex) of each shortcut
+"""
+import array
+import heapq
+import os
+import struct
+import sys
+
+import digraph
+import snapshot
+
+MAGIC = b"RONALDCH"
+VERSION = 2
+
+# magic, version, vertices, up edges, down edges, shortcuts, text sha256
+_HEADER = struct.Struct("<8sIIIII32s")
+
+class ContractionHierarchy:
+    """
+    Contraction hierarchy over a graph with edge costs.  If cost is None
+    the weights stored in G are used.
+
+    >>> G = digraph.Digraph([(1, 2), (2, 3), (3, 4), (1, 5), (5, 4), (4, 1)])
+    >>> cost = lambda e: {(1, 5): 5, (5, 4): 5}.get(e, 1)
+    >>> CH = ContractionHierarchy(G, cost)
+    >>> CH.least_cost_path(1, 4)
+    [1, 2, 3, 4]
+    >>> CH.least_cost_path(5, 3)
+    [5, 4, 1, 2, 3]
+    >>> CH.least_cost_path(2, 2)
+    [2]
+    >>> CH.least_cost_path(1, 6)
+
+    # Disconnected vertices have no path
+    >>> CH = ContractionHierarchy(digraph.Digraph([(1, 2), (3, 4)]), lambda e: 1)
+    >>> CH.least_cost_path(1, 4)
+    """
+
+    def __init__(self, G, cost = None, witness_limit = 200):
+        self.rank = {}
+        self.checksum = bytes(32)
+
+        # edges to higher ranked vertices, out of and into each vertex
+        self._up = {}
+        self._down = {}
+
+        # the vertex each shortcut skips
+        self._middle = {}
+
+        if G is not None:
+            self._contract(G, cost, witness_limit)
+
+    def _contract(self, G, cost, witness_limit):
+        """
+        Orders and contracts every vertex of G.
+        """
+        neighbours = digraph.edge_costs(G, cost)
+        out = { v: {} for v in G.vertices() }
+        into = { v: {} for v in G.vertices() }
+        for v in out:
+            for (w, c) in neighbours(v):
+                if w == v: continue
+                out[v][w] = c
+                into[w][v] = c
+
+        deleted = { v: 0 for v in out }
+
+        def priority(v):
+            # edge difference, plus the number of contracted neighbours to
+            # spread the contraction evenly over the graph.  The shortcuts
+            # are returned too, to be added if v is contracted now.
+            shortcuts = _shortcuts(v, out, into, witness_limit)
+            return (len(shortcuts) - len(out[v]) - len(into[v]) + deleted[v], shortcuts)
+
+        todo = [ (priority(v)[0], v) for v in out ]
+        heapq.heapify(todo)
+
+        while todo:
+            (_, v) = heapq.heappop(todo)
+
+            # priorities go stale as neighbours are contracted, so check
+            # that v still comes first before contracting it
+            (p, shortcuts) = priority(v)
+            if todo and p > todo[0][0]:
+                heapq.heappush(todo, (p, v))
+                continue
+
+            # every edge v still has leads to a vertex contracted later
+            self.rank[v] = len(self.rank)
+            self._up[v] = list(out[v].items())
+            self._down[v] = list(into[v].items())
+
+            for u in into[v]:
+                del out[u][v]
+                deleted[u] += 1
+            for w in out[v]:
+                del into[w][v]
+                deleted[w] += 1
+            del out[v]
+            del into[v]
+
+            for (u, w, c) in shortcuts:
+                out[u][w] = c
+                into[w][u] = c
+                self._middle[(u, w)] = v
+
+    def num_shortcuts(self):
+        """
+        Returns the number of shortcut edges in the hierarchy.
+        """
+        return len(self._middle)
+
+    def least_cost_path(self, start, dest, stats = None):
+        """
+        Returns the least cost path from start to dest as a list of
+        vertices, or None if there is none.  If stats is a dictionary the
+        number of vertices "settled" by both searches is stored in it.
+        """
+        if stats is None:
+            stats = {}
+        stats["settled"] = 0
+
+        if start not in self.rank or dest not in self.rank:
+            return None
+        if start == dest:
+            return [start]
+
+        # forward search over _up, backward search over _down
+        distance = ({start: 0}, {dest: 0})
+        parent = ({}, {})
+        todo = ([(0, start)], [(0, dest)])
+        visited = (set(), set())
+        edges = (self._up, self._down)
+
+        best = float('inf')
+        meet = None
+
+        while todo[0] or todo[1]:
+            # expand the side with the smaller key, and stop once neither
+            # side can improve on the best path
+            side = 0 if (todo[0] and (not todo[1] or todo[0][0][0] <= todo[1][0][0])) else 1
+            if todo[side][0][0] >= best:
+                if not todo[1 - side] or todo[1 - side][0][0] >= best:
+                    break
+                side = 1 - side
+
+            (d, v) = heapq.heappop(todo[side])
+            if v in visited[side]: continue
+            visited[side].add(v)
+
+            other = distance[1 - side]
+            if v in other and d + other[v] < best:
+                best = d + other[v]
+                meet = v
+
+            for (w, c) in edges[side][v]:
+                new_distance = d + c
+                if w not in distance[side] or new_distance < distance[side][w]:
+                    distance[side][w] = new_distance
+                    parent[side][w] = v
+                    heapq.heappush(todo[side], (new_distance, w))
+
+                    if w in other and new_distance + other[w] < best:
+                        best = new_distance + other[w]
+                        meet = w
+
+        stats["settled"] = len(visited[0]) + len(visited[1])
+
+        if meet is None:
+            return None
+
+        # the search path, with shortcuts still in it
+        up_path = [meet]
+        while up_path[-1] != start:
+            up_path.append(parent[0][up_path[-1]])
+        up_path.reverse()
+
+        down_path = [meet]
+        while down_path[-1] != dest:
+            down_path.append(parent[1][down_path[-1]])
+
+        hops = up_path + down_path[1:]
+
+        path = [start]
+        for i in range(len(hops) - 1):
+            self._unpack(hops[i], hops[i+1], path)
+
+        return path
+
+    def _unpack(self, u, w, path):
+        """
+        Appends the original vertices after u on edge u -> w to path,
+        expanding shortcuts.
+        """
+        stack = [(u, w)]
+        while stack:
+            (x, y) = stack.pop()
+            m = self._middle.get((x, y))
+            if m is None:
+                path.append(y)
+            else:
+                stack.append((m, y))
+                stack.append((x, m))
+
+    def save(self, filename, text_file = None):
+        """
+        Writes the hierarchy to a file, to be read back with load,
+        recording the SHA-256 of the road file text_file it was built for
+        if it is given.  The file is replaced in one step.
+
+        >>> import os, tempfile
+        >>> CH = ContractionHierarchy(digraph.Digraph([(1, 2), (2, 3)]), lambda e: 1)
+        >>> path = os.path.join(tempfile.mkdtemp(), "test.ch")
+        >>> CH.save(path, "test.txt")
+        >>> CH = ContractionHierarchy.load(path)
+        >>> (CH.least_cost_path(1, 3), CH.is_current("test.txt"))
+        ([1, 2, 3], True)
+        """
+        checksum = self.checksum
+        if text_file is not None:
+            checksum = snapshot.text_checksum(text_file)
+
+        ids = sorted(self.rank, key = self.rank.get)
+        sections = [ array.array('q', ids) ]
+        for edges in (self._up, self._down):
+            offsets = array.array('i', [0])
+            ends = array.array('q')
+            costs = array.array('d')
+            for v in ids:
+                for (w, c) in edges[v]:
+                    ends.append(w)
+                    costs.append(c)
+                offsets.append(len(ends))
+            sections += [offsets, ends, costs]
+        sections.append(array.array('q',
+            (x for ((u, w), m) in self._middle.items() for x in (u, w, m))))
+
+        header = _HEADER.pack(MAGIC, VERSION, len(ids), len(sections[2]),
+                              len(sections[5]), len(self._middle), checksum)
+
+        temporary = "%s.%d.tmp" % (filename, os.getpid())
+        with open(temporary, 'wb') as f:
+            snapshot.write_section(f, header)
+            for section in sections:
+                snapshot.write_section(f, snapshot.little_endian(section).tobytes())
+        os.replace(temporary, filename)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Reads a hierarchy written by save.
+        """
+        if sys.byteorder != 'little':
+            raise RuntimeError("Hierarchies can only be loaded on little endian hosts")
+
+        sections = snapshot.SectionReader(filename, _HEADER)
+        try:
+            (magic, version, n, up, down, shortcuts, checksum) = sections.header
+            if magic != MAGIC:
+                raise ValueError("{} is not a contraction hierarchy".format(filename))
+            if version != VERSION:
+                raise ValueError("{} is hierarchy version {}, expected {}".format(
+                    filename, version, VERSION))
+
+            CH = cls(None)
+            CH.checksum = checksum
+            ids = sections.take('q', n).tolist()
+            CH.rank = { v: r for (r, v) in enumerate(ids) }
+
+            for (edges, count) in ((CH._up, up), (CH._down, down)):
+                offsets = sections.take('i', n + 1).tolist()
+                ends = sections.take('q', count).tolist()
+                costs = sections.take('d', count).tolist()
+                for (r, v) in enumerate(ids):
+                    (lo, hi) = (offsets[r], offsets[r + 1])
+                    edges[v] = list(zip(ends[lo:hi], costs[lo:hi]))
+
+            triples = sections.take('q', 3 * shortcuts).tolist()
+            CH._middle = { (triples[i], triples[i + 1]): triples[i + 2]
+                           for i in range(0, len(triples), 3) }
+        finally:
+            sections.close()
+
+        return CH
+
+    def is_current(self, text_file):
+        """
+        Returns True if the hierarchy was built for the current contents
+        of text_file.
+        """
+        return self.checksum == snapshot.text_checksum(text_file)
+
+def _shortcuts(v, out, into, witness_limit):
+    """
+    Returns the shortcuts (u, w, cost) needed to contract v: one for each
+    path u -> v -> w with no other path, a witness, at most as cheap.
+    Witness searches give up after settling witness_limit vertices, which
+    can only add shortcuts that were not needed.
+    """
+    shortcuts = []
+    if not out[v]:
+        return shortcuts
+
+    longest_out = max(out[v].values())
+    for (u, cost_in) in into[v].items():
+        witness = _witness_search(u, v, out, cost_in + longest_out, witness_limit)
+        for (w, cost_out) in out[v].items():
+            if w == u: continue
+            through = cost_in + cost_out
+            if witness.get(w, float('inf')) > through:
+                shortcuts.append((u, w, through))
+
+    return shortcuts
+
+def _witness_search(source, skip, out, limit, witness_limit):
+    """
+    Dijkstra from source that never enters skip, stops at cost limit or
+    after settling witness_limit vertices.  Returns the distances found.
+    """
+    distance = {source: 0}
+    todo = [(0, source)]
+    settled = 0
+
+    while todo and settled < witness_limit:
+        (d, v) = heapq.heappop(todo)
+        if d > distance[v]: continue
+        if d > limit: break
+        settled += 1
+
+        for (w, c) in out[v].items():
+            if w == skip: continue
+            new_distance = d + c
+            if w not in distance or new_distance < distance[w]:
+                distance[w] = new_distance
+                heapq.heappush(todo, (new_distance, w))
+
+    return distance
+
+if __name__ == "__main__":
+    import coordinates
+
+    argv = sys.argv[1:]
+    if not argv:
+        print(__doc__)
+        exit(1)
+
+    text_file = argv.pop(0)
+    hierarchy_file = argv.pop(0) if argv else text_file + ".ch"
+
+    (G, vertices) = digraph.read_graph(text_file)
+    CH = ContractionHierarchy(G, coordinates.CoordinateStore(vertices).distance_cost())
+    CH.save(hierarchy_file, text_file)
+    print("Wrote {}, {} vertices, {} shortcuts".format(
+        hierarchy_file, len(CH.rank), CH.num_shortcuts()))
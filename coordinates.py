@@ -0,0 +1,235 @@
+"""
+Dense storage for vertex coordinates.
+
+A dictionary from vertex id to a (lat, lon) tuple costs a hash table
+slot, a tuple and two int objects for every vertex.  CoordinateStore
+keeps the coordinates in two array('i') columns instead, 4 bytes each,
+with the vertex ids in a third column and a map from id to position.
+It can still be used like the dictionary it replaces.
+
+Snapping many points at once is vectorised with NumPy when it is
+installed, and falls back to one point at a time when it is not.
+"""
+
+import array
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# most point to vertex distances nearest_many computes in one block
+BLOCK_DISTANCES = 1 << 22
+
+class CoordinateStore:
+    """
+    Vertex coordinates in columns, indexed by a dense vertex index 0..n-1
+    in sorted id order.
+
+    >>> store = CoordinateStore({20: (5, 7), 10: (1, 4)})
+    >>> store[20]
+    (5, 7)
+    >>> (store.index(20), store.vertex(0), list(store.lat))
+    (1, 10, [1, 5])
+    >>> (10 in store, 30 in store, len(store), sorted(store))
+    (True, False, 2, [10, 20])
+    >>> store.distance_cost()((10, 20))
+    5.0
+    >>> store[30]
+    Traceback (most recent call last):
+    ...
+    KeyError: 30
+    """
+
+    def __init__(self, vertices = None):
+        items = sorted((vertices or {}).items())
+
+        self.ids = array.array('q', (v for (v, _) in items))
+        self.lat = array.array('i', (lat for (_, (lat, lon)) in items))
+        self.lon = array.array('i', (lon for (_, (lat, lon)) in items))
+
+        self._index = { v: i for (i, (v, _)) in enumerate(items) }
+        self.index = self._index.__getitem__
+        self._numpy_columns = None
+
+    @classmethod
+    def from_arrays(cls, ids, lat, lon, index = None):
+        """
+        Builds a store over existing columns without copying them, so they
+        can be memoryviews of a memory mapped file.  index is a function
+        from vertex id to position that raises KeyError for unknown ids,
+        such as the index method of a CSRDigraph over the same sorted ids.
+        If it is None a dictionary is built.
+
+        >>> store = CoordinateStore.from_arrays([3, 8], [1, 2], [5, 6])
+        >>> store[8]
+        (2, 6)
+        """
+        store = cls.__new__(cls)
+        store.ids = ids
+        store.lat = lat
+        store.lon = lon
+
+        if index is None:
+            store._index = { v: i for (i, v) in enumerate(ids) }
+            index = store._index.__getitem__
+        store.index = index
+        store._numpy_columns = None
+
+        return store
+
+    def subset(self, keep):
+        """
+        Returns a store of the vertices v for which keep(v) is true.
+
+        >>> CoordinateStore({1: (0, 0), 2: (3, 4), 3: (5, 5)}).subset(lambda v: v != 2)[3]
+        (5, 5)
+        """
+        kept = [ i for (i, v) in enumerate(self.ids) if keep(v) ]
+        return CoordinateStore.from_arrays(
+            array.array('q', (self.ids[i] for i in kept)),
+            array.array('i', (self.lat[i] for i in kept)),
+            array.array('i', (self.lon[i] for i in kept)))
+
+    def vertex(self, i):
+        """
+        Returns the id of the vertex with dense index i.
+        """
+        return self.ids[i]
+
+    def __getitem__(self, v):
+        i = self.index(v)
+        return (self.lat[i], self.lon[i])
+
+    def __contains__(self, v):
+        try:
+            self.index(v)
+        except KeyError:
+            return False
+        return True
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def items(self):
+        ids = self.ids
+        lat = self.lat
+        lon = self.lon
+        return ( (ids[i], (lat[i], lon[i])) for i in range(len(ids)) )
+
+    def values(self):
+        return zip(self.lat, self.lon)
+
+    def distance_cost(self):
+        """
+        Returns a function giving the straight line length of an edge
+        (v, w), for Digraph.set_weights.  This is the only definition of
+        the distance cost: snapshots, hierarchies, landmarks, benchmarks
+        and Server.cost_distance all use it, so their weights are the same
+        to the last bit.
+
+        >>> CoordinateStore({1: (0, 0), 2: (3, 4)}).distance_cost()((1, 2))
+        5.0
+        """
+        index = self.index
+        lat = self.lat
+        lon = self.lon
+        sqrt = math.sqrt
+
+        def cost(e):
+            i = index(e[0])
+            j = index(e[1])
+            d_lat = lat[i] - lat[j]
+            d_lon = lon[i] - lon[j]
+            return sqrt(d_lat * d_lat + d_lon * d_lon)
+
+        return cost
+
+    def path_coordinates(self, path):
+        """
+        Returns the (lat, lon) of each vertex of path.
+
+        >>> CoordinateStore({1: (0, 0), 2: (3, 4)}).path_coordinates([2, 1])
+        [(3, 4), (0, 0)]
+        """
+        index = self.index
+        lat = self.lat
+        lon = self.lon
+        result = []
+        for v in path:
+            i = index(v)
+            result.append((lat[i], lon[i]))
+        return result
+
+    def nearest(self, lat, lon):
+        """
+        Returns the id of the vertex closest to (lat, lon) by checking every
+        vertex, or None if the store is empty.  Ties go to the smaller id.
+
+        >>> CoordinateStore({1: (0, 0), 2: (10, 10), 3: (10, -10)}).nearest(10, 0)
+        1
+        """
+        best = None
+        best_distance = None
+        for (i, (v_lat, v_lon)) in enumerate(zip(self.lat, self.lon)):
+            d = (lat - v_lat) ** 2 + (lon - v_lon) ** 2
+            if best_distance is None or d < best_distance:
+                best = i
+                best_distance = d
+
+        if best is None:
+            return None
+        return self.ids[best]
+
+    def nearest_many(self, lats, lons):
+        """
+        Returns the id of the vertex closest to each point (lats[i],
+        lons[i]), as nearest does for one point.  With NumPy the distances
+        from a block of points to every vertex are computed at once.
+
+        >>> store = CoordinateStore({1: (0, 0), 2: (10, 10), 3: (10, -10)})
+        >>> store.nearest_many([9, 10, -50], [9, 0, -50])
+        [2, 1, 1]
+        >>> CoordinateStore().nearest_many([0], [0])
+        [None]
+        """
+        if len(lats) != len(lons):
+            raise ValueError("Different numbers of latitudes and longitudes")
+
+        if numpy is None or not len(self):
+            return [ self.nearest(lat, lon) for (lat, lon) in zip(lats, lons) ]
+
+        (lat, lon) = self.numpy_columns()
+        lats = numpy.asarray(lats, dtype = numpy.int64)
+        lons = numpy.asarray(lons, dtype = numpy.int64)
+
+        ids = self.ids
+        result = []
+        block = max(1, BLOCK_DISTANCES // len(self))
+        for first in range(0, len(lats), block):
+            d_lat = lats[first:first + block, None] - lat
+            d_lon = lons[first:first + block, None] - lon
+            # argmin takes the first of equals, the smallest id
+            closest = (d_lat * d_lat + d_lon * d_lon).argmin(axis = 1)
+            result.extend(ids[i] for i in closest.tolist())
+
+        return result
+
+    def numpy_columns(self):
+        """
+        Returns the lat and lon columns as NumPy int64 arrays, wide enough
+        to square differences in, made on first use.  NumPy must be
+        installed.
+        """
+        if self._numpy_columns is None:
+            self._numpy_columns = (numpy.array(self.lat, dtype = numpy.int64),
+                                   numpy.array(self.lon, dtype = numpy.int64))
+        return self._numpy_columns
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
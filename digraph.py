@@ -3,7 +3,14 @@ Graph module for undirected graphs.
 """
 
 import random
+import heapq
+import collections
 import math
+import array
+import bisect
+import codecs
+import gzip
+import io
 
 try:
     import display
@@ -28,6 +35,8 @@ class Digraph:
     def __init__(self, edges = None):
         self._tosets = {}
         self._fromsets = {}
+        self._weights = None
+        self._rweights = None
 
         if edges:
             for e in edges: self.add_edge(e)
@@ -48,6 +57,11 @@ class Digraph:
             self._tosets[v] = set()
             self._fromsets[v] = set()
 
+            # a vertex with no edges keeps the stored weights complete
+            if self._weights is not None:
+                self._weights[v] = {}
+                self._rweights[v] = {}
+
     def add_edge(self, e):
         """
         Adds an edge to graph.  If vertices in the edge do not exist, it adds them.
@@ -72,6 +86,10 @@ class Digraph:
         self._tosets[e[0]].add(e[1])
         self._fromsets[e[1]].add(e[0])
 
+        # Stored weights no longer cover every edge
+        self._weights = None
+        self._rweights = None
+
     def edges(self):
         """
         Returns the set of edges in the graph as ordered tuples.
@@ -117,6 +135,55 @@ class Digraph:
         """
         return self._tosets[v]
 
+    def set_weights(self, cost):
+        """
+        Computes the cost of every edge once and stores it alongside the
+        adjacency, for adj_to_weights and adj_from_weights.  Adding an
+        edge afterwards drops the stored weights.
+
+        >>> G = Digraph([(1, 2), (1, 3)])
+        >>> G.set_weights(lambda e: e[1] * 10)
+        >>> sorted(G.adj_to_weights(1))
+        [(2, 20), (3, 30)]
+
+        Adding a vertex keeps them, it has no edges to weigh
+        >>> G.add_vertex(4)
+        >>> (list(G.adj_to_weights(4)), least_cost_path(G, 4, 1))
+        ([], None)
+        >>> G.add_edge((2, 3))
+        >>> G.adj_to_weights(1)
+        Traceback (most recent call last):
+        ...
+        ValueError: Graph has no stored weights, call set_weights first
+        """
+        self._weights = { v: { w: cost((v, w)) for w in self._tosets[v] }
+                          for v in self._tosets }
+        self._rweights = { w: { u: self._weights[u][w] for u in self._fromsets[w] }
+                           for w in self._fromsets }
+
+    def adj_to_weights(self, v):
+        """
+        Returns (w, cost) pairs for the edges from v, using the weights
+        stored by set_weights.
+        """
+        if self._weights is None:
+            raise ValueError("Graph has no stored weights, call set_weights first")
+        return self._weights[v].items()
+
+    def adj_from_weights(self, v):
+        """
+        Returns (u, cost) pairs for the edges into v, using the weights
+        stored by set_weights.
+
+        >>> G = Digraph([(1, 3), (2, 3)])
+        >>> G.set_weights(lambda e: e[0] * 10)
+        >>> sorted(G.adj_from_weights(3))
+        [(1, 10), (2, 20)]
+        """
+        if self._rweights is None:
+            raise ValueError("Graph has no stored weights, call set_weights first")
+        return self._rweights[v].items()
+
     def adj_from(self, v):
         """
         Returns the set of vertices that contain an edge to v.
@@ -181,6 +248,327 @@ class Digraph:
         # If all edges are in list of graph edges, it is a path
         return True
 
+    def freeze(self, cost = None):
+        """
+        Returns a compact, unchangeable CSRDigraph copy of this graph.  If
+        cost is given, the cost of every edge is computed and stored.
+
+        >>> G = Digraph([(1, 2), (2, 3)])
+        >>> G.add_vertex(4)
+        >>> C = G.freeze()
+        >>> (C.vertices() == G.vertices(), C.edges() == G.edges())
+        (True, True)
+        """
+        return CSRDigraph(self.edges(), self.vertices(), cost)
+
+class CSRDigraph:
+    """
+    Frozen directed graph in compressed sparse row form.
+
+    Vertex ids are remapped to dense indices 0..n-1 in sorted id order.
+    The targets of the edges out of the vertex with index i are
+    _targets[_offsets[i]:_offsets[i+1]], stored as indices in a compact
+    array, and _sources/_roffsets hold the reversed edges the same way.
+    If a cost function is given, the cost of every edge is computed once
+    and kept in _weights, parallel to _targets.
+
+    It answers the same queries as Digraph, so it can be passed to
+    least_cost_path, shortest_path and spanning_tree, but it cannot be
+    changed once built.
+
+    >>> G = CSRDigraph([(1, 2), (2, 3), (3, 1)])
+    >>> (G.num_vertices(), G.num_edges())
+    (3, 3)
+    >>> G.adj_to(1)
+    [2]
+    >>> G.adj_from(1)
+    [3]
+
+    Build it from the output of graph_from_text, vertices with no edges
+    are kept:
+    >>> (vertices, edges) = graph_from_text("test.txt")
+    >>> G = CSRDigraph(edges, vertices, lambda e: 1.5)
+    >>> G.num_vertices()
+    3
+    >>> G.weight((276281417, 276281415))
+    1.5
+    >>> least_cost_path(G, 276281417, 276281423, G.weight)
+    [276281417, 276281423]
+    """
+
+    def __init__(self, edges = None, vertices = None, cost = None):
+        edges = list(edges or ())
+
+        ids = set(vertices or ())
+        for (v, w) in edges:
+            ids.add(v)
+            ids.add(w)
+
+        self._ids = array.array('q', sorted(ids))
+        self._index = { v: i for (i, v) in enumerate(self._ids) }
+
+        n = len(self._ids)
+        index = self._index
+        pairs = sorted({ (index[v], index[w]) for (v, w) in edges })
+
+        self._offsets, self._targets = _compress_rows(n, pairs)
+        self._roffsets, self._sources = _compress_rows(n,
+            sorted((w, v) for (v, w) in pairs))
+
+        self._weights = None
+        if cost is not None:
+            self.set_weights(cost)
+
+    @classmethod
+    def from_arrays(cls, ids, offsets, targets, roffsets, sources, weights = None):
+        """
+        Builds a CSRDigraph directly from the arrays returned by arrays(),
+        without copying them, so they can be memoryviews of a memory
+        mapped file.  ids must be sorted.  Vertex ids are found by binary
+        search over ids, so nothing is built up front.
+
+        >>> G = CSRDigraph([(1, 2), (2, 3)], cost = lambda e: 1)
+        >>> H = CSRDigraph.from_arrays(*G.arrays())
+        >>> (H.edges() == G.edges(), H.adj_to(2), H.adj_from(2), H.weight((2, 3)))
+        (True, [3], [1], 1.0)
+        """
+        G = cls.__new__(cls)
+        G._ids = ids
+        G._index = _SortedIndex(ids)
+        G._offsets = offsets
+        G._targets = targets
+        G._roffsets = roffsets
+        G._sources = sources
+        G._weights = weights
+
+        return G
+
+    def arrays(self):
+        """
+        Returns the arrays that make up the graph, in the order taken by
+        from_arrays: (ids, offsets, targets, roffsets, sources, weights).
+        """
+        return (self._ids, self._offsets, self._targets,
+                self._roffsets, self._sources, self._weights)
+
+    def __repr__(self):
+        return "CSRDigraph({}, {})".format(self.vertices(), self.edges())
+
+    def edges(self):
+        """
+        Returns the set of edges in the graph as ordered tuples.
+        """
+        ids = self._ids
+        return { (ids[i], ids[t]) for i in range(len(ids))
+                 for t in self._targets[self._offsets[i]:self._offsets[i+1]] }
+
+    def vertices(self):
+        """
+        Returns the set of vertices in the graph.
+        """
+        return set(self._ids)
+
+    def num_edges(self):
+        return len(self._targets)
+
+    def num_vertices(self):
+        """
+        Returns the number of vertices in the graph.
+        """
+        return len(self._ids)
+
+    def adj_to(self, v):
+        """
+        Returns the list of vertices that contain an edge from v.
+
+        >>> G = CSRDigraph([(1, 3), (1, 2)], vertices = [4])
+        >>> G.adj_to(1)
+        [2, 3]
+        >>> G.adj_to(4)
+        []
+        """
+        i = self._index[v]
+        ids = self._ids
+        return [ ids[t] for t in self._targets[self._offsets[i]:self._offsets[i+1]] ]
+
+    def adj_from(self, v):
+        """
+        Returns the list of vertices that contain an edge to v.
+
+        >>> G = CSRDigraph([(1, 3), (2, 3)])
+        >>> G.adj_from(3)
+        [1, 2]
+        """
+        i = self._index[v]
+        ids = self._ids
+        return [ ids[s] for s in self._sources[self._roffsets[i]:self._roffsets[i+1]] ]
+
+    def set_weights(self, cost):
+        """
+        Computes the cost of every edge once and stores it in an array
+        parallel to the edge targets.
+        """
+        ids = self._ids
+        offsets = self._offsets
+        self._weights = array.array('d',
+            (cost((ids[i], ids[t])) for i in range(len(ids))
+             for t in self._targets[offsets[i]:offsets[i+1]]))
+
+    def index(self, v):
+        """
+        Returns the dense index of vertex v, raising KeyError if v is not
+        in the graph.
+
+        >>> G = CSRDigraph([(10, 30), (30, 20)])
+        >>> (G.index(10), G.index(30), G.vertex(1))
+        (0, 2, 20)
+        """
+        return self._index[v]
+
+    def vertex(self, i):
+        """
+        Returns the id of the vertex with dense index i.
+        """
+        return self._ids[i]
+
+    def edge_position(self, e):
+        """
+        Returns the position of edge e in the targets array, which is also
+        its position in any per-edge array such as the weights.  Raises
+        KeyError if e is not an edge.
+
+        >>> G = CSRDigraph([(1, 2), (1, 3), (2, 3)])
+        >>> [ G.edge_position(e) for e in [(1, 2), (1, 3), (2, 3)] ]
+        [0, 1, 2]
+        >>> G.edge_position((3, 1))
+        Traceback (most recent call last):
+        ...
+        KeyError: (3, 1)
+        """
+        i = self._index[e[0]]
+        t = self._index.get(e[1])
+        (lo, hi) = (self._offsets[i], self._offsets[i+1])
+        k = bisect.bisect_left(self._targets, t, lo, hi) if t is not None else hi
+        if k == hi or self._targets[k] != t:
+            raise KeyError(e)
+
+        return k
+
+    def adj_to_weights(self, v):
+        """
+        Returns (w, cost) pairs for the edges from v, read from the stored
+        weights.
+
+        >>> G = CSRDigraph([(1, 2), (1, 3)], cost = lambda e: e[1] * 10)
+        >>> list(G.adj_to_weights(1))
+        [(2, 20.0), (3, 30.0)]
+        """
+        if self._weights is None:
+            raise ValueError("Graph has no stored weights, call set_weights first")
+
+        i = self._index[v]
+        (lo, hi) = (self._offsets[i], self._offsets[i+1])
+        ids = self._ids
+        return zip([ ids[t] for t in self._targets[lo:hi] ], self._weights[lo:hi])
+
+    def adj_from_weights(self, v):
+        """
+        Returns (u, cost) pairs for the edges into v, read from the stored
+        weights.
+
+        >>> G = CSRDigraph([(1, 3), (2, 3)], cost = lambda e: e[0] * 10)
+        >>> G.adj_from_weights(3)
+        [(1, 10.0), (2, 20.0)]
+        """
+        if self._weights is None:
+            raise ValueError("Graph has no stored weights, call set_weights first")
+
+        return [ (u, self._weights[self.edge_position((u, v))]) for u in self.adj_from(v) ]
+
+    def weight(self, e):
+        """
+        Returns the stored cost of edge e.  It can be passed as the cost
+        function to least_cost_path.
+
+        >>> G = CSRDigraph([(1, 2), (1, 3)], cost = lambda e: e[1] * 10)
+        >>> G.weight((1, 3))
+        30.0
+        >>> G.weight((2, 1))
+        Traceback (most recent call last):
+        ...
+        KeyError: (2, 1)
+        """
+        if self._weights is None:
+            raise ValueError("Graph has no stored weights, call set_weights first")
+
+        return self._weights[self.edge_position(e)]
+
+    def is_path(self, path):
+        """
+        Returns True if the list of vertices in the argument path are a
+        valid path in the graph.  Returns False otherwise.
+
+        >>> G = CSRDigraph([(1, 2), (2, 3)])
+        >>> (G.is_path([1, 2, 3]), G.is_path([3, 2]), G.is_path([]))
+        (True, False, False)
+        """
+        if len(path) == 0:
+            return False
+
+        return all( path[i+1] in self.adj_to(path[i]) for i in range(len(path)-1) )
+
+class _SortedIndex:
+    """
+    Maps a vertex id to its position in a sorted sequence of ids by binary
+    search.  Used in place of a dictionary when building one would cost
+    more than the lookups.
+
+    >>> index = _SortedIndex([3, 8, 20])
+    >>> (index[8], index.get(20), index.get(4))
+    (1, 2, None)
+    >>> index[4]
+    Traceback (most recent call last):
+    ...
+    KeyError: 4
+    """
+
+    def __init__(self, ids):
+        self._ids = ids
+
+    def get(self, v, default = None):
+        i = bisect.bisect_left(self._ids, v)
+        if i == len(self._ids) or self._ids[i] != v:
+            return default
+        return i
+
+    def __getitem__(self, v):
+        i = self.get(v)
+        if i is None:
+            raise KeyError(v)
+        return i
+
+    def __contains__(self, v):
+        return self.get(v) is not None
+
+def _compress_rows(n, pairs):
+    """
+    Given sorted (row, column) index pairs for n rows, returns the offsets
+    and columns arrays of their compressed sparse row form.
+
+    >>> (offsets, columns) = _compress_rows(3, [(0, 1), (0, 2), (2, 0)])
+    >>> (list(offsets), list(columns))
+    ([0, 2, 2, 3], [1, 2, 0])
+    """
+    offsets = array.array('i', [0]) * (n + 1)
+    for (row, _) in pairs:
+        offsets[row + 1] += 1
+    for i in range(n):
+        offsets[i + 1] += offsets[i]
+
+    columns = array.array('i', (column for (_, column) in pairs))
+
+    return (offsets, columns)
+
 def random_graph(n, m):
     """
     Make a random Digraph with n vertices and m edges.
@@ -231,9 +619,74 @@ def spanning_tree(G, start):
                 
     return T
 
-def shortest_path(G, source, dest):
+def strongly_connected_components(G):
+    """
+    Returns the strongly connected components of G as lists of vertices.
+    Two depth-first searches like spanning_tree's find them (Kosaraju's
+    algorithm): one along adj_to to order the vertices by when the search
+    finished with them, then one along adj_from from each vertex in the
+    reverse of that order, which visits exactly one component.
+
+    The components come out in topological order, so no edge goes from a
+    component to an earlier one.
+
+    >>> G = Digraph([(1, 2), (2, 1), (2, 3), (3, 4), (4, 3), (4, 5), (6, 6)])
+    >>> components = strongly_connected_components(G)
+    >>> [ sorted(c) for c in components if 6 not in c ]
+    [[1, 2], [3, 4], [5]]
+    >>> len(components)
+    4
     """
-    Returns the shortest path from vertex source to vertex dest.
+    # first search, vertices in the order their search finished
+    visited = set()
+    finished = []
+    for start in G.vertices():
+        if start in visited: continue
+
+        visited.add(start)
+        todo = [ (start, iter(G.adj_to(start))) ]
+        while todo:
+            (cur, neighbours) = todo[-1]
+            for n in neighbours:
+                if n not in visited:
+                    visited.add(n)
+                    todo.append((n, iter(G.adj_to(n))))
+                    break
+            else:
+                todo.pop()
+                finished.append(cur)
+
+    # second search, backwards along edges, one component at a time
+    visited = set()
+    components = []
+    for start in reversed(finished):
+        if start in visited: continue
+
+        visited.add(start)
+        component = []
+        todo = [ start ]
+        while todo:
+            cur = todo.pop()
+            component.append(cur)
+            for n in G.adj_from(cur):
+                if n not in visited:
+                    visited.add(n)
+                    todo.append(n)
+
+        components.append(component)
+
+    return components
+
+def shortest_path(G, source, dest, max_hops = None):
+    """
+    Returns the shortest path from vertex source to vertex dest, the one
+    with the fewest edges, or [] if there is none.  source may also be a
+    list or set of vertices, and the path then starts at whichever of them
+    is fewest edges from dest.  If max_hops is given, paths with more
+    edges than that are not looked for.
+
+    A breadth first search, O(V + E): each vertex is queued once, and the
+    search stops as soon as it reaches dest.
 
     >>> G = Digraph([(1, 2), (2, 3), (3, 4), (4, 5), (1, 6), (3, 6), (6, 7)])
     >>> path = shortest_path(G, 1, 7)
@@ -273,54 +726,85 @@ def shortest_path(G, source, dest):
     [1, 2, 3, 4]
     >>> G.is_path(path)
     True
-    
+
+    # Several sources, and a hop limit
+    >>> G = Digraph([(1, 2), (2, 3), (3, 4), (5, 4), (6, 5)])
+    >>> shortest_path(G, [1, 6], 4)
+    [6, 5, 4]
+    >>> shortest_path(G, 1, 4, max_hops = 2)
+    []
+    >>> shortest_path(G, 1, 4, max_hops = 3)
+    [1, 2, 3, 4]
+    """
+    if isinstance(source, (list, set)):
+        sources = source
+    else:
+        sources = [source]
+
+    (hops, parent) = hop_tree(G, sources, [dest], max_hops)
+    if dest not in hops:
+        return []
+
+    # follow the parents back to the source the path starts at
+    path = [dest]
+    while hops[path[-1]] > 0:
+        path.append(parent[path[-1]])
+    path.reverse()
+
+    return path
+
+def hop_tree(G, sources, targets = None, max_hops = None):
+    """
+    Runs a breadth first search from every vertex in sources at once and
+    returns (hops, parent): the number of edges from the nearest source to
+    each vertex reached, and its parent on a shortest path from there.
+
+    If targets is given, the search stops as soon as every target has been
+    reached, otherwise it reaches every vertex it can.  If max_hops is
+    given, vertices more edges than that from every source are not
+    reached.
+
+    >>> G = Digraph([(1, 2), (2, 3), (3, 4), (1, 5), (5, 4)])
+    >>> (hops, parent) = hop_tree(G, [1])
+    >>> sorted(hops.items())
+    [(1, 0), (2, 1), (3, 2), (4, 2), (5, 1)]
+    >>> parent[4]
+    5
+    >>> (hops, parent) = hop_tree(G, [2, 5], max_hops = 1)
+    >>> sorted(hops.items())
+    [(2, 0), (3, 1), (4, 1), (5, 0)]
     """
-    # Create a list to hold queue and a visited set to
-    # hold tuples (vertex, leading) where leading is the
-    # vertex that brought us to the vertex
-    queue = [source]
-    visited = [source]
-    shortest_path = []
+    hops = {}
     parent = {}
+    for s in sources:
+        hops[s] = 0
 
-    # If source = dest, return source
-    if source == dest:
-        return queue
+    remaining = None
+    if targets is not None:
+        remaining = set(targets) - hops.keys()
+        if not remaining:
+            return (hops, parent)
 
+    queue = collections.deque(hops)
     while queue:
-        # Grab oldest element of queue
-        v = queue[0]
-
-        # Find unvisited neigbours
-        for x in G.adj_to(v):
-
-            # First check if a neighbour is destination
-            if x == dest:
-
-                # Build the path we just found
-                cur_path = [dest, v]
-                cur = v
-                while source not in cur_path:
-                    cur_path.append(parent[cur])
-                    cur = parent[cur]
-                                
-                # Path is backwards, flip order
-                cur_path.reverse()
-
-                # If this is first path found, it is shortest so far
-                if len(shortest_path) == 0 or len(cur_path) < len(cur_path):
-                    shortest_path = cur_path
-
-            # If neighbour is not dest:
-            elif x not in visited:
-                visited.append(x)
-                queue.append(x)
-                parent[x] = v
-
-        # Remove v from queue
-        queue.remove(v)
-
-    return shortest_path
+        v = queue.popleft()
+        next_hops = hops[v] + 1
+        if max_hops is not None and next_hops > max_hops:
+            break
+
+        for w in G.adj_to(v):
+            if w in hops: continue
+
+            hops[w] = next_hops
+            parent[w] = v
+            queue.append(w)
+
+            if remaining is not None:
+                remaining.discard(w)
+                if not remaining:
+                    return (hops, parent)
+
+    return (hops, parent)
         
     
 def compress(walk):
@@ -348,8 +832,45 @@ def compress(walk):
 
 
 # Dijkstra's algorithm, least cost path from start to dest
-def least_cost_path(G, start, dest, cost):
+def least_cost_path(G, start, dest, cost = None, queue = "heap", stats = None,
+        heuristic = None, bidirectional = False, stream = False):
     """
+    Returns the least cost path from start to dest as a list of vertices,
+    or None if dest cannot be reached.
+
+    If cost is None the search reads the edge costs stored in G by
+    set_weights, without calling back into Python for each edge.
+    Otherwise cost is called with an edge (v, w) and returns the cost of
+    that edge, which is slower but allows any cost.
+
+    If heuristic is given the search runs as A*: heuristic(v) must return
+    a lower bound on the cost from v to dest that never decreases by more
+    than the cost of an edge (a consistent heuristic), such as the straight
+    line distance when costs are edge lengths.  The path found is still a
+    least cost path, but may be a different one when several tie.
+
+    queue selects the priority queue used to pick the next vertex:
+        "heap" -- binary heap with lazy deletion, O((V + E) log V)
+        "scan" -- linear scan over the unsettled vertices, O(V^2)
+    Both break ties between equal cost vertices in the order the vertices
+    were discovered, so they always return the same path.
+
+    If bidirectional is True, one search grows forward from start over
+    adj_to and another backward from dest over adj_from until they meet,
+    which settles about half as many vertices on long routes.  It needs the
+    heap queue and cannot be combined with a heuristic.
+
+    If stream is True the path is returned as an iterator over its
+    vertices, which hands out start as soon as the search is done rather
+    than after the whole path has been rebuilt.  To get the vertices in
+    order from the parent pointers the search runs backward, from dest
+    over adj_from, so a heuristic must then bound the cost from start to
+    v, and the path may be a different one when several tie.
+
+    If stats is a dictionary it is filled with search counters:
+    "settled" vertices, "relaxed" edges and "stale" queue entries that
+    were skipped.  The heap queue pushes an entry for every relaxed edge.
+
     >>> G = Digraph( [(1,2), (2,3)] )
     >>> s = least_cost_path(G, 1, 3, (lambda x: 1) )
     >>> G.is_path(s)
@@ -373,44 +894,538 @@ def least_cost_path(G, start, dest, cost):
     >>> s = least_cost_path(G, 1, 1, (lambda x:1) )
     >>> s == [1]
     True
+
+    # Both engines agree, even when there are ties
+    >>> G = Digraph( [(1,2), (1,3), (2,4), (3,4), (4,5), (1,5)] )
+    >>> least_cost_path(G, 1, 5, (lambda e: 2 if e == (1,5) else 1), "scan")
+    [1, 5]
+    >>> least_cost_path(G, 1, 5, (lambda e: 2 if e == (1,5) else 1), "heap")
+    [1, 5]
+    >>> least_cost_path(G, 1, 4, (lambda x: 1), "scan")
+    [1, 2, 4]
+    >>> least_cost_path(G, 1, 4, (lambda x: 1), "heap")
+    [1, 2, 4]
+
+    >>> stats = {}
+    >>> least_cost_path(G, 1, 4, (lambda x: 1), stats = stats)
+    [1, 2, 4]
+    >>> stats["settled"]
+    5
+
+    # A* with a heuristic settles fewer vertices
+    >>> least_cost_path(G, 1, 4, (lambda x: 1), stats = stats,
+    ...     heuristic = (lambda v: {1: 2, 2: 1, 3: 1, 4: 0, 5: 9}[v]))
+    [1, 2, 4]
+    >>> stats["settled"]
+    4
+
+    # Stored weights give the same answers as the callback
+    >>> G.set_weights(lambda e: 2 if e == (1,5) else 1)
+    >>> least_cost_path(G, 1, 5)
+    [1, 5]
+    >>> least_cost_path(G, 1, 4, queue = "scan")
+    [1, 2, 4]
+
+    # The bidirectional search finds paths of the same cost
+    >>> least_cost_path(G, 1, 5, bidirectional = True)
+    [1, 5]
+    >>> least_cost_path(G, 1, 4, (lambda x: 1), bidirectional = True) in ([1, 2, 4], [1, 3, 4])
+    True
+    >>> least_cost_path(G, 4, 1, (lambda x: 1), bidirectional = True)
+    >>> least_cost_path(G, 2, 2, (lambda x: 1), bidirectional = True)
+    [2]
+
+    # Streamed paths come out one vertex at a time
+    >>> s = least_cost_path(G, 1, 4, (lambda x: 1), stream = True)
+    >>> next(s)
+    1
+    >>> list(s)
+    [2, 4]
+    >>> least_cost_path(G, 4, 1, stream = True)
+    >>> list(least_cost_path(G, 1, 5, bidirectional = True, stream = True))
+    [1, 5]
+
+    >>> least_cost_path(G, 1, 4, (lambda x: 1), "pairing")
+    Traceback (most recent call last):
+    ...
+    ValueError: Unknown queue engine: pairing
+    """
+    if queue == "heap":
+        search = _dijkstra_heap
+    elif queue == "scan":
+        search = _dijkstra_scan
+    else:
+        raise ValueError("Unknown queue engine: {}".format(queue))
+
+    if stats is None:
+        stats = {}
+    stats["settled"] = 0
+    stats["relaxed"] = 0
+    stats["stale"] = 0
+
+    if bidirectional:
+        if queue != "heap" or heuristic is not None:
+            raise ValueError("The bidirectional search only supports the heap queue without a heuristic")
+        path = _dijkstra_bidirectional(G, start, dest, edge_costs(G, cost),
+                                       reverse_edge_costs(G, cost), stats)
+        if stream and path is not None:
+            return iter(path)
+        return path
+
+    if heuristic is None:
+        heuristic = _no_heuristic
+
+    if stream:
+        # the parents of the backward search lead from start towards dest
+        successor = search(G, dest, start, reverse_edge_costs(G, cost), stats, heuristic)
+        if successor is None:
+            return None
+        return follow_path(successor, start, dest)
+
+    parent = search(G, start, dest, edge_costs(G, cost), stats, heuristic)
+
+    # if dest was never reached, do not return a path
+    if parent is None:
+        return None
+
+    return extract_path(parent, start, dest)
+
+def least_cost_tree(G, start, cost = None, targets = None, stats = None):
+    """
+    Runs Dijkstra's algorithm from start and returns (distance, parent):
+    the least cost to each settled vertex and its parent on a least cost
+    path.  Use extract_path to read a path out of parent.
+
+    If targets is given, the search stops as soon as every target is
+    settled (or cannot be reached), otherwise it settles every vertex
+    reachable from start.  cost and stats are as for least_cost_path.
+
+    >>> G = Digraph( [(1,2), (2,3), (3,4), (1,3), (5,1)] )
+    >>> (distance, parent) = least_cost_tree(G, 1, lambda e: 1)
+    >>> sorted(distance.items())
+    [(1, 0), (2, 1), (3, 1), (4, 2)]
+    >>> extract_path(parent, 1, 4)
+    [1, 3, 4]
+    >>> (distance, parent) = least_cost_tree(G, 1, lambda e: 1, targets = [2])
+    >>> 4 in distance
+    False
+    """
+    if stats is None:
+        stats = {}
+
+    neighbours = edge_costs(G, cost)
+    remaining = set(targets) if targets is not None else None
+
+    distance = {start: 0}
+    order = {start: 0}
+    todo = [(0, 0, start)]
+    settled = {}
+    parent = {}
+    (relaxed, stale) = (0, 0)
+
+    while todo:
+        (total_distance, _, vertex_id) = heapq.heappop(todo)
+        if vertex_id in settled:
+            stale += 1
+            continue
+
+        settled[vertex_id] = total_distance
+        if remaining is not None:
+            remaining.discard(vertex_id)
+            if not remaining: break
+
+        for (neighbour, edge_cost) in neighbours(vertex_id):
+            if neighbour in settled: continue
+
+            new_distance = total_distance + edge_cost
+            if (neighbour not in distance) or (new_distance < distance[neighbour]):
+                if neighbour not in order:
+                    order[neighbour] = len(order)
+                distance[neighbour] = new_distance
+                parent[neighbour] = vertex_id
+                relaxed += 1
+                heapq.heappush(todo, (new_distance, order[neighbour], neighbour))
+
+    stats["settled"] = len(settled)
+    stats["relaxed"] = relaxed
+    stats["stale"] = stale
+
+    return (settled, parent)
+
+def extract_path(parent, start, dest):
+    """
+    Follows the parent pointers back from dest to start and returns
+    the path from start to dest.
+
+    >>> extract_path({2: 1, 3: 2}, 1, 3)
+    [1, 2, 3]
+    >>> extract_path({}, 1, 1)
+    [1]
+    """
+    path = [dest]
+    while path[-1] != start:
+        path.append(parent[path[-1]])
+
+    # path is backwards, flip it
+    path.reverse()
+
+    return path
+
+def follow_path(successor, start, dest):
+    """
+    Generates the path from start to dest by following successor
+    pointers, such as the parents of a search that ran backward from dest.
+
+    >>> list(follow_path({1: 2, 2: 3}, 1, 3))
+    [1, 2, 3]
+    >>> list(follow_path({}, 1, 1))
+    [1]
+    """
+    v = start
+    yield v
+    while v != dest:
+        v = successor[v]
+        yield v
+
+def edge_costs(G, cost = None):
+    """
+    Returns a function giving the (w, cost) pairs of the edges out of a
+    vertex.  If cost is None these are the weights stored in G, otherwise
+    cost is called on each edge.
+
+    >>> G = Digraph([(1, 2), (1, 3)])
+    >>> sorted(edge_costs(G, lambda e: e[1])(1))
+    [(2, 2), (3, 3)]
+    """
+    if cost is None:
+        return G.adj_to_weights
+
+    def neighbours(v):
+        return [ (w, cost((v, w))) for w in G.adj_to(v) ]
+
+    return neighbours
+
+def reverse_edge_costs(G, cost = None):
+    """
+    Returns a function giving the (u, cost) pairs of the edges into a
+    vertex.  If cost is None these are the weights stored in G, otherwise
+    cost is called on each edge.
+
+    >>> G = Digraph([(1, 3), (2, 3)])
+    >>> sorted(reverse_edge_costs(G, lambda e: e[0])(3))
+    [(1, 1), (2, 2)]
+    """
+    if cost is None:
+        return G.adj_from_weights
+
+    def neighbours(v):
+        return [ (u, cost((u, v))) for u in G.adj_from(v) ]
+
+    return neighbours
+
+def _no_heuristic(v):
+    """
+    The heuristic used for plain Dijkstra.
+    """
+    return 0
+
+def _dijkstra_scan(G, start, dest, neighbours, stats, heuristic):
+    """
+    Dijkstra's algorithm that finds the next vertex by scanning every
+    unsettled vertex.  neighbours(v) gives the (w, cost) pairs of the
+    edges out of v.  Returns the parent map, or None if dest was not
+    reached.
     """
     todo = {start: 0}
     visited = set()
     parent = {}
+    relaxed = 0
 
     while todo and dest not in visited:
         # get smallest from todo
-        (vertex_id,total_distance) = ( min(todo.items(), key = lambda i: i[1]) )
+        (vertex_id,total_distance) = ( min(todo.items(), key = lambda i: i[1] + heuristic(i[0])) )
         todo.pop(vertex_id)
         visited.add(vertex_id)
 
         # look for unvisited neighbours
-        for neighbours in G.adj_to(vertex_id):
-            if neighbours in visited: continue
-            
-            elif (neighbours not in todo) or (total_distance + cost((vertex_id,neighbours)) < todo[neighbours]):
-                todo[neighbours] = (total_distance + cost((vertex_id,neighbours)) )
-                parent[neighbours] = vertex_id
-                
-            else: pass
-		
+        for (neighbour, edge_cost) in neighbours(vertex_id):
+            if neighbour in visited: continue
+
+            distance = total_distance + edge_cost
+            if (neighbour not in todo) or (distance < todo[neighbour]):
+                todo[neighbour] = distance
+                parent[neighbour] = vertex_id
+                relaxed += 1
+
+    stats["settled"] += len(visited)
+    stats["relaxed"] += relaxed
 
-    # if dest was never reached, do not return a path
     if dest not in visited:
         return None
-    
-    # if there is a path, extract to dest
-    path = [dest]
-    while start not in path:
-        path.append(parent[vertex_id])
-        vertex_id = parent[vertex_id]
 
-    # path is backwards, flip it
-    path.reverse()
+    return parent
+
+def _dijkstra_heap(G, start, dest, neighbours, stats, heuristic):
+    """
+    Dijkstra's algorithm on a binary heap.  Instead of decreasing a key
+    we push a new entry and skip the stale ones when they are popped.
+    neighbours(v) gives the (w, cost) pairs of the edges out of v.
+
+    Heap entries are (distance + heuristic, discovery order, vertex), which
+    settles vertices in exactly the same order as _dijkstra_scan.  Returns
+    the parent map, or None if dest was not reached.
+    """
+    distance = {start: 0}
+    order = {start: 0}
+    todo = [(heuristic(start), 0, start)]
+    visited = set()
+    parent = {}
+    (relaxed, stale) = (0, 0)
+
+    while todo:
+        (_, _, vertex_id) = heapq.heappop(todo)
+
+        # stale entry, the vertex was already settled with a lower cost
+        if vertex_id in visited:
+            stale += 1
+            continue
+
+        total_distance = distance[vertex_id]
+
+        visited.add(vertex_id)
+        if vertex_id == dest:
+            break
+
+        for (neighbour, edge_cost) in neighbours(vertex_id):
+            if neighbour in visited: continue
+
+            new_distance = total_distance + edge_cost
+            if (neighbour not in distance) or (new_distance < distance[neighbour]):
+                if neighbour not in order:
+                    order[neighbour] = len(order)
+                distance[neighbour] = new_distance
+                parent[neighbour] = vertex_id
+                relaxed += 1
+                heapq.heappush(todo, (new_distance + heuristic(neighbour), order[neighbour], neighbour))
+
+    # counted in locals and stored once, so searches nobody counts cost less
+    stats["settled"] += len(visited)
+    stats["relaxed"] += relaxed
+    stats["stale"] += stale
+
+    if dest not in visited:
+        return None
+
+    return parent
+
+def _dijkstra_bidirectional(G, start, dest, forward, backward, stats):
+    """
+    Bidirectional Dijkstra.  forward(v) gives the (w, cost) pairs of the
+    edges out of v, backward(v) the (u, cost) pairs of the edges into v.
+
+    The side with the smaller queue key is expanded next.  Every edge
+    scanned into a vertex the other side has reached gives a candidate
+    path, and the search stops once the two smallest keys add up to at
+    least the best candidate, since no path through an unsettled vertex
+    can be cheaper.  Returns the path, or None if dest was not reached.
+    """
+    if start == dest:
+        stats["settled"] += 1
+        return [start]
+
+    distance = ({start: 0}, {dest: 0})
+    order = ({start: 0}, {dest: 0})
+    parent = ({}, {})
+    todo = ([(0, 0, start)], [(0, 0, dest)])
+    visited = (set(), set())
+    neighbours = (forward, backward)
+
+    best = None
+    meet = None
+    (relaxed, stale) = (0, 0)
+
+    while todo[0] and todo[1]:
+        if best is not None and todo[0][0][0] + todo[1][0][0] >= best:
+            break
+
+        side = 0 if todo[0][0][0] <= todo[1][0][0] else 1
+        (_, _, vertex_id) = heapq.heappop(todo[side])
+        if vertex_id in visited[side]:
+            stale += 1
+            continue
+
+        visited[side].add(vertex_id)
+
+        total_distance = distance[side][vertex_id]
+        other = distance[1 - side]
+
+        for (neighbour, edge_cost) in neighbours[side](vertex_id):
+            new_distance = total_distance + edge_cost
+
+            if neighbour in other and (best is None or new_distance + other[neighbour] < best):
+                best = new_distance + other[neighbour]
+                meet = (vertex_id, neighbour) if side == 0 else (neighbour, vertex_id)
+
+            if neighbour in visited[side]: continue
+            if (neighbour not in distance[side]) or (new_distance < distance[side][neighbour]):
+                if neighbour not in order[side]:
+                    order[side][neighbour] = len(order[side])
+                distance[side][neighbour] = new_distance
+                parent[side][neighbour] = vertex_id
+                relaxed += 1
+                heapq.heappush(todo[side], (new_distance, order[side][neighbour], neighbour))
+
+    stats["settled"] += len(visited[0]) + len(visited[1])
+    stats["relaxed"] += relaxed
+    stats["stale"] += stale
+
+    if meet is None:
+        return None
+
+    # the best path crosses from the forward to the backward tree on edge meet
+    (u, w) = meet
+    path = extract_path(parent[0], start, u)
+    while w != dest:
+        path.append(w)
+        w = parent[1][w]
+    path.append(dest)
 
     return path
 
-def graph_from_text(text_file):
+def read_graph(text_file, names = None, chunk_size = 1 << 20,
+               strict = False, degrees = False):
+    """
+    Reads a road file straight into a Digraph in one pass and returns
+    (graph, vertices), where vertices maps each vertex id to its (lat,
+    lon) in 100000ths of a degree, or in degrees as written in the file
+    if degrees is True.  Every vertex record becomes a vertex of the
+    graph, even one with no edges.
+
+    text_file is a file name or a file opened in binary mode.  It is read
+    in chunks of chunk_size bytes, and may be gzipped.  If names is a
+    dictionary, it is filled with the street name of each edge.  Lines
+    that are not vertex or edge records are skipped, unless strict is
+    True, when they raise an exception.
+
+    >>> names = {}
+    >>> (G, vertices) = read_graph("test.txt", names)
+    >>> vertices[276281417]
+    (5347700, -11359344)
+    >>> sorted(G.adj_to(276281417))
+    [276281415, 276281423]
+    >>> names[(276281417, 276281415)]
+    'Romaniuk Road NW'
+
+    # Lines split across chunks and gzipped files read the same
+    >>> import gzip, io
+    >>> with open("test.txt", "rb") as f:
+    ...     packed = io.BytesIO(gzip.compress(f.read()))
+    >>> read_graph(packed, chunk_size = 7)[1] == vertices
+    True
+
+    # Characters split across chunks are put back together
+    >>> text = 'V,1,53.5,-113.5\\nV,2,53.6,-113.5\\nE,1,2,"Rue Thérèse"\\n'
+    >>> names = {}
+    >>> (G, vertices) = read_graph(io.BytesIO(text.encode('utf-8')), names, chunk_size = 1)
+    >>> names[(1, 2)]
+    'Rue Thérèse'
+
+    # Strict reading refuses anything but vertex and edge records
+    >>> text = io.BytesIO(b'V,1,53.5,-113.5\\nX,1\\n')
+    >>> read_graph(text, degrees = True)[1]
+    {1: (53.5, -113.5)}
+    >>> read_graph(io.BytesIO(text.getvalue()), strict = True)
+    Traceback (most recent call last):
+    ...
+    Exception: Error: weird line |X,1|
+    """
+    G = Digraph()
+    tosets = G._tosets
+    fromsets = G._fromsets
+    vertices = {}
+    street_names = {}
+    floor = math.floor
+
+    for lines in _read_chunks(text_file, chunk_size):
+        for line in lines:
+            kind = line[:2]
+
+            if kind == "V,":
+                # got a vertex record
+                (_, v, lat, lon) = line.split(",")
+                v = int(v)
+
+                # lat and lon are integers that we floor and multiply by 100k
+                if degrees:
+                    vertices[v] = (float(lat), float(lon))
+                else:
+                    vertices[v] = (int(floor(float(lat) * 100000)), int(float(lon) * 100000))
+                if v not in tosets:
+                    tosets[v] = set()
+                    fromsets[v] = set()
+
+            elif kind == "E,":
+                # got an edge record, the name may hold commas
+                (_, v, w, name) = line.split(",", 3)
+                v = int(v)
+                w = int(w)
+
+                if v not in tosets or w not in tosets:
+                    G.add_vertex(v)
+                    G.add_vertex(w)
+                tosets[v].add(w)
+                fromsets[w].add(v)
+
+                if names is not None:
+                    # get rid of leading and trailing quote " chars around
+                    # name, and keep one copy of each street name
+                    name = name.rstrip().strip('"')
+                    names[(v, w)] = street_names.setdefault(name, name)
+
+            elif strict:
+                # weird input
+                raise Exception("Error: weird line |{}|".format(line.rstrip()))
+
+    return (G, vertices)
+
+def _read_chunks(text_file, chunk_size):
+    """
+    Generates the lines of a text file a chunk at a time, as lists of
+    strings.  Gzipped files are recognised by their first bytes.
+    """
+    source = open(text_file, 'rb') if isinstance(text_file, str) else text_file
+    if not hasattr(source, "peek"):
+        source = io.BufferedReader(source)
+
+    f = source
+    try:
+        if source.peek(2)[:2] == b"\x1f\x8b":
+            f = gzip.GzipFile(fileobj = source)
+
+        # a character may be split across chunks, the decoder holds on to
+        # its first bytes until the rest arrive
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        tail = ""
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                tail += decoder.decode(b"", final = True)
+                break
+            lines = (tail + decoder.decode(chunk)).split("\n")
+            tail = lines.pop()
+            yield lines
+        if tail:
+            yield [tail]
+    finally:
+        if f is not source:
+            f.close()
+        if isinstance(text_file, str):
+            source.close()
+        elif source is not text_file:
+            # leave the caller's file open
+            source.detach()
+
+def graph_from_text(text_file, names = None):
     """
     Makes a digraph from a provided text file.
     Put the file name in quotes when calling:
@@ -419,50 +1434,20 @@ def graph_from_text(text_file):
     Returns a tuple, the first tuple being vertices the second tuple being edges
     edge information: (first vertex, second vertex, cost)
 	vertex information (id, lat, long)
+
+    If names is a dictionary, it is filled with the street name of each edge.
+    read_graph builds the Digraph itself, which is quicker and smaller.
+
+    >>> names = {}
+    >>> (vertices, edges) = graph_from_text("test.txt", names)
+    >>> vertices[276281417]
+    (5347700, -11359344)
+    >>> names[(276281417, 276281415)]
+    'Romaniuk Road NW'
     """
-    # Open the file
-    file = open(text_file)
-    
-    edges = set()
-    
-    # Store vertices in a hash table, use to find cost
-    vertices = {}
+    (G, vertices) = read_graph(text_file, names)
 
-    for line in file:
-        # strip all trailing whitespace
-        line = line.rstrip()
-        fields = line.split(",")
-        type = fields[0]
-        
-        if type == 'V':
-            # got a vertex record
-            (id,lat,lon) = fields[1:]
-            
-            # vertex id's should be ints
-            id=int(id)
-            
-            # lat and lon are integers that we floor and multiply by 100k
-            lat=int(math.floor(float(lat) * 100000))
-            lon=int((float(lon) * 100000))
-            
-            vertices[id] = (lat, lon)
-
-        elif type == 'E':
-            # got an edge record
-            (start,stop,name) = fields[1:]
-
-            # vertices are ints
-            start=int(start)
-            stop=int(stop)
-
-            # get rid of leading and trailing quote " chars around name
-            name = name.strip('"')
-
-            individ_edge = (start, stop)
-            edges.add(individ_edge)
-        
-        
-    return (vertices, edges)
+    return (vertices, G.edges())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,529 @@
+"""
+    python3 frontend.py [ -s serial-port ]... [ --tcp host:port ] [ --unix path ]
+                        [ --workers n ] [ graph options ]
+
+Asyncio front end that serves many clients at once.  Clients can be
+attached on serial ports, or connect over TCP or a Unix socket, and all
+of them speak the same line protocol as server.py: a request line of
+four integers "lat lon lat lon", optionally followed by the client's map
+number for --simplify, answered by the number of points and one
+"lat lon" line per point.  Malformed requests, and lines that are not
+ASCII, get no answer, as in server.py.  A serial port that fails is
+closed and reported without stopping the other clients.  Each client can switch to the binary route frames of wire.py
+with a "PROTOCOL 1" line, or to chunked routes with "PROTOCOL 2".
+
+A "RELOAD" line from any client, or a SIGHUP, loads the graph again in a
+new pool of workers, which takes over once it is ready.
+
+Routes are computed in a pool of worker processes, each holding its own
+server.Server, so reading and writing never wait on a search and
+throughput grows with the number of cores.  Streamed routes come back
+from the workers a chunk at a time, down a pipe, and each chunk is sent
+on as soon as it arrives.  Loading the graph from a snapshot
+(--snapshot) lets the workers share its pages.
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import multiprocessing
+import os
+import signal
+import time
+
+import metrics
+import server
+import wire
+
+# the route server of each worker process
+_server = None
+
+def _start_worker(args):
+    global _server
+    if args.metrics:
+        # each worker writes its own metrics file, named after its pid
+        args = argparse.Namespace(**vars(args))
+        (root, extension) = os.path.splitext(args.metrics)
+        args.metrics = "%s.%d%s" % (root, os.getpid(), extension)
+    _server = server.Server(args, open_serial=False)
+
+def _resident_bytes():
+    """
+    Returns the memory resident in a worker process, once it has loaded
+    the graph.
+    """
+    return metrics.resident_bytes()
+
+def _route_lines(request):
+    """
+    Answers one request in a worker process, returning the lines to send
+    back or None for a malformed request.
+    """
+    try:
+        return _server.route_lines(request)
+    except (RuntimeError, TypeError):
+        return None
+    finally:
+        _server.dump_metrics()
+
+def _route_stream(request, chunks):
+    """
+    As _route_lines, but sends the lines of each chunk of a streamed
+    route down the pipe chunks as soon as the chunk is read out of the
+    search, and None once the answer is complete.  Nothing but None is
+    sent for a malformed request.
+    """
+    try:
+        try:
+            lines = []
+            pending = 0
+            for line in _server.route_stream(request):
+                lines.append(line)
+                if pending == 0:
+                    # the count line that starts a chunk, or the 0 that
+                    # ends the route
+                    pending = int(line)
+                else:
+                    pending -= 1
+                if pending == 0:
+                    chunks.send(lines)
+                    lines = []
+        except (RuntimeError, TypeError):
+            pass
+        chunks.send(None)
+    except BrokenPipeError:
+        # the client hung up and the front end stopped reading
+        pass
+    finally:
+        chunks.close()
+        _server.dump_metrics()
+
+def _route_frame(request):
+    """
+    As _route_lines, but returns a binary route frame.
+    """
+    try:
+        return _server.route_frame(request)
+    except (RuntimeError, TypeError):
+        return None
+    finally:
+        _server.dump_metrics()
+
+class Frontend:
+    """
+    Listens on every serial port and socket given in args and answers
+    requests from a pool of worker processes.
+
+    >>> args = parse_args(["-g", "test.txt", "--tcp", "127.0.0.1:0"])
+    >>> async def ask():
+    ...     frontend = Frontend(args, workers = 1)
+    ...     (listener,) = await frontend.start()
+    ...     port = listener.sockets[0].getsockname()[1]
+    ...     lines = await request_route("127.0.0.1", port, "5347700 -11359344 5347615 -11359341")
+    ...     await frontend.stop()
+    ...     return lines
+    >>> asyncio.run(ask())
+    ['2', '5347700 -11359344', '5347615 -11359341']
+
+    The same route in the binary protocol
+    >>> async def ask_binary():
+    ...     frontend = Frontend(args, workers = 1)
+    ...     (listener,) = await frontend.start()
+    ...     port = listener.sockets[0].getsockname()[1]
+    ...     route = await request_route("127.0.0.1", port,
+    ...                                 "5347700 -11359344 5347615 -11359341", binary = True)
+    ...     await frontend.stop()
+    ...     return route
+    >>> asyncio.run(ask_binary())
+    [(5347700, -11359344), (5347615, -11359341)]
+
+    Line noise is dropped and the client is still answered
+    >>> async def ask_after_noise():
+    ...     frontend = Frontend(args, workers = 1)
+    ...     (listener,) = await frontend.start()
+    ...     port = listener.sockets[0].getsockname()[1]
+    ...     (reader, writer) = await asyncio.open_connection("127.0.0.1", port)
+    ...     writer.write(b"\\xff\\xfe garbage\\n5347700 -11359344 5347615 -11359341\\n")
+    ...     count = await reader.readline()
+    ...     writer.close()
+    ...     await frontend.stop()
+    ...     return count
+    >>> asyncio.run(ask_after_noise())
+    b'2\\n'
+
+    Streamed routes are sent a chunk at a time, ending with a 0 chunk
+    >>> async def ask_stream():
+    ...     frontend = Frontend(args, workers = 1)
+    ...     (listener,) = await frontend.start()
+    ...     port = listener.sockets[0].getsockname()[1]
+    ...     (reader, writer) = await asyncio.open_connection("127.0.0.1", port)
+    ...     writer.write(b"PROTOCOL 2\\n5347700 -11359344 5347615 -11359341\\n")
+    ...     lines = [await reader.readline() for _ in range(5)]
+    ...     writer.close()
+    ...     await frontend.stop()
+    ...     return b"".join(lines).decode('ascii').split()
+    >>> asyncio.run(ask_stream())
+    ['PROTOCOL', '2', '2', '5347700', '-11359344', '5347615', '-11359341', '0']
+    """
+
+    def __init__(self, args, workers = None):
+        self.args = args
+        self.debug = args.verbose
+        self.workers = workers or os.cpu_count()
+        self.pool = self._new_pool()
+        self._reloading = None
+
+        # serial reads block, so each port gets its own thread
+        self.serial_threads = concurrent.futures.ThreadPoolExecutor(
+            max(1, len(args.serialports)))
+
+        self._listeners = []
+        self._serial_tasks = []
+        self._clients = {}
+
+    def _new_pool(self):
+        return concurrent.futures.ProcessPoolExecutor(
+            self.workers, initializer = _start_worker, initargs = (self.args,))
+
+    def start_reload(self):
+        """
+        Starts a reload in the background.  Returns False if one is
+        already under way.
+        """
+        if self._reloading is not None and not self._reloading.done():
+            return False
+        self._reloading = asyncio.ensure_future(self.reload())
+        return True
+
+    async def reload(self):
+        """
+        Loads the graph again in a new pool of workers, and sends requests
+        to it once one of its workers has loaded the graph.  Requests the
+        old workers already have are answered by them before they exit.
+        Returns True if it switched pools, False if the new workers could
+        not load the graph.
+
+        >>> async def reload():
+        ...     frontend = Frontend(parse_args(["-g", "test.txt"]), workers = 1)
+        ...     old = frontend.pool
+        ...     reloaded = await frontend.reload()
+        ...     await frontend.stop()
+        ...     return (reloaded, frontend.pool is not old)
+        >>> asyncio.run(reload())  # doctest: +ELLIPSIS
+        Reloading graph: test.txt
+        Reloaded graph in ...s, ...
+        (True, True)
+        """
+        print("Reloading graph: %s" % self.args.graphname)
+        started = time.perf_counter()
+        pool = self._new_pool()
+
+        loop = asyncio.get_running_loop()
+        try:
+            resident = await loop.run_in_executor(pool, _resident_bytes)
+        except concurrent.futures.process.BrokenProcessPool as error:
+            print("Reload failed, still using the old workers: %s" % error)
+            pool.shutdown(wait = False)
+            return False
+
+        (old, self.pool) = (self.pool, pool)
+        old.shutdown(wait = False)
+
+        seconds = time.perf_counter() - started
+        if resident is None:
+            print("Reloaded graph in %.2fs" % seconds)
+        else:
+            print("Reloaded graph in %.2fs, each new worker holds %.1f MB until the old ones exit"
+                  % (seconds, resident / 2 ** 20))
+        return True
+
+    async def answer(self, request):
+        """
+        Computes the answer to a request in the worker pool.
+        """
+        loop = asyncio.get_running_loop()
+        lines = await loop.run_in_executor(self.pool, _route_lines, request)
+        self.debug and print("request:", request, "->", lines and lines[0])
+        return lines
+
+    async def stream(self, request, send):
+        """
+        Computes a streamed route in the worker pool, passing each chunk
+        to the coroutine function send as soon as the worker has it.
+        """
+        (chunks, worker_end) = multiprocessing.Pipe(duplex = False)
+
+        def ended(future):
+            # a worker that dies sends no None of its own, and the worker's
+            # end of the pipe is only needed here until the worker is done
+            if not chunks.closed and (future.cancelled() or future.exception() is not None):
+                worker_end.send(None)
+            worker_end.close()
+
+        loop = asyncio.get_running_loop()
+        worker = loop.run_in_executor(self.pool, _route_stream, request, worker_end)
+        worker.add_done_callback(ended)
+
+        points = 0
+        try:
+            while True:
+                lines = await loop.run_in_executor(None, chunks.recv)
+                if lines is None:
+                    break
+                points += int(lines[0])
+                await send(_encode(lines))
+
+            await worker
+        finally:
+            chunks.close()
+        self.debug and print("request:", request, "->", points, "points streamed")
+
+    async def reply(self, request, protocol, send):
+        """
+        Answers a line from a client using protocol, passing the bytes to
+        send back to the coroutine function send, and returns the protocol
+        the client uses from then on.
+        """
+        negotiated = wire.negotiate(request)
+        if negotiated is not None:
+            await send(_encode([wire.negotiation_reply(negotiated)]))
+            return negotiated
+
+        if request == wire.RELOAD:
+            await send(_encode([wire.reload_reply(self.start_reload())]))
+            return protocol
+
+        if protocol == wire.BINARY:
+            loop = asyncio.get_running_loop()
+            frame = await loop.run_in_executor(self.pool, _route_frame, request)
+            self.debug and print("request:", request, "->", frame and len(frame), "bytes")
+            if frame is not None:
+                await send(frame)
+        elif protocol == wire.STREAM:
+            await self.stream(request, send)
+        else:
+            lines = await self.answer(request)
+            if lines:
+                await send(_encode(lines))
+
+        return protocol
+
+    async def start(self):
+        """
+        Starts listening on every socket and serial port, and returns the
+        socket servers.
+        """
+        if self.args.tcp:
+            (host, port) = self.args.tcp.rsplit(":", 1)
+            self._listeners.append(
+                await asyncio.start_server(self.serve_stream, host, int(port)))
+        if self.args.unix:
+            self._listeners.append(
+                await asyncio.start_unix_server(self.serve_stream, self.args.unix))
+
+        for port in self.args.serialports:
+            self._serial_tasks.append(asyncio.ensure_future(self.serve_serial(port)))
+
+        return self._listeners
+
+    async def stop(self):
+        """
+        Stops listening and shuts the worker pool down.
+        """
+        for listener in self._listeners:
+            listener.close()
+            await listener.wait_closed()
+
+        # hang up on the socket clients and let their handlers finish
+        for writer in self._clients.values():
+            writer.close()
+        await asyncio.gather(*self._clients, return_exceptions = True)
+
+        for task in self._serial_tasks:
+            task.cancel()
+        if self._reloading is not None:
+            await self._reloading
+        self.pool.shutdown()
+        self.serial_threads.shutdown(wait = False)
+
+    async def serve_forever(self):
+        # kill -HUP reloads the graph, like a RELOAD line from a client
+        if hasattr(signal, 'SIGHUP'):
+            asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, self.start_reload)
+
+        await self.start()
+        await asyncio.gather(*(listener.serve_forever() for listener in self._listeners),
+                             *self._serial_tasks)
+
+    async def serve_stream(self, reader, writer):
+        """
+        Serves one socket client until it disconnects.
+        """
+        self._clients[asyncio.current_task()] = writer
+        protocol = wire.ASCII
+
+        async def send(message):
+            writer.write(message)
+            await writer.drain()
+
+        try:
+            while True:
+                raw_message = await reader.readline()
+                if not raw_message:
+                    break
+
+                request = _decode(raw_message)
+                if request is None:
+                    continue
+
+                protocol = await self.reply(request, protocol, send)
+        except ConnectionError:
+            pass
+        finally:
+            del self._clients[asyncio.current_task()]
+            writer.close()
+
+    async def serve_serial(self, port, device = None):
+        """
+        Serves the client on one serial port, opened unless device, an
+        open port, is given.  If the port fails, for instance when the
+        device is unplugged, the failure is reported and only this client
+        stops.
+
+        >>> class Unplugged:
+        ...     def __init__(self):
+        ...         self.lines = [b"\\xff\\xfe garbage\\n", b"5347700 -11359344 5347615 -11359341\\n"]
+        ...         self.written = []
+        ...     def readline(self):
+        ...         if not self.lines:
+        ...             raise OSError("device disconnected")
+        ...         return self.lines.pop(0)
+        ...     def write(self, message):
+        ...         self.written.append(message)
+        ...     def close(self):
+        ...         pass
+        >>> async def serve():
+        ...     frontend = Frontend(parse_args(["-g", "test.txt"]), workers = 1)
+        ...     device = Unplugged()
+        ...     await frontend.serve_serial("/dev/ttyACM0", device)
+        ...     await frontend.stop()
+        ...     return device.written
+        >>> asyncio.run(serve())
+        Serial port /dev/ttyACM0 failed: device disconnected
+        [b'2\\n5347700 -11359344\\n5347615 -11359341\\n']
+        """
+        loop = asyncio.get_running_loop()
+        protocol = wire.ASCII
+
+        async def send(message):
+            await loop.run_in_executor(self.serial_threads, device.write, message)
+
+        try:
+            if device is None:
+                import serial
+
+                print("Opening serial port: %s" % port)
+                device = serial.Serial(port, 9600)
+        except OSError as error:
+            print("Serial port %s failed: %s" % (port, error))
+            return
+
+        try:
+            while True:
+                raw_message = await loop.run_in_executor(self.serial_threads, device.readline)
+                request = _decode(raw_message)
+                if request is None:
+                    continue
+
+                protocol = await self.reply(request, protocol, send)
+        except Exception as error:
+            # serial.SerialException is an OSError, anything else is a bug
+            # in serving this port, neither may stop the other clients
+            print("Serial port %s failed: %s" % (port, error))
+        finally:
+            device.close()
+
+async def request_route(host, port, request, binary = False):
+    """
+    Sends one request to a front end over TCP and returns the lines of the
+    answer.  If binary is True the route is asked for in the binary
+    protocol, and returned as a list of (lat, lon) points.
+    """
+    (reader, writer) = await asyncio.open_connection(host, port)
+    try:
+        if binary:
+            writer.write(_encode([wire.negotiation_reply(wire.BINARY), request]))
+            await writer.drain()
+
+            reply = (await reader.readline()).decode('ascii').rstrip("\r\n")
+            if wire.negotiate(reply) != wire.BINARY:
+                raise RuntimeError("Front end refused the binary protocol")
+
+            header = await reader.readexactly(2)
+            length = int.from_bytes(header, 'little')
+            return wire.decode_route(header + await reader.readexactly(length + 2))
+
+        writer.write(_encode([request]))
+        await writer.drain()
+
+        count = (await reader.readline()).decode('ascii').rstrip("\r\n")
+        lines = [count]
+        for _ in range(int(count)):
+            lines.append((await reader.readline()).decode('ascii').rstrip("\r\n"))
+        return lines
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+def _decode(raw_message):
+    """
+    Returns a request line without its line ending, or None if it is not
+    ASCII, as when a serial line picks up noise while a device resets.
+    """
+    try:
+        return raw_message.decode('ascii').rstrip("\r\n")
+    except UnicodeDecodeError:
+        return None
+
+def _encode(lines):
+    return "".join(line + "\n" for line in lines).encode('ascii')
+
+def parse_args(argv = None):
+    """
+    Parses arguments for this program.  Adds to the options of server.py:
+        serialports -- list of str
+        tcp         -- str, host:port
+        unix        -- str
+        workers     -- int
+    """
+    parser = argparse.ArgumentParser(
+        description = 'Serve map directions to many clients at once.')
+    parser.add_argument('-s', '--serial',
+                        help = 'path to a serial port, may be given more than once',
+                        dest = 'serialports',
+                        action = 'append',
+                        default = [])
+    parser.add_argument('--tcp',
+                        help = 'host:port to listen on for TCP clients',
+                        default = None)
+    parser.add_argument('--unix',
+                        help = 'path of a Unix socket to listen on',
+                        default = None)
+    parser.add_argument('--workers',
+                        help = 'number of route worker processes (DEFAULT = number of cores)',
+                        type = int,
+                        default = None)
+    server.add_route_arguments(parser)
+
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    if not (args.serialports or args.tcp or args.unix):
+        print("Nothing to serve.  Supply -s, --tcp or --unix")
+        exit()
+
+    frontend = Frontend(args, args.workers)
+    try:
+        asyncio.run(frontend.serve_forever())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,461 @@
+"""
+    python3 landmarks.py digraph-file [ landmark-file ] [ --count n ]
+                         [ --select farthest | avoid ] [ --queries n ]
+
+Landmarks for A* searches (ALT: A*, landmarks and the triangle inequality).
+
+A handful of landmark vertices are chosen, and Dijkstra's algorithm finds
+the least cost from each landmark to every vertex and from every vertex
+to each landmark.  By the triangle inequality, for any landmark L
+
+    cost(v, t) >= cost(L, t) - cost(L, v)
+    cost(v, t) >= cost(v, L) - cost(t, L)
+
+so the largest of these over the landmarks is a lower bound on the cost
+from v to t, and a consistent heuristic for least_cost_path.  It works
+for any edge costs, not just straight line lengths, and it is much
+cheaper to build than a contraction hierarchy: two searches per landmark.
+
+The tables are stored in 4 byte integers, in units of resolution.  Every
+edge cost is rounded down to a whole number of units before the searches,
+so the tables hold exact least costs for slightly cheaper edges and the
+bounds stay consistent.  Vertices a landmark cannot reach, or that cannot
+reach it, get UNREACHED, which makes the bound so large that vertices
+with no path to t are left until last.
+
+Landmarks are chosen by one of
+    "farthest" -- each landmark is the vertex farthest, there and back,
+                  from the landmarks chosen before it
+    "avoid"    -- each landmark is the leaf of the part of a shortest path
+                  tree that the landmarks so far bound worst (Goldberg and
+                  Werneck's avoid)
+both within the largest strongly connected component.
+
+Run as a script it reads a road file, chooses landmarks for the straight
+line edge costs the server uses and saves them to landmark-file (the road
+file name with ".landmarks" added if not given), then reports how many
+vertices Dijkstra, straight line A* and ALT settle on random requests.
+"""
+import argparse
+import array
+import heapq
+import os
+import random
+import struct
+import sys
+
+import digraph
+import snapshot
+
+MAGIC = b"LANDMRK\0"
+VERSION = 1
+
+# magic, version, vertices, landmarks, resolution, text sha256
+_HEADER = struct.Struct("<8sIIId32s")
+
+# table entry of a vertex with no path to or from a landmark
+UNREACHED = 2 ** 32 - 1
+
+COUNT = 16
+
+# landmarks used by each search, the ones with the best bounds at its ends
+ACTIVE = 4
+
+class Landmarks:
+    """
+    Landmarks over a graph and their distance tables.  If cost is None
+    the weights stored in G are used.  resolution must be a power of two,
+    so that bounds are exact multiples of it.
+
+    >>> G = digraph.Digraph([(1, 2), (2, 3), (3, 4), (4, 1), (2, 4)])
+    >>> cost = lambda e: {(2, 4): 5}.get(e, 1)
+    >>> L = Landmarks(G, 2, cost)
+    >>> len(L.landmarks)
+    2
+    >>> h = L.heuristic_to(1)
+    >>> [ h(v) for v in (1, 2, 3, 4) ]
+    [0.0, 3.0, 2.0, 1.0]
+    >>> digraph.least_cost_path(G, 2, 1, cost, heuristic = h)
+    [2, 3, 4, 1]
+
+    Bounds for searches that run backward, from dest towards start
+    >>> h = L.heuristic_from(1)
+    >>> [ h(v) for v in (1, 2, 3, 4) ]
+    [0.0, 1.0, 2.0, 3.0]
+    """
+
+    def __init__(self, G, count = COUNT, cost = None, select = "farthest",
+                 resolution = 0.125, seed = 0, active = ACTIVE):
+        self.resolution = resolution
+        self.active = active
+        self.landmarks = array.array('q')
+        self._forward = []
+        self._backward = []
+        self.checksum = bytes(32)
+
+        if G is None:
+            return
+
+        self.ids = array.array('q', sorted(G.vertices()))
+        self._index = { v: i for (i, v) in enumerate(self.ids) }
+        self.index = self._index.__getitem__
+
+        forward = digraph.edge_costs(G, cost)
+        backward = digraph.reverse_edge_costs(G, cost)
+        largest = max(digraph.strongly_connected_components(G), key = len, default = [])
+        rng = random.Random(seed)
+
+        if select == "farthest":
+            self._select_farthest(forward, backward, largest, count, rng)
+        elif select == "avoid":
+            self._select_avoid(forward, backward, largest, count, rng)
+        else:
+            raise ValueError("Unknown landmark selection {}".format(select))
+
+    def _add(self, landmark, forward, backward):
+        """
+        Makes landmark a landmark, computing its tables.
+        """
+        self.landmarks.append(landmark)
+        self._forward.append(self._distances(forward, landmark))
+        self._backward.append(self._distances(backward, landmark))
+
+    def _select_farthest(self, forward, backward, largest, count, rng):
+        """
+        Chooses each landmark as the vertex of largest whose least cost
+        there and back from the landmarks before it is greatest, starting
+        from the vertex farthest from a random one.
+        """
+        if not largest:
+            return
+
+        # least cost there and back from the landmarks chosen so far
+        closest = { v: None for v in largest }
+        start = rng.choice(largest)
+        tables = (self._distances(forward, start), self._distances(backward, start))
+
+        while len(self.landmarks) < count:
+            (to, back) = tables
+            for v in closest:
+                i = self.index(v)
+                d = to[i] + back[i]
+                if closest[v] is None or d < closest[v]:
+                    closest[v] = d
+
+            landmark = max(closest, key = closest.get)
+            if closest[landmark] == 0:
+                break
+
+            self._add(landmark, forward, backward)
+            tables = (self._forward[-1], self._backward[-1])
+
+    def _select_avoid(self, forward, backward, largest, count, rng):
+        """
+        Chooses each landmark from a least cost tree grown from a random
+        vertex of largest.  Each vertex is weighted by how far the
+        landmarks so far underestimate its cost from the root, and the new
+        landmark is found by walking down from the root into the heaviest
+        subtree that holds no landmark, to a leaf.
+        """
+        tries = 0
+        while len(self.landmarks) < count and tries < 4 * count:
+            tries += 1
+            root = rng.choice(largest)
+            parent = {}
+            order = []
+            cost = self._distances(forward, root, parent, order)
+
+            bound = self.heuristic_from(root)
+            size = {}
+            children = {}
+            blocked = set(self.landmarks)
+
+            # sizes of subtrees, leaves first, 0 for those holding a landmark
+            for v in reversed(order):
+                if v in blocked:
+                    size[v] = 0
+                else:
+                    size[v] = size.get(v, 0) + cost[self.index(v)] * self.resolution - bound(v)
+
+                if v in parent:
+                    p = parent[v]
+                    if v in blocked:
+                        blocked.add(p)
+                    size[p] = size.get(p, 0) + size[v]
+                    children.setdefault(p, []).append(v)
+
+            v = root
+            while v in children:
+                heaviest = max(children[v], key = lambda w: (size[w], -self.index(w)))
+                if size[heaviest] <= 0:
+                    break
+                v = heaviest
+
+            if v in blocked:
+                continue
+            self._add(v, forward, backward)
+
+    def _distances(self, neighbours, start, parent = None, order = None):
+        """
+        Runs Dijkstra's algorithm from start, with every edge cost rounded
+        down to a whole number of resolution units, and returns the least
+        cost to each vertex by its index, UNREACHED where there is no path.
+        If parent is a dictionary it is filled with each vertex's parent,
+        and if order is a list the vertices are appended to it as they are
+        settled.
+        """
+        ids = self.ids
+        index = self.index
+        resolution = self.resolution
+
+        table = array.array('I', [UNREACHED]) * len(ids)
+        settled = bytearray(len(ids))
+        first = index(start)
+        table[first] = 0
+        todo = [(0, first)]
+
+        while todo:
+            (d, i) = heapq.heappop(todo)
+            if settled[i]: continue
+            settled[i] = 1
+
+            v = ids[i]
+            if order is not None:
+                order.append(v)
+
+            for (w, c) in neighbours(v):
+                j = index(w)
+                new_distance = d + int(c // resolution)
+                if new_distance < table[j]:
+                    if new_distance >= UNREACHED:
+                        raise ValueError("Landmark distances do not fit in the tables, use a coarser resolution")
+                    table[j] = new_distance
+                    if parent is not None:
+                        parent[w] = v
+                    heapq.heappush(todo, (new_distance, j))
+
+        return table
+
+    def heuristic_to(self, dest, start = None):
+        """
+        Returns a function giving a lower bound on the cost from a vertex
+        to dest.  If start is given, only the active landmarks with the
+        best bounds at start are used, which makes each call quicker and
+        hardly loosens the bounds.
+        """
+        t = self.index(dest)
+        tables = [ (to, to[t], back, back[t]) for (to, back) in zip(self._forward, self._backward) ]
+
+        if start is not None and len(tables) > self.active:
+            s = self.index(start)
+            tables.sort(key = lambda table: -max(table[1] - table[0][s], table[2][s] - table[3]))
+            del tables[self.active:]
+
+        index = self.index
+        resolution = self.resolution
+
+        def heuristic(v):
+            i = index(v)
+            best = 0
+            for (to, to_t, back, back_t) in tables:
+                bound = to_t - to[i]
+                if bound > best:
+                    best = bound
+                bound = back[i] - back_t
+                if bound > best:
+                    best = bound
+            return best * resolution
+
+        return heuristic
+
+    def heuristic_from(self, start, dest = None):
+        """
+        Returns a function giving a lower bound on the cost from start to
+        a vertex, for searches that run backward from dest.  dest chooses
+        the active landmarks, as start does for heuristic_to.
+        """
+        s = self.index(start)
+        tables = [ (to, to[s], back, back[s]) for (to, back) in zip(self._forward, self._backward) ]
+
+        if dest is not None and len(tables) > self.active:
+            t = self.index(dest)
+            tables.sort(key = lambda table: -max(table[0][t] - table[1], table[3] - table[2][t]))
+            del tables[self.active:]
+
+        index = self.index
+        resolution = self.resolution
+
+        def heuristic(v):
+            i = index(v)
+            best = 0
+            for (to, to_s, back, back_s) in tables:
+                bound = to[i] - to_s
+                if bound > best:
+                    best = bound
+                bound = back_s - back[i]
+                if bound > best:
+                    best = bound
+            return best * resolution
+
+        return heuristic
+
+    def size(self):
+        """
+        Returns the number of bytes the distance tables take.
+        """
+        return sum(table.itemsize * len(table) for table in self._forward + self._backward)
+
+    def save(self, filename, text_file = None):
+        """
+        Writes the landmarks to a file, to be read back with load,
+        recording the SHA-256 of the road file text_file they were chosen
+        for if it is given.  The file is replaced in one step.
+
+        >>> import os, tempfile
+        >>> G = digraph.Digraph([(1, 2), (2, 3), (3, 1)])
+        >>> path = os.path.join(tempfile.mkdtemp(), "test.landmarks")
+        >>> Landmarks(G, 2, lambda e: 1).save(path)
+        >>> L = Landmarks.load(path)
+        >>> (list(L.landmarks), L.heuristic_to(1)(2))
+        ([1, 2], 2.0)
+        >>> L.close()
+        """
+        checksum = self.checksum
+        if text_file is not None:
+            checksum = snapshot.text_checksum(text_file)
+
+        header = _HEADER.pack(MAGIC, VERSION, len(self.ids), len(self.landmarks),
+                              self.resolution, checksum)
+
+        temporary = "%s.%d.tmp" % (filename, os.getpid())
+        with open(temporary, 'wb') as f:
+            snapshot.write_section(f, header)
+            for section in [self.ids, self.landmarks] + self._forward + self._backward:
+                snapshot.write_section(f, snapshot.little_endian(section).tobytes())
+        os.replace(temporary, filename)
+
+    @classmethod
+    def load(cls, filename, index = None):
+        """
+        Reads landmarks written by save through mmap, so processes on one
+        host share the tables.  index is a function from vertex id to its
+        position in sorted order, as for coordinates.CoordinateStore; if it
+        is None a dictionary is built.
+        """
+        if sys.byteorder != 'little':
+            raise RuntimeError("Landmarks can only be loaded on little endian hosts")
+
+        L = cls(None)
+        L._sections = snapshot.SectionReader(filename, _HEADER)
+        (magic, version, n, k, L.resolution, L.checksum) = L._sections.header
+        if magic != MAGIC:
+            raise ValueError("{} is not a landmark file".format(filename))
+        if version != VERSION:
+            raise ValueError("{} is landmark version {}, expected {}".format(
+                filename, version, VERSION))
+
+        take = L._sections.take
+        L.ids = take('q', n)
+        L.landmarks = take('q', k)
+        L._forward = [ take('I', n) for _ in range(k) ]
+        L._backward = [ take('I', n) for _ in range(k) ]
+
+        if index is None:
+            L._index = { v: i for (i, v) in enumerate(L.ids) }
+            index = L._index.__getitem__
+        L.index = index
+
+        return L
+
+    def is_current(self, text_file):
+        """
+        Returns True if the landmarks were chosen for the current contents
+        of text_file.
+        """
+        return self.checksum == snapshot.text_checksum(text_file)
+
+    def close(self):
+        """
+        Releases the memory map of landmarks read by load.
+        """
+        self._forward = self._backward = []
+        self._sections.close()
+
+def settled_report(G, L, queries, heuristic = None):
+    """
+    Runs each (start, dest) query with Dijkstra, with A* using
+    heuristic(dest) if it is given, and with the landmark heuristic, and
+    returns the total number of vertices each settled.
+
+    >>> G = digraph.Digraph([ (v, v + 1) for v in range(20) ] + [ (v + 1, v) for v in range(20) ])
+    >>> G.set_weights(lambda e: 1)
+    >>> report = settled_report(G, Landmarks(G, 2), [(5, 15), (12, 2)])
+    >>> (report['dijkstra'], report['alt'])
+    (35, 22)
+    """
+    report = { "dijkstra": 0, "alt": 0 }
+    if heuristic is not None:
+        report["astar"] = 0
+
+    stats = {}
+    for (start, dest) in queries:
+        digraph.least_cost_path(G, start, dest, stats = stats)
+        report["dijkstra"] += stats["settled"]
+
+        if heuristic is not None:
+            digraph.least_cost_path(G, start, dest, stats = stats, heuristic = heuristic(dest))
+            report["astar"] += stats["settled"]
+
+        digraph.least_cost_path(G, start, dest, stats = stats,
+                                heuristic = L.heuristic_to(dest, start))
+        report["alt"] += stats["settled"]
+
+    return report
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description = 'Choose landmarks for ALT searches over a road file.')
+    parser.add_argument('graphname', help = 'road file')
+    parser.add_argument('landmarkfile', nargs = '?', default = None,
+                        help = 'file to save the landmarks to (DEFAULT = road file name with ".landmarks" added)')
+    parser.add_argument('--count',
+                        help = 'number of landmarks (DEFAULT = {})'.format(COUNT),
+                        type = int,
+                        default = COUNT)
+    parser.add_argument('--select',
+                        help = 'how landmarks are chosen (DEFAULT = farthest)',
+                        choices = ['farthest', 'avoid'],
+                        default = 'farthest')
+    parser.add_argument('--queries',
+                        help = 'number of random requests to report on (DEFAULT = 100)',
+                        type = int,
+                        default = 100)
+
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    import time
+
+    import benchmark
+    import coordinates
+
+    args = parse_args()
+    landmark_file = args.landmarkfile or args.graphname + ".landmarks"
+
+    (G, vertices) = digraph.read_graph(args.graphname)
+    G.set_weights(coordinates.CoordinateStore(vertices).distance_cost())
+
+    began = time.perf_counter()
+    L = Landmarks(G, args.count, select = args.select)
+    seconds = time.perf_counter() - began
+    L.save(landmark_file, args.graphname)
+    print("Wrote {}, {} landmarks chosen in {:.1f}s, {:.1f} MB of tables".format(
+        landmark_file, len(L.landmarks), seconds, L.size() / 2 ** 20))
+
+    rng = random.Random(0)
+    ordered = sorted(vertices)
+    queries = [ (rng.choice(ordered), rng.choice(ordered)) for _ in range(args.queries) ]
+    report = settled_report(G, L, queries, benchmark.distance_heuristic(vertices))
+    for name in ("dijkstra", "astar", "alt"):
+        print("{:<10} {:>10.0f} vertices settled per request, {:.1f}x fewer than Dijkstra".format(
+            name, report[name] / len(queries), report["dijkstra"] / max(1, report[name])))
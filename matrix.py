@@ -0,0 +1,82 @@
+"""
+Travel cost matrices between sets of vertices.
+
+Rather than one least cost path search per (source, target) pair, each
+source gets a single Dijkstra search that stops once it has settled every
+target, so an N x M matrix costs N searches.  Sources are independent and
+can be spread over a pool of processes.
+"""
+
+import multiprocessing
+
+import digraph
+
+def one_to_many(G, source, targets, cost = None, paths = False):
+    """
+    Returns the least costs from source to each of targets, as a list in
+    the same order with None for unreachable targets.  If paths is True,
+    returns (costs, paths) where paths holds the least cost paths.  cost
+    is as for digraph.least_cost_path.
+
+    >>> G = digraph.Digraph([(1, 2), (2, 3), (1, 3), (4, 1)])
+    >>> one_to_many(G, 1, [3, 2, 4], lambda e: 5 if e == (1, 3) else 1)
+    [2, 1, None]
+    >>> one_to_many(G, 1, [3, 1], lambda e: 1, paths = True)
+    ([1, 0], [[1, 3], [1]])
+    """
+    (distance, parent) = digraph.least_cost_tree(G, source, cost, targets)
+
+    costs = [ distance.get(t) for t in targets ]
+    if not paths:
+        return costs
+
+    found = [ digraph.extract_path(parent, source, t) if t in distance else None
+              for t in targets ]
+    return (costs, found)
+
+def distance_matrix(G, sources, targets, cost = None, paths = False, processes = None):
+    """
+    Returns the matrix of least costs from every source to every target:
+    one row per source, one column per target, None where there is no
+    path.  If paths is True, returns (costs, paths) with the paths laid
+    out the same way.
+
+    If processes is more than 1 the sources are split over a pool of that
+    many worker processes.  The graph is sent to each worker once, and
+    cost must then be None (stored weights) or a function that can be
+    pickled, such as a module level function.
+
+    >>> G = digraph.Digraph([(1, 2), (2, 3), (3, 1)])
+    >>> G.set_weights(lambda e: 1)
+    >>> distance_matrix(G, [1, 2], [1, 2, 3])
+    [[0, 1, 2], [2, 0, 1]]
+    >>> distance_matrix(G, [1, 2], [1, 2, 3], processes = 2)
+    [[0, 1, 2], [2, 0, 1]]
+    >>> (costs, found) = distance_matrix(G, [3], [2], paths = True)
+    >>> found
+    [[[3, 1, 2]]]
+    """
+    sources = list(sources)
+    targets = list(targets)
+
+    if processes is None or processes <= 1 or len(sources) <= 1:
+        rows = [ one_to_many(G, s, targets, cost, paths) for s in sources ]
+    else:
+        with multiprocessing.Pool(processes, _start_worker, (G, targets, cost, paths)) as pool:
+            rows = pool.map(_worker_row, sources)
+
+    if not paths:
+        return rows
+
+    return ([ costs for (costs, _) in rows ], [ found for (_, found) in rows ])
+
+# each worker process keeps its own copy of the graph and targets
+_worker = None
+
+def _start_worker(G, targets, cost, paths):
+    global _worker
+    _worker = (G, targets, cost, paths)
+
+def _worker_row(source):
+    (G, targets, cost, paths) = _worker
+    return one_to_many(G, source, targets, cost, paths)
@@ -0,0 +1,186 @@
+"""
+Latency histograms and counters for the route server.
+
+The server times each stage of a request (parsing, snapping, the cache,
+the search, formatting the answer and the serial writes) into a
+histogram per stage, and adds up search counters such as the vertices
+settled.  Metrics can be written out in the Prometheus text format, for
+the node exporter's textfile collector, or as JSON.
+
+Instrumented code keeps a Metrics object, or None when metrics are off,
+and only reads the clock when it has one.
+"""
+
+import json
+import os
+import time
+
+# upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+PREFIX = "route_server"
+
+class Histogram:
+    """
+    Counts observations into buckets by upper bound, plus their sum.
+
+    >>> h = Histogram((1, 10))
+    >>> for value in (0.5, 3, 3, 50):
+    ...     h.observe(value)
+    >>> h.cumulative()
+    [(1, 1), (10, 3), ('+Inf', 4)]
+    >>> (h.count, h.sum)
+    (4, 56.5)
+    """
+
+    def __init__(self, buckets = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        i = 0
+        for bound in self.buckets:
+            if value <= bound:
+                break
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """
+        Returns (upper bound, observations at or below it) for every
+        bucket, ending with "+Inf".
+        """
+        result = []
+        total = 0
+        for (bound, n) in zip(self.buckets + ("+Inf",), self.counts):
+            total += n
+            result.append((bound, total))
+        return result
+
+class Metrics:
+    """
+    Per-stage latency histograms and counters.
+
+    >>> now = [0.0]
+    >>> m = Metrics(clock = lambda: now[0])
+    >>> started = m.clock()
+    >>> now[0] = 0.002
+    >>> m.observe("search", m.clock() - started)
+    >>> m.count("settled", 40)
+    >>> m.count("settled", 2)
+    >>> print(m.prometheus())  # doctest: +ELLIPSIS
+    # TYPE route_server_stage_seconds histogram
+    route_server_stage_seconds_bucket{stage="search",le="0.0001"} 0
+    ...
+    route_server_stage_seconds_bucket{stage="search",le="0.0025"} 1
+    ...
+    route_server_stage_seconds_bucket{stage="search",le="+Inf"} 1
+    route_server_stage_seconds_sum{stage="search"} 0.002
+    route_server_stage_seconds_count{stage="search"} 1
+    # TYPE route_server_settled_total counter
+    route_server_settled_total 42
+    <BLANKLINE>
+    >>> m.as_dict()["counters"]
+    {'settled': 42}
+    """
+
+    def __init__(self, buckets = LATENCY_BUCKETS, clock = time.perf_counter):
+        self.buckets = buckets
+        self.clock = clock
+        self.stages = {}
+        self.counters = {}
+
+    def observe(self, stage, seconds):
+        """
+        Records that stage took seconds.
+        """
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = Histogram(self.buckets)
+        histogram.observe(seconds)
+
+    def count(self, name, amount = 1):
+        """
+        Adds amount to the counter name.
+        """
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def prometheus(self):
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        if self.stages:
+            name = PREFIX + "_stage_seconds"
+            lines.append("# TYPE %s histogram" % name)
+            for (stage, histogram) in sorted(self.stages.items()):
+                for (bound, total) in histogram.cumulative():
+                    lines.append('%s_bucket{stage="%s",le="%s"} %d' % (name, stage, bound, total))
+                lines.append('%s_sum{stage="%s"} %r' % (name, stage, histogram.sum))
+                lines.append('%s_count{stage="%s"} %d' % (name, stage, histogram.count))
+
+        for (counter, value) in sorted(self.counters.items()):
+            name = "%s_%s_total" % (PREFIX, counter)
+            lines.append("# TYPE %s counter" % name)
+            lines.append("%s %r" % (name, value))
+
+        return "\n".join(lines) + "\n"
+
+    def as_dict(self):
+        """
+        Returns the metrics as a dictionary that can be written as JSON.
+        """
+        return {
+            "stages": { stage: { "count": h.count, "sum": h.sum,
+                                 "buckets": [ [str(bound), total] for (bound, total) in h.cumulative() ] }
+                        for (stage, h) in self.stages.items() },
+            "counters": dict(self.counters),
+            }
+
+    def dump(self, filename):
+        """
+        Writes the metrics to filename, as JSON if it ends in ".json" and
+        in the Prometheus format otherwise.  The file is replaced in one
+        step, so readers never see half of it.
+
+        >>> import tempfile
+        >>> m = Metrics()
+        >>> m.count("requests")
+        >>> path = os.path.join(tempfile.mkdtemp(), "metrics.json")
+        >>> m.dump(path)
+        >>> json.load(open(path))["counters"]
+        {'requests': 1}
+        """
+        if filename.endswith(".json"):
+            text = json.dumps(self.as_dict(), indent = 1, sort_keys = True)
+        else:
+            text = self.prometheus()
+
+        temporary = filename + ".tmp"
+        with open(temporary, 'w') as f:
+            f.write(text)
+        os.replace(temporary, filename)
+
+def resident_bytes():
+    """
+    Returns the memory this process has resident, in bytes, or None where
+    /proc is not available.
+
+    >>> size = resident_bytes()
+    >>> size is None or size > 0
+    True
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
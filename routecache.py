@@ -0,0 +1,116 @@
+"""
+Bounded least recently used cache for computed routes.
+
+Keys are the snapped (origin vertex, destination vertex) pairs, so every
+request that snaps to the same two vertices shares one entry.  Entries
+can also expire after a time to live.  The cache counts hits, misses,
+evictions and expirations so its effect can be watched.
+"""
+
+import collections
+import time
+
+class RouteCache:
+    """
+    LRU cache of routes.  A size of 0 turns caching off.  ttl is in
+    seconds, None means entries never expire.
+
+    >>> cache = RouteCache(2)
+    >>> cache.store((1, 2), [1, 5, 2])
+    >>> cache.lookup((1, 2))
+    (True, [1, 5, 2])
+    >>> cache.lookup((2, 1))
+    (False, None)
+
+    Storing a third route evicts the least recently used one.  Routes
+    with no path are cached too.
+    >>> cache.store((3, 4), None)
+    >>> cache.store((5, 6), [5, 6])
+    >>> cache.lookup((1, 2))
+    (False, None)
+    >>> cache.lookup((3, 4))
+    (True, None)
+    >>> sorted(cache.stats().items())
+    [('evictions', 1), ('expirations', 0), ('hits', 2), ('invalidations', 0), ('misses', 2), ('size', 2)]
+
+    Entries expire after the time to live
+    >>> now = [0]
+    >>> cache = RouteCache(10, ttl = 5, clock = lambda: now[0])
+    >>> cache.store((1, 2), [1, 2])
+    >>> now[0] = 6
+    >>> cache.lookup((1, 2))
+    (False, None)
+    >>> cache.stats()["expirations"]
+    1
+    """
+
+    def __init__(self, size = 256, ttl = None, clock = time.monotonic):
+        self.size = size
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = collections.OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, key):
+        """
+        Returns (True, route) if key is cached and fresh, otherwise
+        (False, None).  The route may itself be None when no path exists.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return (False, None)
+
+        (stored_at, route) = entry
+        if self.ttl is not None and self._clock() - stored_at > self.ttl:
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return (False, None)
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return (True, route)
+
+    def store(self, key, route):
+        """
+        Caches route under key, evicting the least recently used entry if
+        the cache is full.
+        """
+        if self.size <= 0:
+            return
+
+        self._entries[key] = (self._clock(), route)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last = False)
+            self.evictions += 1
+
+    def clear(self):
+        """
+        Drops every entry, for when the graph the routes came from changes.
+
+        >>> cache = RouteCache()
+        >>> cache.store((1, 2), [1, 2])
+        >>> cache.clear()
+        >>> (len(cache), cache.invalidations)
+        (0, 1)
+        """
+        self._entries.clear()
+        self.invalidations += 1
+
+    def stats(self):
+        """
+        Returns the cache counters as a dictionary.
+        """
+        return { "hits": self.hits, "misses": self.misses,
+                 "evictions": self.evictions, "expirations": self.expirations,
+                 "invalidations": self.invalidations, "size": len(self._entries) }
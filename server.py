@@ -1,7 +1,24 @@
 import digraph
+import spatial
+import snapshot
+import contraction
+import landmarks
+import chains
+import treecache
+import routecache
+import matrix
+import simplify
+import wire
+import metrics
+import coordinates
+import components
 from types import *
 import math
+import os
 import sys
+import signal
+import threading
+import time
 import serial
 import argparse
 
@@ -11,26 +28,287 @@ class Server:
 	one user-accessable member method: get_route.
 	"""
 
-	def __init__(self, args):
-		if args.serialport:
-			print("Opening serial port: %s" % args.serialport)
-			self.serial_out = self.serial_in =  serial.Serial(args.serialport, 9600)
-		else:
-			print("No serial port.  Supply one with the -s port option")
-			exit()
+	def __init__(self, args, open_serial=True):
+		"""
+		Loads the graph named in args.  Unless open_serial is False, also
+		opens the serial port in args.serialport, for front ends that talk
+		to their clients some other way.
+		"""
+		self.serial_out = self.serial_in = None
+		if open_serial:
+			if args.serialport:
+				print("Opening serial port: %s" % args.serialport)
+				self.serial_out = self.serial_in =  serial.Serial(args.serialport, 9600)
+			else:
+				print("No serial port.  Supply one with the -s port option")
+				exit()
 
 		if args.verbose:
 			self.debug = True
 		else:
 			self.debug = False
-		vertex_edge_tuple = digraph.graph_from_text(args.graphname)
-		self.vertices = vertex_edge_tuple[0]
-		self.edges = vertex_edge_tuple[1]
-		self.graph = digraph.Digraph(self.edges)
+
+		# A* is only used when the cost is the straight line distance,
+		# which is what makes the straight line heuristic admissible.
+		self.cost = self.cost_distance
+		self.search = args.search
+		self.hierarchy_file = args.hierarchy
+		self.landmark_file = args.landmarks
+		self.compress_chains = args.compress_chains
+
+		# Searches from origins used again are kept, to be resumed
+		self.tree_cache_size = args.tree_cache
+		self.tree_cache_vertices = args.tree_cache_vertices
+
+		# Requests are snapped into the largest strongly connected component,
+		# where every vertex can reach every other one
+		self.snap_largest = args.snap_largest
+
+		# Routes are cached by their snapped endpoints
+		self.route_cache = routecache.RouteCache(args.cache_size, args.cache_ttl)
+
+		# Routes are simplified to within this many pixels of the client's map
+		self.simplify = args.simplify
+		self.simplify_totals = {'routes': 0, 'points': 0, 'dropped': 0, 'seconds saved': 0.0}
+
+		# ASCII until the client asks for something else
+		self.protocol = wire.ASCII
+
+		# Stage timings and search counters, None when they are off
+		self.metrics = None
+		self.metrics_file = args.metrics
+		self.metrics_interval = args.metrics_interval
+		self._metrics_dumped = 0
+		if self.metrics_file:
+			self.metrics = metrics.Metrics()
+
+		# The files the graph is loaded from, again on a reload
+		self.graphname = args.graphname
+		self.snapshot_file = args.snapshot
+		self._reloading = None
+		self.last_reload = None
+
+		self.load_graph(args.graphname, args.snapshot)
+
+	def load_graph(self, graphname, snapshot_file=None):
+		"""
+		Loads the road graph and builds everything that depends on it: the
+		spatial index, the contraction hierarchy if one is used, and an
+		empty route cache.
+		"""
+		self._install(self._build_graph(graphname, snapshot_file))
+
+	def _build_graph(self, graphname, snapshot_file):
+		"""
+		Loads the road graph and everything that depends on it, and returns
+		them as a dictionary.  Nothing the server is using is changed, so
+		this can run while requests are answered from the loaded graph.
+		"""
+		loaded = {'snapshot': None}
+		if snapshot_file:
+			loaded['snapshot'] = self._load_snapshot(graphname, snapshot_file)
+			loaded['vertices'] = loaded['snapshot'].vertices
+			loaded['graph'] = loaded['snapshot'].graph
+		else:
+			(loaded['graph'], vertices) = digraph.read_graph(graphname)
+
+			# Coordinates are kept in columns rather than a dict of tuples
+			loaded['vertices'] = coordinates.CoordinateStore(vertices)
+			del vertices
+
+		# cost_distance and every stored weight come from this one function
+		loaded['distance_cost'] = loaded['vertices'].distance_cost()
+		if not snapshot_file:
+			# Compute every edge cost once, so searches never call cost_distance
+			loaded['graph'].set_weights(loaded['distance_cost'])
+
+		# Components let requests with no route be turned down without a search
+		loaded['components'] = components.ComponentIndex(loaded['graph'])
+		if self.debug:
+			print("%d strongly connected components, the largest has %d of %d vertices"
+					% (len(loaded['components']), max(loaded['components'].sizes, default=0),
+					len(loaded['vertices'])))
+
+		snap_to = loaded['vertices']
+		if self.snap_largest:
+			snap_to = snap_to.subset(loaded['components'].in_largest)
+		loaded['index'] = spatial.GridIndex(snap_to)
+
+		# Contraction hierarchies are built for the stored cost_distance weights
+		loaded['hierarchy'] = None
+		if self.search == "ch":
+			loaded['hierarchy'] = self._load_hierarchy(graphname, loaded)
+
+		# Landmarks are cheap enough to rebuild whenever the road file changes
+		loaded['landmarks'] = None
+		if self.search == "alt":
+			loaded['landmarks'] = self._load_landmarks(graphname, loaded)
+
+		# Searches skip the shape-only vertices along roads
+		loaded['chains'] = None
+		if self.compress_chains and self.search != "ch":
+			loaded['chains'] = chains.ChainGraph(loaded['graph'])
+			if self.debug:
+				print("Chains compressed the graph to %d of %d vertices"
+						% (loaded['chains'].graph.num_vertices(), len(loaded['vertices'])))
+
+		# The trees belong to this graph, so a reload starts with none
+		loaded['trees'] = None
+		if self.tree_cache_size > 0 and self.search != "ch":
+			loaded['trees'] = treecache.TreeCache(loaded['graph'], self.tree_cache_size,
+					self.tree_cache_vertices)
+
+		return loaded
+
+	def _load_hierarchy(self, graphname, loaded):
+		"""
+		Returns the hierarchy saved in the hierarchy file if it was built
+		for the current road file, and otherwise builds one for the stored
+		cost_distance weights and saves it there.
+		"""
+		if self.hierarchy_file and os.path.exists(self.hierarchy_file):
+			CH = contraction.ContractionHierarchy.load(self.hierarchy_file)
+			if CH.is_current(graphname):
+				return CH
+			print("Hierarchy file %s is out of date" % self.hierarchy_file)
+
+		print("Building contraction hierarchy, save one with contraction.py or --hierarchy to skip this")
+		CH = contraction.ContractionHierarchy(loaded['graph'])
+		if self.hierarchy_file:
+			CH.save(self.hierarchy_file, graphname)
+		return CH
+
+	def _load_landmarks(self, graphname, loaded):
+		"""
+		Returns the landmarks saved in the landmark file if they were
+		chosen for the current road file, and otherwise chooses them for
+		the stored cost_distance weights and saves them there.
+		"""
+		if self.landmark_file and os.path.exists(self.landmark_file):
+			L = landmarks.Landmarks.load(self.landmark_file, loaded['vertices'].index)
+			if L.is_current(graphname):
+				return L
+			L.close()
+			print("Landmark file %s is out of date" % self.landmark_file)
+
+		print("Choosing landmarks, save them with landmarks.py or --landmarks to skip this")
+		L = landmarks.Landmarks(loaded['graph'])
+		if self.landmark_file:
+			L.save(self.landmark_file, graphname)
+		return L
+
+	def _install(self, loaded):
+		"""
+		Switches to a graph from _build_graph.  The old snapshot is not
+		closed, routes still being streamed from it finish on it.
+		"""
+		self.snapshot = loaded['snapshot']
+		self.graph = loaded['graph']
+		self.vertices = loaded['vertices']
+		self._distance_cost = loaded['distance_cost']
+		self.index = loaded['index']
+		self.components = loaded['components']
+		self.hierarchy = loaded['hierarchy']
+		self.landmarks = loaded['landmarks']
+		self.chains = loaded['chains']
+		self.trees = loaded['trees']
+
+		# Cached routes belong to the old graph
+		self.route_cache.clear()
+
+	def reload(self):
+		"""
+		Starts loading the graph again, from the files it was loaded from,
+		in a background thread.  Requests are answered from the old graph
+		until finish_reload switches to the new one.  Returns False if a
+		reload is already under way.
+		"""
+		if self._reloading is not None:
+			return False
+
+		print("Reloading graph: %s" % self.graphname)
+		reloading = {'started': time.perf_counter(), 'resident': metrics.resident_bytes()}
+
+		def build():
+			try:
+				reloading['loaded'] = self._build_graph(self.graphname, self.snapshot_file)
+			except Exception as error:
+				reloading['error'] = error
+			reloading['finished'] = time.perf_counter()
+			reloading['peak'] = metrics.resident_bytes()
+
+		reloading['thread'] = threading.Thread(target=build, name="reload", daemon=True)
+		self._reloading = reloading
+		reloading['thread'].start()
+		return True
+
+	def finish_reload(self, wait=False):
+		"""
+		Switches to the reloaded graph if it is ready, or once it is if wait
+		is True, and reports how long the reload took and how much more
+		memory was resident while both graphs were loaded.  Called between
+		requests, so each request sees one graph.  Returns True if it
+		switched.
+		"""
+		reloading = self._reloading
+		if reloading is None:
+			return False
+		if wait:
+			reloading['thread'].join()
+		elif reloading['thread'].is_alive():
+			return False
+		self._reloading = None
+
+		seconds = reloading['finished'] - reloading['started']
+		if 'error' in reloading:
+			print("Reload failed after %.2fs, still using the old graph: %s"
+					% (seconds, reloading['error']))
+			self.metrics and self.metrics.count("reload_failures")
+			return False
+
+		self._install(reloading['loaded'])
+
+		overlap = None
+		if reloading['resident'] is not None and reloading['peak'] is not None:
+			overlap = reloading['peak'] - reloading['resident']
+		self.last_reload = {'seconds': seconds, 'overlap bytes': overlap}
+
+		if overlap is None:
+			print("Reloaded graph in %.2fs" % seconds)
+		else:
+			print("Reloaded graph in %.2fs, %.1f MB more resident while both were loaded"
+					% (seconds, overlap / 2 ** 20))
+		if self.metrics:
+			self.metrics.observe("reload", seconds)
+			self.metrics.count("reloads")
+
+		return True
+
+	def _load_snapshot(self, graphname, snapshot_file):
+		"""
+		Returns the graph loaded from a binary snapshot, compiling it from
+		graphname first if it is missing or was compiled from a different
+		file.  The snapshot weights are the cost_distance costs.
+		"""
+		loaded = None
+		if os.path.exists(snapshot_file):
+			loaded = snapshot.Snapshot(snapshot_file)
+			if os.path.exists(graphname) and not loaded.is_current(graphname):
+				print("Snapshot %s is out of date" % snapshot_file)
+				loaded.close()
+				loaded = None
+
+		if loaded is None:
+			print("Compiling snapshot: %s" % snapshot_file)
+			snapshot.compile_snapshot(graphname, snapshot_file)
+			loaded = snapshot.Snapshot(snapshot_file)
+
+		return loaded
 
 	def _parse_input(self, in_str):
 		"""
-		Takes a space separated list of 4 inputs. Inputs must be integers
+		Takes a space separated list of 4 inputs, optionally followed by the
+		number of the map the client is showing. Inputs must be integers
 
 		>>> S = Server(parse_args())
 		>>> result = S._parse_input("5365488 -11333914 5364727 -11335890")
@@ -42,6 +320,9 @@ class Server:
 		-11333914
 		>>> result['lon']['dest']
 		-11335890
+		>>> result['zoom']
+		>>> S._parse_input("5365488 -11333914 5364727 -11335890 3")['zoom']
+		3
 		>>> S._parse_input("1114")
 		Traceback (most recent call last):
 			...
@@ -54,9 +335,11 @@ class Server:
 
 		"""
 
+		started = self.metrics and self.metrics.clock()
+
 		split_string = in_str.split(' ')
 
-		if len(split_string) != 4:
+		if len(split_string) not in (4, 5):
 			raise RuntimeError('You must pass in 4 inputs')
 
 		# We want to change all strings to integers. If not, exceptions must be raised
@@ -69,7 +352,16 @@ class Server:
 			split_string[i] = int_cast
 				
 		input_dict = {'lat': {'orig': split_string[0], 'dest': split_string[2]}, 
-				'lon': {'orig': split_string[1], 'dest': split_string[3]}}
+				'lon': {'orig': split_string[1], 'dest': split_string[3]},
+				'zoom': None}
+
+		if len(split_string) == 5:
+			if not 0 <= split_string[4] < len(simplify.MAP_BOXES):
+				raise TypeError('Unknown map number')
+			input_dict['zoom'] = split_string[4]
+
+		if self.metrics:
+			self.metrics.observe("parse", self.metrics.clock() - started)
 
 		return input_dict
 
@@ -85,20 +377,42 @@ class Server:
 		85.05292469985967
 		>>> S = Server("edmonton-roads-digraph.txt")
 		"""
-		vertex_1_lat = self.vertices[e[0]][0]
-		vertex_1_lon = self.vertices[e[0]][1]
-		vertex_2_lat = self.vertices[e[1]][0]
-		vertex_2_lon = self.vertices[e[1]][1]
+		return self._distance_cost(e)
+
+	def heuristic_distance(self, dest):
+		"""
+		Returns a heuristic for A* searches to vertex dest: the straight
+		line distance from a vertex to dest.  It never overestimates the
+		cost of a route under cost_distance.
 
-		computed_lat = math.pow( math.fabs(vertex_1_lat - vertex_2_lat), 2)
-		computed_lon = math.pow( math.fabs(vertex_1_lon - vertex_2_lon), 2)
-		cost = math.sqrt( computed_lat + computed_lon )
-		return cost
+		>>> S = Server(parse_args())
+		>>> h = S.heuristic_distance(276281415)
+		>>> h(276281417) == S.cost_distance( (276281417,276281415) )
+		True
+		"""
+		(dest_lat, dest_lon) = self.vertices[dest]
+		index = self.vertices.index
+		lats = self.vertices.lat
+		lons = self.vertices.lon
+
+		def heuristic(v):
+			i = index(v)
+			d_lat = lats[i] - dest_lat
+			d_lon = lons[i] - dest_lon
+			return math.sqrt( d_lat * d_lat + d_lon * d_lon )
+
+		return heuristic
 
 	def send(self, serial_port, message):
 		"""
-		Sends a message back to the client device.
+		Sends a message back to the client device.  Lines are sent as
+		ASCII with a newline, bytes such as binary route frames as they are.
 		"""
+		if isinstance(message, bytes):
+			self.debug and print("server: %d byte frame" % len(message))
+			serial_port.write(message)
+			return
+
 		full_message = ''.join((str(message), "\n"))
 
 		(self.debug and
@@ -150,81 +464,535 @@ class Server:
 		S.get_route("5351621 -11337271 5344647 -11357049")
 
 		"""
-		input_dict = self._parse_input(in_str)
+		return self._route(self._parse_input(in_str))
+
+	def _route(self, input_dict):
+		"""
+		Returns the route for a parsed request, from the cache if it is there.
+		"""
+		(origin_vertex_id, dest_vertex_id) = self._snap(input_dict)
+
+		key = (origin_vertex_id, dest_vertex_id)
+		(found, path) = self.route_cache.lookup(key)
+		if not found:
+			path = self._find_route(origin_vertex_id, dest_vertex_id)
+			self.route_cache.store(key, path)
+
+		# callers get their own copy of a cached route
+		if path is not None:
+			path = list(path)
+
+		return path
+
+	def _snap(self, input_dict):
+		"""
+		Returns the vertices nearest the origin and destination of a request.
+		"""
+		started = self.metrics and self.metrics.clock()
 
-		origin_vertex_id = get_vertex_id(self.vertices, input_dict['lat']['orig'], 
+		origin_vertex_id = self.index.nearest(input_dict['lat']['orig'],
 				input_dict['lon']['orig'])
-		dest_vertex_id = get_vertex_id(self.vertices, input_dict['lat']['dest'],
+		dest_vertex_id = self.index.nearest(input_dict['lat']['dest'],
 				input_dict['lon']['dest'])
 
-		path = digraph.least_cost_path(self.graph, origin_vertex_id, dest_vertex_id, self.cost_distance)
-		
+		if self.metrics:
+			self.metrics.observe("snap", self.metrics.clock() - started)
+
+		return (origin_vertex_id, dest_vertex_id)
+
+	def route_lines(self, in_str):
+		"""
+		Answers a route request with the lines to send back: the number of
+		points, then "lat lon" for each point of the route.  With --simplify,
+		requests that name the client's map get the route simplified for it.
+
+		>>> S = Server(parse_args())
+		>>> S.route_lines("5344628 -11345124 5344596 -11345087")
+		['2', '5344628 -11345124', '5344596 -11345087']
+		"""
+		coordinates = self.route_coordinates(in_str)
+
+		if coordinates is None:
+			return ["0"]
+
+		started = self.metrics and self.metrics.clock()
+
+		lines = [str(len(coordinates))]
+		for (lat, lon) in coordinates:
+			lines.append(str(lat) + " " + str(lon))
+
+		if self.metrics:
+			self.metrics.observe("format", self.metrics.clock() - started)
+
+		return lines
+
+	def route_frame(self, in_str):
+		"""
+		Answers a route request with one binary frame, see wire.py.  A
+		route too long for one frame is answered with an empty frame, as
+		if there were no route, rather than ending the connection.  Both
+		this program and frontend.py answer binary requests here.
+
+		>>> S = Server(parse_args())
+		>>> frame = S.route_frame("5344628 -11345124 5344596 -11345087")
+		>>> wire.decode_route(frame)
+		[(5344628, -11345124), (5344596, -11345087)]
+		"""
+		coordinates = self.route_coordinates(in_str)
+
+		started = self.metrics and self.metrics.clock()
+		try:
+			frame = wire.encode_route(coordinates or [])
+		except ValueError:
+			print("Route of %d points is too long for one frame" % len(coordinates))
+			self.metrics and self.metrics.count("frames_too_long")
+			frame = wire.encode_route([])
+		if self.metrics:
+			self.metrics.observe("format", self.metrics.clock() - started)
+
+		return frame
+
+	def route_stream(self, in_str):
+		"""
+		Answers a route request with the lines of a streamed route, see
+		wire.py.  The search runs before this returns, but the lines are
+		generated as they are sent, so the first point goes out without
+		waiting for the rest of the route.  Simplified routes still need
+		the whole route first.
+
+		>>> S = Server(parse_args())
+		>>> list(S.route_stream("5344628 -11345124 5344596 -11345087"))
+		['2', '5344628 -11345124', '5344596 -11345087', '0']
+		"""
+		input_dict = self._parse_input(in_str)
+
+		if self.simplify is not None and input_dict['zoom'] is not None:
+			return wire.chunk_lines(self._coordinates(input_dict) or [])
+
+		path = self._route_stream(input_dict)
+		if path is None:
+			return wire.chunk_lines([])
+
+		vertices = self.vertices
+		return wire.chunk_lines(vertices[p] for p in path)
+
+	def _route_stream(self, input_dict):
+		"""
+		As _route, but returns an iterator over the route.  A route that
+		was not cached is cached once it has all been read.
+		"""
+		(origin_vertex_id, dest_vertex_id) = self._snap(input_dict)
+
+		key = (origin_vertex_id, dest_vertex_id)
+		(found, path) = self.route_cache.lookup(key)
+		if not found:
+			path = self._find_route(origin_vertex_id, dest_vertex_id, stream=True)
+			if path is None:
+				self.route_cache.store(key, None)
+			else:
+				return self._cache_streamed(key, path, self.route_cache.invalidations)
+
+		if path is None:
+			return None
+		return iter(path)
+
+	def _cache_streamed(self, key, path, invalidations):
+		"""
+		Passes the vertices of path on, and caches the route at the end,
+		unless the cache has been cleared for a new graph since the search.
+		"""
+		route = []
+		for v in path:
+			route.append(v)
+			yield v
+		if self.route_cache.invalidations == invalidations:
+			self.route_cache.store(key, route)
+
+	def route_coordinates(self, in_str):
+		"""
+		Returns the (lat, lon) points of the route for a request, simplified
+		for the client's map with --simplify, or None if there is no route.
+		"""
+		return self._coordinates(self._parse_input(in_str))
+
+	def _coordinates(self, input_dict):
+		"""
+		route_coordinates for a parsed request.
+		"""
+		path = self._route(input_dict)
+
+		if path is None:
+			return None
+
+		coordinates = self.vertices.path_coordinates(path)
+		if self.simplify is not None and input_dict['zoom'] is not None:
+			coordinates = self._simplify(coordinates, input_dict['zoom'])
+		return coordinates
+
+	def dump_metrics(self, force=False):
+		"""
+		Writes the metrics file, with the route and tree cache counters added, if
+		metrics are on and metrics_interval seconds have passed since the
+		last time or force is True.
+		"""
+		if not self.metrics:
+			return
+
+		now = self.metrics.clock()
+		if not force and now - self._metrics_dumped < self.metrics_interval:
+			return
+		self._metrics_dumped = now
+
+		for (name, value) in self.route_cache.stats().items():
+			if name != "size":
+				self.metrics.counters["cache_" + name] = value
+		if self.trees is not None:
+			for (name, value) in self.trees.stats().items():
+				if name != "size":
+					self.metrics.counters["tree_cache_" + name] = value
+		self.metrics.dump(self.metrics_file)
+
+	def answer(self, in_str):
+		"""
+		Returns the messages that answer a line from the client: the reply
+		to a protocol negotiation or a reload, or the route in the protocol
+		in use.
+
+		>>> S = Server(parse_args())
+		>>> S.answer("PROTOCOL 1")
+		['PROTOCOL 1']
+		>>> (frame,) = S.answer("5344628 -11345124 5344596 -11345087")
+		>>> len(wire.decode_route(frame))
+		2
+		"""
+		protocol = wire.negotiate(in_str)
+		if protocol is not None:
+			self.protocol = protocol
+			return [wire.negotiation_reply(protocol)]
+
+		if in_str == wire.RELOAD:
+			return [wire.reload_reply(self.reload())]
+
+		if self.protocol == wire.BINARY:
+			return [self.route_frame(in_str)]
+		if self.protocol == wire.STREAM:
+			return self.route_stream(in_str)
+		return self.route_lines(in_str)
+
+	def _simplify(self, coordinates, zoom):
+		"""
+		Simplifies route coordinates for map zoom, adding up the points
+		dropped and the serial transfer time that saves, in the metrics
+		too if they are kept.
+
+		>>> S = Server(parse_args())
+		>>> S.simplify = 1.0
+		>>> route = [(5350000, -11350000), (5350010, -11349000), (5350000, -11348000)]
+		>>> S._simplify(route, 0)
+		[(5350000, -11350000), (5350000, -11348000)]
+		>>> S.simplify_totals['dropped']
+		1
+		>>> S.metrics = metrics.Metrics()
+		>>> len(S._simplify(route, 0))
+		2
+		>>> S.metrics.counters['simplify_points_dropped']
+		1
+		"""
+		simplified = simplify.simplify_route(coordinates, zoom, self.simplify)
+
+		before = simplify.transfer_seconds(["%d %d" % c for c in coordinates])
+		after = simplify.transfer_seconds(["%d %d" % c for c in simplified])
+
+		self.simplify_totals['routes'] += 1
+		self.simplify_totals['points'] += len(coordinates)
+		self.simplify_totals['dropped'] += len(coordinates) - len(simplified)
+		self.simplify_totals['seconds saved'] += before - after
+
+		if self.metrics:
+			self.metrics.count("simplify_points_dropped", len(coordinates) - len(simplified))
+			self.metrics.count("simplify_seconds_saved", before - after)
+
+		if self.debug:
+			print("Simplified route from %d to %d points, %.3fs less to send"
+					% (len(coordinates), len(simplified), before - after))
+
+		return simplified
+
+	def snap_many(self, points):
+		"""
+		Returns the vertices nearest each of a list of (lat, lon) points,
+		snapping them all at once.
+		"""
+		started = self.metrics and self.metrics.clock()
+
+		vertices = self.index.nearest_many([ lat for (lat, _) in points ],
+				[ lon for (_, lon) in points ])
+
+		if self.metrics:
+			self.metrics.observe("snap", self.metrics.clock() - started)
+
+		return vertices
+
+	def get_matrix(self, origins, dests, paths=False, processes=None):
+		"""
+		Returns the matrix of route costs from every origin to every
+		destination, each given as a (lat, lon) pair.  Rows are origins,
+		columns destinations, None where there is no route.  If paths is
+		True, returns (costs, paths) with the vertex paths as well.
+		processes spreads the origins over a process pool.
+		"""
+		sources = self.snap_many(origins)
+		targets = self.snap_many(dests)
+
+		cost = None
+		if self.cost != self.cost_distance:
+			cost = self.cost
+
+		return matrix.distance_matrix(self.graph, sources, targets, cost,
+				paths=paths, processes=processes)
+
+	def _find_route(self, origin_vertex_id, dest_vertex_id, stream=False):
+		"""
+		Runs the configured search between two vertices.  If stream is
+		True returns an iterator over the route instead of a list.
+		"""
+		if not self.metrics:
+			return self._search(origin_vertex_id, dest_vertex_id, stream, None)
+
+		stats = {}
+		started = self.metrics.clock()
+		path = self._search(origin_vertex_id, dest_vertex_id, stream, stats)
+		self.metrics.observe("search", self.metrics.clock() - started)
+
+		self.metrics.count("searches")
+		for (name, value) in stats.items():
+			self.metrics.count(name, value)
+
+		return path
+
+	def _search(self, origin_vertex_id, dest_vertex_id, stream, stats):
+		"""
+		_find_route, filling in the search counters in stats.
+		"""
+		# Vertices in components with no path between them need no search
+		if self.components.reachable(origin_vertex_id, dest_vertex_id) is False:
+			if stats is not None:
+				stats['unreachable'] = 1
+			return None
+
+		if self.hierarchy is not None:
+			path = self.hierarchy.least_cost_path(origin_vertex_id, dest_vertex_id, stats)
+			if stream and path is not None:
+				return iter(path)
+			return path
+
+		# Repeated origins resume the Dijkstra search kept from before
+		if self.trees is not None and self.cost == self.cost_distance:
+			path = self.trees.least_cost_path(origin_vertex_id, dest_vertex_id, stats)
+			if stream and path is not None:
+				return iter(path)
+			return path
+
+		# streamed searches run backward, towards the origin
+		heuristic = None
+		if self.search == "astar" and self.cost == self.cost_distance:
+			heuristic = self.heuristic_distance(origin_vertex_id if stream else dest_vertex_id)
+		elif self.landmarks is not None and self.cost == self.cost_distance:
+			if stream:
+				heuristic = self.landmarks.heuristic_from(origin_vertex_id, dest_vertex_id)
+			else:
+				heuristic = self.landmarks.heuristic_to(dest_vertex_id, origin_vertex_id)
+
+		bidirectional = (self.search == "bidirectional")
+
+		# Chain edges cost the sum of the cost_distance costs along them,
+		# the path found is expanded back into every vertex
+		if self.chains is not None and self.cost == self.cost_distance:
+			return self.chains.least_cost_path(origin_vertex_id, dest_vertex_id,
+					stats=stats, heuristic=heuristic, bidirectional=bidirectional,
+					stream=stream)
+
+		# The stored weights are the cost_distance costs, any other cost
+		# function is called for each edge instead.
+		cost = None
+		if self.cost != self.cost_distance:
+			cost = self.cost
+
+		path = digraph.least_cost_path(self.graph, origin_vertex_id, dest_vertex_id,
+				cost, stats=stats, heuristic=heuristic,
+				bidirectional=bidirectional, stream=stream)
 
 		return path
 		
 		
 def get_vertex_id(vertex_dict, lat, lon):
 	"""
+	Returns the id of the vertex closest to (lat, lon) by checking every
+	vertex.  Ties go to the smaller id, the same as spatial.GridIndex, which
+	the server uses instead of this.  vertex_dict may be a dictionary or a
+	coordinates.CoordinateStore.
+
+	>>> get_vertex_id({1: (0, 0), 2: (10, 10), 3: (10, -10)}, 9, 9)
+	2
+	>>> get_vertex_id({3: (10, -10), 2: (10, 10)}, 10, 0)
+	2
+	>>> get_vertex_id(coordinates.CoordinateStore({3: (10, -10), 2: (10, 10)}), 10, 0)
+	2
+	"""
+	return get_vertex_ids(vertex_dict, [lat], [lon])[0]
 
+def get_vertex_ids(vertex_dict, lats, lons):
 	"""
-	distances = { }
-	for id, value in vertex_dict.items():
-		computed_lat = math.pow( math.fabs(lat - value[0]), 2)
-		computed_lon = math.pow( math.fabs(lon - value[1]), 2)
-		cost = math.sqrt( computed_lat + computed_lon )
-		distances[cost] = id
-	
-	return distances[min(distances)]
+	Returns the id of the vertex closest to each point (lats[i], lons[i]),
+	as get_vertex_id does for one point.  The distances to every vertex
+	are computed for many points at once when NumPy is installed.
 
+	>>> get_vertex_ids({1: (0, 0), 2: (10, 10), 3: (10, -10)}, [9, 10], [9, -9])
+	[2, 3]
+	"""
+	if not isinstance(vertex_dict, coordinates.CoordinateStore):
+		vertex_dict = coordinates.CoordinateStore(vertex_dict)
 
+	return vertex_dict.nearest_many(lats, lons)
 
-if __name__ == "__main__":
-	def parse_args():
-		"""
-		Parses arguments for this program.
-		Returns an object with the following members:
-			args.
-				 serialport -- str
-				 verbose    -- bool
-				 graphname  -- str
-		"""
-
-		parser = argparse.ArgumentParser(
-			description='Assignment 1: Map directions.',
-			epilog = 'If SERIALPORT is not specified, stdin/stdout are used.')
-		parser.add_argument('-s', '--serial',
-							help='path to serial port',
-							dest='serialport',
-							default=None)
-		parser.add_argument('-v', dest='verbose',
-							help='verbose',
-							action='store_true')
-		parser.add_argument('-g', '--graph',
-							help='path to graph (DEFAULT = "edmonton-roads-2.0.1.txt")',
-							dest='graphname',
-							default='edmonton-roads-2.0.1.txt')
-
-		return parser.parse_args()
 
+def add_route_arguments(parser):
+	"""
+	Adds the arguments that control graph loading and routing to an
+	argparse parser, for this program and the other front ends.
+	"""
+	parser.add_argument('-v', dest='verbose',
+						help='verbose',
+						action='store_true')
+	parser.add_argument('-g', '--graph',
+						help='path to graph (DEFAULT = "edmonton-roads-2.0.1.txt")',
+						dest='graphname',
+						default='edmonton-roads-2.0.1.txt')
+	parser.add_argument('--search',
+						help='search algorithm (DEFAULT = astar)',
+						dest='search',
+						choices=['astar', 'dijkstra', 'bidirectional', 'ch', 'alt'],
+						default='astar')
+	parser.add_argument('--snapshot',
+						help='path to a binary graph snapshot, compiled from the graph if missing or out of date',
+						dest='snapshot',
+						default=None)
+	parser.add_argument('--hierarchy',
+						help='contraction hierarchy file for --search ch, built and written if missing or out of date',
+						dest='hierarchy',
+						default=None)
+	parser.add_argument('--landmarks',
+						help='landmark file for --search alt, chosen and written if missing or out of date',
+						dest='landmarks',
+						default=None)
+	parser.add_argument('--compress-chains',
+						help='search a graph with runs of degree 2 vertices collapsed into single edges',
+						dest='compress_chains',
+						action='store_true')
+	parser.add_argument('--snap-largest-component',
+						help='snap requests only to vertices in the largest strongly connected component',
+						dest='snap_largest',
+						action='store_true')
+	parser.add_argument('--cache-size',
+						help='number of routes to cache, 0 to turn caching off (DEFAULT = 256)',
+						dest='cache_size',
+						type=int,
+						default=256)
+	parser.add_argument('--tree-cache',
+						help='number of origins whose Dijkstra searches are kept and resumed, in place of --search, 0 to turn it off (DEFAULT = 0)',
+						dest='tree_cache',
+						type=int,
+						default=0)
+	parser.add_argument('--tree-cache-vertices',
+						help='vertices the kept searches may hold between them (DEFAULT = 1000000)',
+						dest='tree_cache_vertices',
+						type=int,
+						default=1000000)
+	parser.add_argument('--cache-ttl',
+						help='seconds a cached route stays valid (DEFAULT = forever)',
+						dest='cache_ttl',
+						type=float,
+						default=None)
+	parser.add_argument('--simplify',
+						help='drop route points within this many pixels of the client map (DEFAULT = off)',
+						dest='simplify',
+						type=float,
+						default=None)
+	parser.add_argument('--metrics',
+						help='file to write stage timings and search counters to, as JSON if it ends in .json and Prometheus text otherwise (DEFAULT = off)',
+						dest='metrics',
+						default=None)
+	parser.add_argument('--metrics-interval',
+						help='seconds between writes of the metrics file (DEFAULT = 10)',
+						dest='metrics_interval',
+						type=float,
+						default=10)
+
+def parse_args():
+	"""
+	Parses arguments for this program.
+	Returns an object with the following members:
+		args.
+			 serialport -- str
+			 verbose    -- bool
+			 graphname  -- str
+			 search     -- str
+			 snapshot   -- str
+			 hierarchy  -- str
+			 landmarks  -- str
+			 compress_chains -- bool
+			 snap_largest -- bool
+			 cache_size -- int
+			 cache_ttl  -- float
+			 tree_cache -- int
+			 tree_cache_vertices -- int
+			 simplify   -- float
+			 metrics    -- str
+			 metrics_interval -- float
+	"""
+
+	parser = argparse.ArgumentParser(
+		description='Assignment 1: Map directions.',
+		epilog = 'If SERIALPORT is not specified, stdin/stdout are used.')
+	parser.add_argument('-s', '--serial',
+						help='path to serial port',
+						dest='serialport',
+						default=None)
+	add_route_arguments(parser)
+
+	return parser.parse_args()
+
+
+if __name__ == "__main__":
 	S = Server(parse_args())
+
+	# kill -HUP reloads the graph, like a RELOAD line from the client
+	if hasattr(signal, 'SIGHUP'):
+		signal.signal(signal.SIGHUP, lambda signum, frame: S.reload())
+
 	while True:
 		in_msg = S.receive(S.serial_in)
+		S.finish_reload()
+		started = S.metrics and S.metrics.clock()
+		# malformed requests are dropped, as frontend.py does
 		try:
-			path = S.get_route(in_msg)
-		except RuntimeError:
+			messages = S.answer(in_msg)
+		except (RuntimeError, TypeError):
+			S.metrics and S.metrics.count("bad_requests")
 			continue
 
-		if path is None:
-			path_length = 0
-		else:
-			path_length = len(path)
-		S.send(S.serial_out, path_length)
-		for p in path:
-			S.send(S.serial_out, str(self.vertices[p][0]) + " " + str(self.vertices[p][1]))
+		answered = S.metrics and S.metrics.clock()
+		for message in messages:
+			S.send(S.serial_out, message)
+
+		if S.metrics:
+			S.metrics.observe("answer", answered - started)
+			S.metrics.observe("send", S.metrics.clock() - answered)
+			S.metrics.count("requests")
+			S.dump_metrics()
 
 
 	"""user_in = input('Enter the four co-ordinates [quit to kill everything] \n')
 	while not user_in == "quit":
 		S.get_route(user_in)		
 		user_in = input('Enter the four co-ordinates [quit to kill everything] \n')"""
-
@@ -0,0 +1,346 @@
+"""
+    python3 serverbench.py [ -g digraph-file | --grid n | --random n m ]
+                           [ -n queries ] [ --seed seed ] [ --search engine ]
+                           [ -o results.json ] [ --compare old-results.json ]
+
+Reproducible benchmark of the work the route server does.
+
+The graph is loaded with digraph.read_graph and the load time and
+the memory the loaded graph holds are measured.  Without a road file a
+synthetic city grid, or a digraph.random_graph with random coordinates
+in the city's box, is written out and loaded the same way, so the
+benchmark runs without the Edmonton data.
+
+Two seeded workloads are then run: "random" requests between points
+near random vertices, and "worst" requests from the south west corner of
+the city to the north east one.  Each request is timed in stages as the
+server runs it: snapping both ends to vertices, the search, and
+formatting the answer as ASCII lines and as a binary frame.
+
+Results are written as JSON to results.json (serverbench.json by
+default), so runs can be compared across commits with --compare.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import benchmark
+import coordinates
+import digraph
+import spatial
+import wire
+
+# city box in the server's units, for random_graph coordinates
+SOUTH_WEST = (5339316, -11373047)
+NORTH_EAST = (5364464, -11332397)
+
+def random_city(n, m, seed = 0):
+    """
+    Returns (vertices, edges) of digraph.random_graph(n, m) with each
+    vertex placed at random in the city's box.
+
+    >>> (vertices, edges) = random_city(20, 40)
+    >>> (len(vertices), len(edges))
+    (20, 40)
+    >>> random_city(20, 40) == (vertices, edges)
+    True
+    """
+    # random_graph draws from the random module itself
+    random.seed(seed)
+    G = digraph.random_graph(n, m)
+
+    rng = random.Random(seed)
+    vertices = { v: (rng.randint(SOUTH_WEST[0], NORTH_EAST[0]),
+                     rng.randint(SOUTH_WEST[1], NORTH_EAST[1]))
+                 for v in sorted(G.vertices()) }
+    return (vertices, set(G.edges()))
+
+def write_graph(vertices, edges, text_file):
+    """
+    Writes a graph in the road file format read by digraph.read_graph.
+    """
+    with open(text_file, 'w') as f:
+        for (v, (lat, lon)) in sorted(vertices.items()):
+            # a little over the value, so read_graph floors back to it
+            f.write("V,{},{:.7f},{:.7f}\n".format(v, (lat + 0.01) / 100000, lon / 100000))
+        for (v, w) in sorted(edges):
+            f.write('E,{},{},"Street"\n'.format(v, w))
+
+def load_graph(text_file):
+    """
+    Loads a road file the way the server does, returning (graph,
+    vertices, index, seconds, bytes): the time it takes and the memory
+    the loaded graph, its weights and the spatial index hold.
+
+    >>> (G, vertices, index, seconds, size) = load_graph("test.txt")
+    >>> (G.num_vertices(), G.num_edges(), size > 0)
+    (3, 2, True)
+    """
+    def load():
+        (G, vertices) = digraph.read_graph(text_file)
+        G.set_weights(coordinates.CoordinateStore(vertices).distance_cost())
+        return (G, vertices, spatial.GridIndex(vertices))
+
+    began = time.perf_counter()
+    load()
+    seconds = time.perf_counter() - began
+
+    # load again to measure memory, tracemalloc slows everything down
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    (G, vertices, index) = load()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    return (G, vertices, index, seconds, size)
+
+def random_queries(vertices, n, seed = 0, jitter = 50):
+    """
+    Returns n requests (lat, lon, lat, lon) between points within jitter
+    of random vertices.
+
+    >>> queries = random_queries({1: (0, 0), 2: (100, 100)}, 3, jitter = 0)
+    >>> queries == random_queries({1: (0, 0), 2: (100, 100)}, 3, jitter = 0)
+    True
+    >>> all(q[:2] in ((0, 0), (100, 100)) for q in queries)
+    True
+    """
+    rng = random.Random(seed)
+    ordered = sorted(vertices)
+
+    def near():
+        (lat, lon) = vertices[rng.choice(ordered)]
+        return (lat + rng.randint(-jitter, jitter), lon + rng.randint(-jitter, jitter))
+
+    return [ near() + near() for _ in range(n) ]
+
+def worst_queries(vertices, n, seed = 0):
+    """
+    Returns n requests across the whole city, south west to north east.
+    """
+    return [ vertices[o] + vertices[d]
+             for (o, d) in benchmark.cross_city_queries(vertices, n, seed) ]
+
+def run_workload(G, vertices, index, queries, search = "astar"):
+    """
+    Runs requests through the server's stages and returns the seconds
+    each stage took per request, as a dictionary of lists, with the
+    vertices settled and route lengths.
+
+    >>> (G, vertices, index, _, _) = load_graph("test.txt")
+    >>> result = run_workload(G, vertices, index, [(5347700, -11359344, 5347615, -11359341)])
+    >>> sorted(result)
+    ['ascii', 'binary', 'points', 'search', 'settled', 'snap']
+    >>> result['points']
+    [2]
+    """
+    heuristic_to = benchmark.distance_heuristic(vertices)
+    result = { stage: [] for stage in ("snap", "search", "ascii", "binary", "settled", "points") }
+    stats = {}
+    clock = time.perf_counter
+
+    for (lat1, lon1, lat2, lon2) in queries:
+        began = clock()
+        origin = index.nearest(lat1, lon1)
+        dest = index.nearest(lat2, lon2)
+        snapped = clock()
+
+        heuristic = heuristic_to(dest) if search == "astar" else None
+        path = digraph.least_cost_path(G, origin, dest, stats = stats, heuristic = heuristic,
+                                       bidirectional = (search == "bidirectional"))
+        searched = clock()
+
+        coordinates = [ vertices[v] for v in path ] if path is not None else []
+        lines = [str(len(coordinates))]
+        for (lat, lon) in coordinates:
+            lines.append(str(lat) + " " + str(lon))
+        formatted = clock()
+
+        wire.encode_route(coordinates)
+        encoded = clock()
+
+        result["snap"].append(snapped - began)
+        result["search"].append(searched - snapped)
+        result["ascii"].append(formatted - searched)
+        result["binary"].append(encoded - formatted)
+        result["settled"].append(stats["settled"])
+        result["points"].append(len(coordinates))
+
+    return result
+
+def time_snapping(index, queries):
+    """
+    Returns the seconds per point it takes to snap both ends of every
+    request one at a time with nearest and all at once with nearest_many.
+
+    >>> (G, vertices, index, _, _) = load_graph("test.txt")
+    >>> (one, many) = time_snapping(index, [(5347700, -11359344, 5347615, -11359341)])
+    >>> one > 0 and many > 0
+    True
+    """
+    lats = [ lat for q in queries for lat in (q[0], q[2]) ]
+    lons = [ lon for q in queries for lon in (q[1], q[3]) ]
+    clock = time.perf_counter
+
+    began = clock()
+    for (lat, lon) in zip(lats, lons):
+        index.nearest(lat, lon)
+    one = clock() - began
+
+    began = clock()
+    index.nearest_many(lats, lons)
+    many = clock() - began
+
+    return (one / len(lats), many / len(lats))
+
+def summarise(values):
+    """
+    Returns the count, mean, median, 90th and 99th percentiles and
+    maximum of a list of numbers.
+
+    >>> summarise([4, 1, 3, 2])
+    {'count': 4, 'mean': 2.5, 'median': 2, 'p90': 4, 'p99': 4, 'max': 4}
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return { "count": 0 }
+
+    def percentile(p):
+        # nearest rank
+        return ordered[max(0, -(-len(ordered) * p // 100) - 1)]
+
+    return { "count": len(ordered), "mean": sum(ordered) / len(ordered),
+             "median": percentile(50), "p90": percentile(90),
+             "p99": percentile(99), "max": ordered[-1] }
+
+def git_commit():
+    """
+    Returns the commit of the working tree, or None outside of git.
+    """
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+            cwd = os.path.dirname(os.path.abspath(__file__)),
+            stderr = subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, old):
+    """
+    Prints the median of each stage next to the one in old results.
+    """
+    print("{:<8} {:<8} {:>12} {:>12} {:>8}".format("workload", "stage", "old ms", "new ms", "ratio"))
+    for (workload, stages) in results["workloads"].items():
+        for (stage, summary) in stages.items():
+            if not stage.endswith("_ms"):
+                continue
+            before = old.get("workloads", {}).get(workload, {}).get(stage, {}).get("median")
+            now = summary.get("median")
+            if before is None or now is None:
+                continue
+            print("{:<8} {:<8} {:>12.3f} {:>12.3f} {:>8.2f}".format(
+                workload, stage[:-3], before, now, now / before if before else float('inf')))
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description = 'Benchmark graph loading and the stages of a route request.')
+    parser.add_argument('-g', '--graph',
+                        help = 'path to road graph (DEFAULT = synthetic grid)',
+                        dest = 'graphname',
+                        default = None)
+    parser.add_argument('--grid',
+                        help = 'size of the synthetic grid (DEFAULT = 60)',
+                        type = int,
+                        default = 60)
+    parser.add_argument('--random',
+                        help = 'use digraph.random_graph with N vertices and M edges',
+                        nargs = 2,
+                        type = int,
+                        metavar = ('N', 'M'),
+                        default = None)
+    parser.add_argument('-n', '--queries',
+                        help = 'number of requests in each workload (DEFAULT = 200)',
+                        type = int,
+                        default = 200)
+    parser.add_argument('--seed',
+                        help = 'random seed for graphs and workloads (DEFAULT = 0)',
+                        type = int,
+                        default = 0)
+    parser.add_argument('--search',
+                        help = 'search algorithm (DEFAULT = astar)',
+                        choices = ['astar', 'dijkstra', 'bidirectional'],
+                        default = 'astar')
+    parser.add_argument('-o', '--output',
+                        help = 'file to write the results to (DEFAULT = serverbench.json)',
+                        default = 'serverbench.json')
+    parser.add_argument('--compare',
+                        help = 'results of an earlier run to compare with',
+                        default = None)
+
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    text_file = args.graphname
+    if text_file is None:
+        if args.random:
+            (vertices, edges) = random_city(args.random[0], args.random[1], args.seed)
+            source = "random_graph {} {}".format(*args.random)
+        else:
+            (vertices, edges) = benchmark.synthetic_city(args.grid, args.grid, args.seed)
+            source = "grid {}".format(args.grid)
+        text_file = os.path.join(tempfile.mkdtemp(), "graph.txt")
+        write_graph(vertices, edges, text_file)
+    else:
+        source = args.graphname
+
+    (G, vertices, index, load_seconds, load_bytes) = load_graph(text_file)
+    print("{}: {} vertices, {} edges, loaded in {:.3f} s, {:.1f} MB".format(
+        source, G.num_vertices(), G.num_edges(), load_seconds, load_bytes / 2 ** 20))
+
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "graph": { "source": source, "vertices": G.num_vertices(), "edges": G.num_edges() },
+        "options": { "queries": args.queries, "seed": args.seed, "search": args.search },
+        "load": { "seconds": load_seconds, "bytes": load_bytes },
+        "workloads": {},
+        }
+
+    workloads = [ ("random", random_queries(vertices, args.queries, args.seed)),
+                  ("worst", worst_queries(vertices, args.queries, args.seed)) ]
+
+    print("{:<8} {:<8} {:>10} {:>10} {:>10} {:>10}".format(
+        "workload", "stage", "mean ms", "median ms", "p99 ms", "max ms"))
+    for (name, queries) in workloads:
+        timings = run_workload(G, vertices, index, queries, args.search)
+        summary = {}
+        for stage in ("snap", "search", "ascii", "binary"):
+            summary[stage + "_ms"] = summarise([ 1000 * t for t in timings[stage] ])
+            s = summary[stage + "_ms"]
+            print("{:<8} {:<8} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}".format(
+                name, stage, s["mean"], s["median"], s["p99"], s["max"]))
+        summary["settled"] = summarise(timings["settled"])
+        summary["points"] = summarise(timings["points"])
+        results["workloads"][name] = summary
+
+    print("{:<8} {:>20} {:>20} {:>8}".format("workload", "snap one us/point", "snap batch us/point", "numpy"))
+    for (name, queries) in workloads:
+        (one, many) = time_snapping(index, queries)
+        results["workloads"][name]["snap_us_per_point"] = { "one": 1e6 * one, "batch": 1e6 * many }
+        print("{:<8} {:>20.2f} {:>20.2f} {:>8}".format(name, 1e6 * one, 1e6 * many, str(spatial.numpy is not None)))
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent = 1, sort_keys = True)
+    print("Wrote", args.output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
@@ -0,0 +1,119 @@
+"""
+Route geometry simplification before sending routes to the client.
+
+Every point of a route costs about 18 bytes on the 9600 baud serial link
+and a malloc'd coord_t on the Arduino.  Most road vertices only shape a
+curve, and at the zoom level the client is showing many of them fall
+within a pixel of the line through their neighbours.  Douglas-Peucker
+drops those points, measuring distances in pixels of the client's map.
+
+The map boxes mirror map_box, map_x_limit and map_y_limit in
+client-v2/map.cpp and must be kept in step with them.
+"""
+
+# (N, W, S, E) of each map tile, map 0 is the most zoomed out
+MAP_BOXES = [
+    (5364463, -11373047, 5343572, -11337891),
+    (5364464, -11373047, 5343572, -11337891),
+    (5361858, -11368652, 5340953, -11333496),
+    (5360554, -11368652, 5339643, -11333496),
+    (5360554, -11367554, 5339643, -11332397),
+    (5360228, -11367554, 5339316, -11332397),
+    ]
+
+# largest pixel coordinate of each map tile
+MAP_LIMITS = [511, 1023, 2047, 4095, 8191, 16383]
+
+BAUD = 9600
+
+def pixel_size(map_num):
+    """
+    Returns the (lat, lon) size of one pixel on the given map.
+
+    >>> (lat, lon) = pixel_size(0)
+    >>> (round(lat, 1), round(lon, 1))
+    (40.9, 68.8)
+    """
+    (north, west, south, east) = MAP_BOXES[map_num]
+    return ( (north - south) / MAP_LIMITS[map_num],
+             (east - west) / MAP_LIMITS[map_num] )
+
+def douglas_peucker(points, tolerance):
+    """
+    Returns the indices of the points to keep so that no dropped point is
+    more than tolerance away from the simplified line.  The first and
+    last points are always kept.
+
+    >>> douglas_peucker([(0, 0), (1, 0.1), (2, 0), (3, 5), (4, 0)], 0.5)
+    [0, 2, 3, 4]
+    >>> douglas_peucker([(0, 0), (0, 0)], 1)
+    [0, 1]
+    >>> douglas_peucker([(0, 0)], 1)
+    [0]
+    """
+    if len(points) < 3:
+        return list(range(len(points)))
+
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    tolerance_squared = tolerance * tolerance
+
+    todo = [ (0, len(points) - 1) ]
+    while todo:
+        (first, last) = todo.pop()
+        (x1, y1) = points[first]
+        (x2, y2) = points[last]
+        (dx, dy) = (x2 - x1, y2 - y1)
+        length_squared = dx * dx + dy * dy
+
+        farthest = None
+        farthest_distance = tolerance_squared
+        for i in range(first + 1, last):
+            (x, y) = points[i]
+            if length_squared == 0:
+                distance = (x - x1) ** 2 + (y - y1) ** 2
+            else:
+                # squared distance from the line through first and last
+                cross = dx * (y - y1) - dy * (x - x1)
+                distance = cross * cross / length_squared
+            if distance > farthest_distance:
+                farthest = i
+                farthest_distance = distance
+
+        if farthest is not None:
+            keep[farthest] = True
+            todo.append((first, farthest))
+            todo.append((farthest, last))
+
+    return [ i for i in range(len(points)) if keep[i] ]
+
+def simplify_route(coordinates, map_num, tolerance = 1.0):
+    """
+    Simplifies a list of (lat, lon) route coordinates for display on the
+    given map, dropping points less than tolerance pixels off the line.
+
+    >>> route = [(5350000, -11350000), (5350010, -11349000), (5350000, -11348000)]
+    >>> simplify_route(route, 0)
+    [(5350000, -11350000), (5350000, -11348000)]
+    >>> simplify_route(route, 5) == route
+    True
+    """
+    (lat_size, lon_size) = pixel_size(map_num)
+    pixels = [ (lon / lon_size, lat / lat_size) for (lat, lon) in coordinates ]
+
+    return [ coordinates[i] for i in douglas_peucker(pixels, tolerance) ]
+
+def transfer_seconds(lines, baud = BAUD):
+    """
+    Returns how long sending lines takes on the serial link, with one
+    start and one stop bit per byte and a newline per line.
+
+    >>> round(transfer_seconds(["2", "5365488 -11333914"], baud = 9600), 4)
+    0.0208
+    """
+    sent = sum(len(line) + 1 for line in lines)
+    return sent * 10 / baud
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,255 @@
+"""
+    python3 snapshot.py digraph-file [ snapshot-file ]
+
+Compiles a road network text file into a binary snapshot that the server
+can load with almost no parsing.  If snapshot-file is not given it is the
+text file name with ".snap" added.
+
+The snapshot holds the vertices, the edges in compressed sparse row form
+(see digraph.CSRDigraph), the street names and the cost_distance weight of
+every edge.  It is loaded through mmap and used in place, so several
+server processes on one host share the same pages.  The text file stays
+the source of truth: the snapshot records the SHA-256 of the text it was
+compiled from, and is_current checks it.
+
+Layout, all little endian, every section starting on an 8 byte boundary:
+    header        magic, version, vertex/edge/name counts, name bytes,
+                  SHA-256 of the text file
+    ids           int64[n]   vertex ids, sorted
+    lat, lon      int32[n]   coordinates, as from digraph.read_graph
+    offsets       int32[n+1] \\ edges out of each vertex
+    targets       int32[m]   /
+    roffsets      int32[n+1] \\ edges into each vertex
+    sources       int32[m]   /
+    weights       float64[m] cost of each edge, parallel to targets
+    edge_names    int32[m]   index of each edge's street name
+    name_offsets  int32[k+1] \\ street names, utf-8
+    name_bytes    char[]     /
+"""
+import array
+import hashlib
+import mmap
+import os
+import struct
+import sys
+
+import coordinates
+import digraph
+
+MAGIC = b"RONALDG\0"
+VERSION = 1
+
+# magic, version, vertices, edges, names, name bytes, text sha256
+_HEADER = struct.Struct("<8sIIIII32s")
+
+def text_checksum(text_file):
+    """
+    Returns the SHA-256 digest of a road network text file.
+    """
+    digest = hashlib.sha256()
+    with open(text_file, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.digest()
+
+def compile_snapshot(text_file, snapshot_file):
+    """
+    Parses text_file with digraph.read_graph and writes the result to
+    snapshot_file.  The file is replaced in one step, so servers that have
+    the old snapshot mapped keep reading it, and processes compiling the
+    same snapshot at once do not write over each other.
+    """
+    names = {}
+    (D, vertices) = digraph.read_graph(text_file, names)
+    cost = coordinates.CoordinateStore(vertices).distance_cost()
+    G = digraph.CSRDigraph(D.edges(), vertices, cost)
+    del D
+    (ids, offsets, targets, roffsets, sources, weights) = G.arrays()
+
+    lat = array.array('i', (vertices[v][0] for v in ids))
+    lon = array.array('i', (vertices[v][1] for v in ids))
+
+    # street names, stored once each, in the same edge order as targets
+    name_list = sorted(set(names.values()))
+    name_number = { name: i for (i, name) in enumerate(name_list) }
+    edge_names = array.array('i',
+        (name_number[names[(ids[i], ids[t])]] for i in range(len(ids))
+         for t in targets[offsets[i]:offsets[i+1]]))
+
+    encoded = [ name.encode('utf-8') for name in name_list ]
+    name_offsets = array.array('i', [0])
+    for name in encoded:
+        name_offsets.append(name_offsets[-1] + len(name))
+    name_bytes = b"".join(encoded)
+
+    header = _HEADER.pack(MAGIC, VERSION, len(ids), len(targets),
+                          len(name_list), len(name_bytes), text_checksum(text_file))
+
+    temporary = "%s.%d.tmp" % (snapshot_file, os.getpid())
+    with open(temporary, 'wb') as f:
+        write_section(f, header)
+        for section in (ids, lat, lon, offsets, targets, roffsets, sources,
+                        weights, edge_names, name_offsets):
+            write_section(f, little_endian(section).tobytes())
+        write_section(f, name_bytes)
+    os.replace(temporary, snapshot_file)
+
+class Snapshot:
+    """
+    A memory mapped graph snapshot.
+
+    graph     -- digraph.CSRDigraph over the mapped arrays, with weights
+    vertices  -- coordinates.CoordinateStore over the mapped coordinates
+    checksum  -- SHA-256 of the text file the snapshot was compiled from
+
+    >>> import os, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), "test.snap")
+    >>> compile_snapshot("test.txt", path)
+    >>> S = Snapshot(path)
+    >>> S.is_current("test.txt")
+    True
+    >>> sorted(S.graph.adj_to(276281417))
+    [276281415, 276281423]
+    >>> S.vertices[276281415]
+    (5347615, -11359341)
+    >>> S.street_name((276281417, 276281423))
+    'Romaniuk Road NW'
+    >>> S.graph.weight((276281417, 276281415)) == S.vertices.distance_cost()((276281417, 276281415))
+    True
+    >>> S.close()
+    """
+
+    def __init__(self, snapshot_file):
+        if sys.byteorder != 'little':
+            raise RuntimeError("Graph snapshots can only be loaded on little endian hosts")
+
+        self._sections = SectionReader(snapshot_file, _HEADER)
+        (magic, version, n, m, k, name_size, self.checksum) = self._sections.header
+        if magic != MAGIC:
+            raise ValueError("{} is not a graph snapshot".format(snapshot_file))
+        if version != VERSION:
+            raise ValueError("{} is snapshot version {}, expected {}".format(
+                snapshot_file, version, VERSION))
+
+        take = self._sections.take
+        ids = take('q', n)
+        self._lat = take('i', n)
+        self._lon = take('i', n)
+        offsets = take('i', n + 1)
+        targets = take('i', m)
+        roffsets = take('i', n + 1)
+        sources = take('i', m)
+        weights = take('d', m)
+        self._edge_names = take('i', m)
+        self._name_offsets = take('i', k + 1)
+        self._name_bytes = take('B', name_size)
+
+        self.graph = digraph.CSRDigraph.from_arrays(ids, offsets, targets,
+                                                    roffsets, sources, weights)
+        self.vertices = coordinates.CoordinateStore.from_arrays(
+            ids, self._lat, self._lon, self.graph.index)
+
+    def is_current(self, text_file):
+        """
+        Returns True if the snapshot was compiled from the current
+        contents of text_file.
+        """
+        return self.checksum == text_checksum(text_file)
+
+    def street_name(self, e):
+        """
+        Returns the street name of edge e.
+        """
+        n = self._edge_names[self.graph.edge_position(e)]
+        (start, stop) = (self._name_offsets[n], self._name_offsets[n+1])
+        return bytes(self._name_bytes[start:stop]).decode('utf-8')
+
+    def close(self):
+        """
+        Releases the memory map.  The graph and vertices cannot be used
+        afterwards.
+        """
+        self.graph = self.vertices = None
+        self._sections.close()
+
+class SectionReader:
+    """
+    Reads a file written with write_section through mmap: a header packed
+    with the struct header, then sections taken in the order they were
+    written, as memoryviews over the mapped pages.
+
+    >>> import os, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), "test.sections")
+    >>> header = struct.Struct("<I")
+    >>> with open(path, 'wb') as f:
+    ...     write_section(f, header.pack(3))
+    ...     write_section(f, little_endian(array.array('q', [7, 8, 9])).tobytes())
+    ...     write_section(f, b"ok")
+    >>> sections = SectionReader(path, header)
+    >>> (count,) = sections.header
+    >>> (list(sections.take('q', count)), bytes(sections.take('B', 2)))
+    ([7, 8, 9], b'ok')
+    >>> sections.close()
+    """
+
+    def __init__(self, filename, header):
+        with open(filename, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+
+        self.header = header.unpack_from(self._map, 0)
+        self._view = memoryview(self._map)
+        self._views = []
+        self._position = aligned(header.size)
+
+    def take(self, typecode, count):
+        """
+        Returns the next section, count numbers of array typecode.
+        """
+        size = count * struct.calcsize(typecode)
+        section = self._view[self._position:self._position + size].cast(typecode)
+        self._views.append(section)
+        self._position = aligned(self._position + size)
+        return section
+
+    def close(self):
+        """
+        Releases the sections and the memory map.
+        """
+        for section in self._views:
+            section.release()
+        self._views = []
+        self._view.release()
+        self._map.close()
+
+def aligned(position):
+    """
+    Returns position rounded up to the 8 byte boundary sections start on.
+    """
+    return (position + 7) & ~7
+
+def little_endian(section):
+    """
+    Returns an array of numbers as it is stored, little endian.
+    """
+    if sys.byteorder != 'little':
+        section = array.array(section.typecode, section)
+        section.byteswap()
+    return section
+
+def write_section(f, data):
+    """
+    Writes the bytes of one section, padded to an 8 byte boundary.
+    """
+    f.write(data)
+    f.write(b"\0" * (aligned(len(data)) - len(data)))
+
+if __name__ == "__main__":
+    argv = sys.argv[1:]
+    if not argv:
+        print(__doc__)
+        exit(1)
+
+    text_file = argv.pop(0)
+    snapshot_file = argv.pop(0) if argv else text_file + ".snap"
+    compile_snapshot(text_file, snapshot_file)
+    print("Wrote {}".format(snapshot_file))
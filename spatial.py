@@ -0,0 +1,282 @@
+"""
+Spatial index for snapping coordinates to the nearest vertex.
+
+The index buckets vertices into a uniform grid of square cells.  A query
+looks at the cell containing the point, then at rings of cells around it,
+and stops as soon as no unvisited cell can hold anything closer than what
+it has already found.
+
+Distances are compared as squared integers, and ties are broken by the
+smaller vertex id, so the answer never depends on dictionary order.
+
+Cells hold the dense indices of their vertices in a CoordinateStore, so
+the index adds only a few bytes per vertex to the coordinates.
+
+Batches of points are snapped with nearest_many.  With NumPy it looks
+at the 3 by 3 block of cells around every point at once, and only falls
+back to nearest for points whose answer could lie outside their block.
+"""
+
+import array
+import heapq
+import math
+
+import coordinates
+from coordinates import numpy
+
+# rings of cells nearest_many searches before going on one point at a time
+BATCH_RINGS = 15
+
+# fewer points than this are quicker to snap one at a time
+BATCH_MINIMUM = 8
+
+class GridIndex:
+    """
+    Uniform grid over a dictionary mapping vertex ids to (lat, lon), or
+    a coordinates.CoordinateStore, which is then shared rather than copied.
+
+    >>> index = GridIndex({1: (0, 0), 2: (10, 10), 3: (10, -10), 4: (50, 50)})
+    >>> index.nearest(9, 9)
+    2
+    >>> index.k_nearest(0, 0, 3)
+    [1, 2, 3]
+
+    # 1, 2 and 3 are all the same distance from (10, 0), the smallest id wins
+    >>> index.nearest(10, 0)
+    1
+
+    # a tie in the next ring of cells is still looked at
+    >>> GridIndex({2: (0, 5), 1: (10, 5), 3: (100, 100)}, cell_size = 10).nearest(5, 5)
+    1
+    >>> index.nearest(10 ** 9, 10 ** 9)
+    4
+    """
+
+    def __init__(self, vertices, cell_size = None):
+        if not isinstance(vertices, coordinates.CoordinateStore):
+            vertices = coordinates.CoordinateStore(vertices)
+        self._store = vertices
+        self._cells = {}
+        self._sorted_cells = None
+
+        if not len(vertices):
+            self._cell_size = 1
+            self._bounds = None
+            return
+
+        lats = vertices.lat
+        lons = vertices.lon
+
+        if cell_size is None:
+            # aim for a handful of vertices per cell
+            area = max(1, (max(lats) - min(lats)) * (max(lons) - min(lons)))
+            cell_size = max(1, int(math.sqrt(4 * area / len(vertices))))
+        self._cell_size = cell_size
+
+        for i in range(len(vertices)):
+            cell = (lats[i] // cell_size, lons[i] // cell_size)
+            if cell not in self._cells:
+                self._cells[cell] = array.array('i')
+            self._cells[cell].append(i)
+
+        rows = [ cell[0] for cell in self._cells ]
+        cols = [ cell[1] for cell in self._cells ]
+        self._bounds = (min(rows), max(rows), min(cols), max(cols))
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self._cells.values())
+
+    def nearest(self, lat, lon):
+        """
+        Returns the id of the vertex closest to (lat, lon), or None if the
+        index is empty.
+
+        >>> GridIndex({}).nearest(0, 0)
+        >>> GridIndex({7: (5, 5)}).nearest(0, 0)
+        7
+        """
+        found = self.k_nearest(lat, lon, 1)
+        if not found:
+            return None
+        return found[0]
+
+    def k_nearest(self, lat, lon, k):
+        """
+        Returns the ids of the k vertices closest to (lat, lon), closest
+        first.  Returns fewer than k ids if the index is smaller than k.
+
+        >>> vertices = { v: (v // 10, v % 10) for v in range(100) }
+        >>> index = GridIndex(vertices, cell_size = 3)
+        >>> index.k_nearest(5, 5, 5)
+        [55, 45, 54, 56, 65]
+        >>> len(index.k_nearest(5, 5, 1000))
+        100
+        """
+        if k <= 0 or self._bounds is None:
+            return []
+
+        size = self._cell_size
+        (row, col) = (lat // size, lon // size)
+        (min_row, max_row, min_col, max_col) = self._bounds
+
+        # rings before the first and past the last hold no cells at all,
+        # which matters for points far outside the map
+        first_ring = max(0, min_row - row, row - max_row, min_col - col, col - max_col)
+        last_ring = max(row - min_row, max_row - row, col - min_col, max_col - col)
+
+        lats = self._store.lat
+        lons = self._store.lon
+        ids = self._store.ids
+
+        # max heap of the best k so far, as (-distance squared, -id)
+        best = []
+
+        ring = first_ring
+        while ring <= last_ring:
+            for cell in _ring_cells(row, col, ring, self._bounds):
+                for i in self._cells.get(cell, ()):
+                    entry = ( -((lat - lats[i]) ** 2 + (lon - lons[i]) ** 2), -ids[i] )
+                    if len(best) < k:
+                        heapq.heappush(best, entry)
+                    elif entry > best[0]:
+                        heapq.heapreplace(best, entry)
+
+            # anything outside the rings searched so far is at least this far
+            reach = min(lat - (row - ring) * size, (row + ring + 1) * size - lat,
+                        lon - (col - ring) * size, (col + ring + 1) * size - lon)
+            if len(best) == k and -best[0][0] < reach * reach:
+                break
+
+            ring += 1
+
+        return [ -id for (_, id) in sorted(best, reverse = True) ]
+
+    def nearest_many(self, lats, lons):
+        """
+        Returns the id of the vertex closest to each point (lats[i],
+        lons[i]), as nearest does for one point.
+
+        >>> vertices = { v: (v // 10, v % 10) for v in range(100) }
+        >>> index = GridIndex(vertices, cell_size = 3)
+        >>> index.nearest_many([5, 0, 100, 2] * 3, [5, 0, 100, -40] * 3)
+        [55, 0, 99, 20, 55, 0, 99, 20, 55, 0, 99, 20]
+        >>> GridIndex({}).nearest_many([1], [1])
+        [None]
+        """
+        if len(lats) != len(lons):
+            raise ValueError("Different numbers of latitudes and longitudes")
+
+        if numpy is None or self._bounds is None or len(lats) < BATCH_MINIMUM:
+            return [ self.nearest(lat, lon) for (lat, lon) in zip(lats, lons) ]
+
+        size = self._cell_size
+        (min_row, max_row, min_col, max_col) = self._bounds
+        width = max_col - min_col + 1
+        (keys, order) = self._cells_by_key()
+        (lat, lon) = self._store.numpy_columns()
+
+        lats = numpy.asarray(lats, dtype = numpy.int64)
+        lons = numpy.asarray(lons, dtype = numpy.int64)
+        rows = lats // size
+        cols = lons // size
+
+        # closest vertex so far of every point, -1 for none yet
+        best_distance = numpy.full(len(lats), numpy.iinfo(numpy.int64).max)
+        best_vertex = numpy.full(len(lats), -1, dtype = numpy.int64)
+
+        # as in k_nearest, but the points still being searched look at
+        # rings first to last together, twice as many rings each time around
+        pending = numpy.arange(len(lats))
+        (first_ring, last_ring) = (0, 1)
+        while len(pending) and first_ring <= BATCH_RINGS:
+            offsets = numpy.array([ cell for ring in range(first_ring, last_ring + 1)
+                                    for cell in _ring_cells(0, 0, ring, (-ring, ring, -ring, ring)) ])
+
+            # every cell around every pending point, row by row
+            r = rows[pending, None] + offsets[:, 0]
+            c = cols[pending, None] + offsets[:, 1]
+            inside = (r >= min_row) & (r <= max_row) & (c >= min_col) & (c <= max_col)
+            key = numpy.where(inside, (r - min_row) * width + (c - min_col), -1).ravel()
+            first = numpy.searchsorted(keys, key, 'left')
+            counts = numpy.searchsorted(keys, key, 'right') - first
+
+            # then every vertex in those cells, along with the best so far
+            known = pending[best_vertex[pending] >= 0]
+            starts = numpy.repeat(first - (numpy.cumsum(counts) - counts), counts)
+            pair_points = numpy.concatenate((known,
+                numpy.repeat(numpy.repeat(pending, len(offsets)), counts)))
+            pair_vertices = numpy.concatenate((best_vertex[known],
+                order[starts + numpy.arange(len(starts))]))
+
+            d_lat = lats[pair_points] - lat[pair_vertices]
+            d_lon = lons[pair_points] - lon[pair_vertices]
+            distances = d_lat * d_lat + d_lon * d_lon
+
+            # the closest pair of each point, the smallest vertex among equals
+            numpy.minimum.at(best_distance, pair_points, distances)
+            closest = distances == best_distance[pair_points]
+            best_vertex[pending] = len(order)
+            numpy.minimum.at(best_vertex, pair_points[closest], pair_vertices[closest])
+            best_vertex[best_vertex == len(order)] = -1
+
+            # anything outside the rings searched so far is at least this far
+            (r, c, p_lat, p_lon) = (rows[pending], cols[pending], lats[pending], lons[pending])
+            reach = numpy.minimum(
+                numpy.minimum(p_lat - (r - last_ring) * size, (r + last_ring + 1) * size - p_lat),
+                numpy.minimum(p_lon - (c - last_ring) * size, (c + last_ring + 1) * size - p_lon))
+            done = (best_vertex[pending] >= 0) & (best_distance[pending] < reach * reach)
+            pending = pending[~done]
+            (first_ring, last_ring) = (last_ring + 1, 2 * last_ring + 1)
+
+        result = [ self._store.ids[i] for i in best_vertex.tolist() ]
+
+        # points far from every vertex, which the rings have not reached
+        for p in pending.tolist():
+            result[p] = self.nearest(int(lats[p]), int(lons[p]))
+
+        return result
+
+    def _cells_by_key(self):
+        """
+        Returns (keys, order): the vertex indices in order of the number of
+        their cell, row by row across the bounds, and the sorted cell
+        numbers that go with them.  Made on first use.
+        """
+        if self._sorted_cells is None:
+            (min_row, max_row, min_col, max_col) = self._bounds
+            (lat, lon) = self._store.numpy_columns()
+            size = self._cell_size
+            keys = (lat // size - min_row) * (max_col - min_col + 1) + (lon // size - min_col)
+            order = numpy.argsort(keys, kind = 'stable')
+            self._sorted_cells = (keys[order], order)
+        return self._sorted_cells
+
+def _ring_cells(row, col, ring, bounds):
+    """
+    Returns the cells on the square ring at the given distance around
+    (row, col), leaving out the cells outside bounds.
+
+    >>> _ring_cells(0, 0, 0, (-5, 5, -5, 5))
+    [(0, 0)]
+    >>> len(_ring_cells(0, 0, 2, (-5, 5, -5, 5)))
+    16
+    >>> _ring_cells(0, 0, 1, (1, 5, 0, 5))
+    [(1, 0), (1, 1)]
+    """
+    (min_row, max_row, min_col, max_col) = bounds
+
+    if ring == 0:
+        return [ (row, col) ]
+
+    cells = []
+    cols = range(max(min_col, col - ring), min(max_col, col + ring) + 1)
+    for r in (row - ring, row + ring):
+        if min_row <= r <= max_row:
+            cells.extend((r, c) for c in cols)
+
+    rows = range(max(min_row, row - ring + 1), min(max_row, row + ring - 1) + 1)
+    for c in (col - ring, col + ring):
+        if min_col <= c <= max_col:
+            cells.extend((r, c) for r in rows)
+
+    return cells
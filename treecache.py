@@ -0,0 +1,208 @@
+"""
+Least cost trees kept between requests from the same origin.
+
+Devices often send many requests from one origin, such as a depot, to
+different destinations.  Dijkstra's algorithm from an origin settles the
+vertices in order of cost, so once it has settled one destination every
+closer destination is already answered by its parent pointers, and a
+farther one only needs the search to carry on from where it stopped.
+
+SearchTree keeps one such search, its settled vertices and its queue,
+and TreeCache keeps the trees of the origins used most recently, within
+a bound on the number of origins and on the vertices they hold.
+"""
+
+import collections
+import heapq
+
+import digraph
+
+class SearchTree:
+    """
+    Dijkstra's algorithm from start that can be stopped at a destination
+    and resumed later for a farther one.  If cost is None the weights
+    stored in G are used.  Vertices are settled in the same order as
+    digraph.least_cost_path, so the paths are the same.
+
+    >>> G = digraph.Digraph([(1, 2), (2, 3), (3, 4), (1, 5)])
+    >>> tree = SearchTree(G, 1, lambda e: 1)
+    >>> stats = {}
+    >>> (tree.least_cost_path(3, stats), stats["settled"])
+    ([1, 2, 3], 4)
+
+    Vertices settled on the way need no more searching
+    >>> (tree.least_cost_path(5, stats), stats["settled"])
+    ([1, 5], 0)
+    >>> (tree.least_cost_path(4, stats), stats["settled"])
+    ([1, 2, 3, 4], 1)
+    >>> tree.least_cost_path(6, stats)
+    >>> (tree.exhausted(), len(tree))
+    (True, 5)
+    """
+
+    def __init__(self, G, start, cost = None):
+        self.start = start
+        self._neighbours = digraph.edge_costs(G, cost)
+
+        self.distance = {start: 0}
+        self.parent = {}
+        self._order = {start: 0}
+        self._todo = [(0, 0, start)]
+        self._settled = set()
+
+    def __len__(self):
+        """
+        Returns the number of vertices the tree holds, settled or queued.
+        """
+        return len(self.distance)
+
+    def exhausted(self):
+        """
+        Returns True once every vertex reachable from start is settled.
+        """
+        return not self._todo
+
+    def settled(self, v):
+        """
+        Returns True if the least cost path to v is known.
+        """
+        return v in self._settled
+
+    def least_cost_path(self, dest, stats = None):
+        """
+        Returns the least cost path from start to dest, or None if there
+        is none, carrying the search on only as far as dest.  If stats is
+        a dictionary it is filled with the counters of least_cost_path for
+        the work done by this call.
+        """
+        if stats is None:
+            stats = {}
+
+        distance = self.distance
+        order = self._order
+        parent = self.parent
+        settled = self._settled
+        todo = self._todo
+        (before, relaxed, stale) = (len(settled), 0, 0)
+
+        while dest not in settled and todo:
+            (total_distance, _, vertex_id) = heapq.heappop(todo)
+
+            # stale entry, the vertex was already settled with a lower cost
+            if vertex_id in settled:
+                stale += 1
+                continue
+
+            settled.add(vertex_id)
+
+            for (neighbour, edge_cost) in self._neighbours(vertex_id):
+                if neighbour in settled: continue
+
+                new_distance = total_distance + edge_cost
+                if (neighbour not in distance) or (new_distance < distance[neighbour]):
+                    if neighbour not in order:
+                        order[neighbour] = len(order)
+                    distance[neighbour] = new_distance
+                    parent[neighbour] = vertex_id
+                    relaxed += 1
+                    heapq.heappush(todo, (new_distance, order[neighbour], neighbour))
+
+        stats["settled"] = len(settled) - before
+        stats["relaxed"] = relaxed
+        stats["stale"] = stale
+
+        if dest not in settled:
+            return None
+
+        return digraph.extract_path(parent, self.start, dest)
+
+class TreeCache:
+    """
+    LRU cache of search trees by origin.  At most size origins are kept,
+    and the least recently used trees are evicted while the trees hold
+    more than max_vertices vertices between them.  A size of 0 turns the
+    cache off.
+
+    >>> G = digraph.Digraph([(1, 2), (2, 3), (3, 1), (3, 4)])
+    >>> cache = TreeCache(G, 2, cost = lambda e: 1)
+    >>> cache.least_cost_path(1, 4)
+    [1, 2, 3, 4]
+    >>> cache.least_cost_path(1, 3)
+    [1, 2, 3]
+    >>> cache.least_cost_path(2, 1)
+    [2, 3, 1]
+    >>> cache.least_cost_path(3, 1)
+    [3, 1]
+    >>> sorted(cache.stats().items())
+    [('evictions', 1), ('hits', 1), ('misses', 3), ('resumed', 0), ('size', 2), ('vertices', 8)]
+
+    Trees are evicted to stay within max_vertices
+    >>> cache = TreeCache(G, 2, max_vertices = 4, cost = lambda e: 1)
+    >>> (cache.least_cost_path(1, 4), cache.least_cost_path(2, 3))
+    ([1, 2, 3, 4], [2, 3])
+    >>> (len(cache), cache.stats()["vertices"])
+    (1, 4)
+    """
+
+    def __init__(self, G, size = 16, max_vertices = 1000000, cost = None):
+        self.size = size
+        self.max_vertices = max_vertices
+        self._G = G
+        self._cost = cost
+        self._trees = collections.OrderedDict()
+        self._vertices = 0
+
+        self.hits = 0
+        self.resumed = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._trees)
+
+    def least_cost_path(self, start, dest, stats = None):
+        """
+        Returns the least cost path from start to dest, or None if there
+        is none, from the tree grown from start if one is cached.  stats
+        is as for SearchTree.least_cost_path.
+        """
+        tree = self._trees.get(start)
+        if tree is None:
+            self.misses += 1
+            tree = SearchTree(self._G, start, self._cost)
+            if self.size > 0:
+                self._trees[start] = tree
+                self._vertices += len(tree)
+        else:
+            self._trees.move_to_end(start)
+            if tree.settled(dest) or tree.exhausted():
+                self.hits += 1
+            else:
+                self.resumed += 1
+
+        before = len(tree)
+        path = tree.least_cost_path(dest, stats)
+
+        if start in self._trees:
+            self._vertices += len(tree) - before
+            self._evict()
+
+        return path
+
+    def _evict(self):
+        """
+        Drops the least recently used trees until the cache is within its
+        bounds.
+        """
+        while self._trees and (len(self._trees) > self.size or self._vertices > self.max_vertices):
+            (_, tree) = self._trees.popitem(last = False)
+            self._vertices -= len(tree)
+            self.evictions += 1
+
+    def stats(self):
+        """
+        Returns the cache counters as a dictionary.
+        """
+        return { "hits": self.hits, "resumed": self.resumed, "misses": self.misses,
+                 "evictions": self.evictions, "size": len(self._trees),
+                 "vertices": self._vertices }
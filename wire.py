@@ -0,0 +1,251 @@
+"""
+Compact binary encoding of routes for the serial link.
+
+In the ASCII protocol every point of a route goes out as a line like
+"5365488 -11333914", about 18 bytes.  Consecutive road vertices are close
+together, so the binary protocol sends the first point in full and every
+later point as the difference from the one before.  Each number is
+zig-zag encoded, which maps small negative and positive values to small
+unsigned ones, then written as a varint: 7 bits per byte, low bits first,
+with the top bit set on every byte but the last.  Most points then take
+4 or 5 bytes.
+
+A route frame is
+
+    payload length   2 bytes, little endian
+    payload          varint number of points, then the zig-zag varint
+                     lat and lon of each point, deltas after the first
+    checksum         2 bytes, little endian, Fletcher-16 of the payload
+
+A route with no path is a frame with 0 points.  So is a route whose
+payload would not fit in 2 bytes of length, about 13000 points; clients
+that need those should use protocol 2.
+
+Protocol 2 streams ASCII routes in chunks, so the number of points need
+not be known before the first one goes out.  Each chunk is a line with
+the number of points in it followed by that many "lat lon" lines, and a
+chunk of 0 points ends the route.  A route with no path is just "0".
+
+The protocol is negotiated.  Before a request the client may send a line
+like "PROTOCOL 1"; the server answers with the same line and uses that
+protocol from then on, or "PROTOCOL 0" to stay with ASCII.  A client that hears
+nothing back is talking to a server that only knows ASCII.  Requests are
+always ASCII lines.  The client side is read_path in client-v2/path.cpp.
+
+The line "RELOAD" asks the server to load its road graph again.  It
+answers "RELOAD 1" if it has started, or "RELOAD 0" if a reload is
+already under way, and goes on answering routes from the old graph
+until the new one is ready.
+"""
+
+import struct
+
+# protocol numbers, as sent in the negotiation line
+ASCII = 0
+BINARY = 1
+STREAM = 2
+
+PROTOCOLS = (ASCII, BINARY, STREAM)
+
+# control line that asks for the road graph to be loaded again
+RELOAD = "RELOAD"
+
+# most points in one chunk of a streamed route
+CHUNK_POINTS = 16
+
+def negotiate(line):
+    """
+    If line asks for a protocol returns the protocol the server will use,
+    otherwise returns None.  Unknown protocols fall back to ASCII.
+
+    >>> negotiate("PROTOCOL 1")
+    1
+    >>> negotiate("PROTOCOL 7")
+    0
+    >>> negotiate("5365488 -11333914 5364727 -11335890")
+    """
+    fields = line.split(' ')
+    if len(fields) != 2 or fields[0] != "PROTOCOL":
+        return None
+
+    try:
+        asked = int(fields[1])
+    except ValueError:
+        return ASCII
+
+    return asked if asked in PROTOCOLS else ASCII
+
+def negotiation_reply(protocol):
+    """
+    Returns the line that tells the client which protocol is in use.
+
+    >>> negotiation_reply(BINARY)
+    'PROTOCOL 1'
+    """
+    return "PROTOCOL %d" % protocol
+
+def reload_reply(started):
+    """
+    Returns the line that answers a RELOAD line.
+
+    >>> reload_reply(True)
+    'RELOAD 1'
+    """
+    return "%s %d" % (RELOAD, started)
+
+def zigzag(n):
+    """
+    Maps signed integers to unsigned ones, small magnitudes to small values.
+
+    >>> [zigzag(n) for n in (0, -1, 1, -2, 2)]
+    [0, 1, 2, 3, 4]
+    """
+    return (n << 1) ^ (n >> 63)
+
+def unzigzag(z):
+    """
+    Inverse of zigzag.
+
+    >>> [unzigzag(z) for z in (0, 1, 2, 3, 4)]
+    [0, -1, 1, -2, 2]
+    """
+    return (z >> 1) ^ -(z & 1)
+
+def put_varint(out, value):
+    """
+    Appends the varint encoding of the unsigned value to the bytearray out.
+
+    >>> out = bytearray()
+    >>> put_varint(out, 300)
+    >>> bytes(out)
+    b'\\xac\\x02'
+    """
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def get_varint(data, pos):
+    """
+    Reads a varint from data at pos, returning (value, next pos).
+
+    >>> get_varint(b'\\xac\\x02', 0)
+    (300, 2)
+    """
+    value = 0
+    shift = 0
+    while True:
+        if pos >= len(data):
+            raise ValueError("Truncated varint")
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return (value, pos)
+        shift += 7
+
+def fletcher16(data):
+    """
+    Fletcher-16 checksum of data, cheap enough for the Arduino to keep up
+    with as the bytes arrive.
+
+    >>> hex(fletcher16(b'abcde'))
+    '0xc8f0'
+    """
+    sum1 = sum2 = 0
+    for byte in data:
+        sum1 = (sum1 + byte) % 255
+        sum2 = (sum2 + sum1) % 255
+    return (sum2 << 8) | sum1
+
+def encode_route(coordinates):
+    """
+    Returns the frame for a route given as a list of (lat, lon) points.
+
+    >>> frame = encode_route([(5365488, -11333914), (5365238, -11334423)])
+    >>> len(frame)
+    17
+    >>> encode_route([])
+    b'\\x01\\x00\\x00\\x00\\x00'
+    """
+    payload = bytearray()
+    put_varint(payload, len(coordinates))
+
+    (last_lat, last_lon) = (0, 0)
+    for (lat, lon) in coordinates:
+        put_varint(payload, zigzag(lat - last_lat))
+        put_varint(payload, zigzag(lon - last_lon))
+        (last_lat, last_lon) = (lat, lon)
+
+    if len(payload) > 0xffff:
+        raise ValueError("Route too long for one frame")
+
+    return (struct.pack("<H", len(payload)) + payload +
+            struct.pack("<H", fletcher16(payload)))
+
+def decode_route(frame):
+    """
+    Returns the list of (lat, lon) points in a frame.  Raises ValueError if
+    the frame is damaged.
+
+    >>> route = [(5365488, -11333914), (5365238, -11334423), (5365157, -11334634)]
+    >>> decode_route(encode_route(route)) == route
+    True
+    >>> decode_route(b'\\x01\\x00\\x00\\x00\\x01')
+    Traceback (most recent call last):
+        ...
+    ValueError: Bad route checksum
+    """
+    if len(frame) < 4:
+        raise ValueError("Truncated route frame")
+
+    (length,) = struct.unpack_from("<H", frame, 0)
+    if len(frame) != length + 4:
+        raise ValueError("Route frame length does not match its header")
+
+    payload = frame[2:2 + length]
+    (checksum,) = struct.unpack_from("<H", frame, 2 + length)
+    if fletcher16(payload) != checksum:
+        raise ValueError("Bad route checksum")
+
+    (count, pos) = get_varint(payload, 0)
+    coordinates = []
+    (lat, lon) = (0, 0)
+    for _ in range(count):
+        (delta, pos) = get_varint(payload, pos)
+        lat += unzigzag(delta)
+        (delta, pos) = get_varint(payload, pos)
+        lon += unzigzag(delta)
+        coordinates.append((lat, lon))
+
+    if pos != length:
+        raise ValueError("Route frame has trailing bytes")
+
+    return coordinates
+
+def chunk_lines(points, chunk_points = CHUNK_POINTS):
+    """
+    Generates the lines of a streamed route from an iterable of (lat, lon)
+    points, sending each chunk as soon as its points have arrived.
+
+    >>> list(chunk_lines([(1, 2), (3, 4), (5, 6)], chunk_points = 2))
+    ['2', '1 2', '3 4', '1', '5 6', '0']
+    >>> list(chunk_lines([]))
+    ['0']
+    """
+    chunk = []
+    for (lat, lon) in points:
+        chunk.append(str(lat) + " " + str(lon))
+        if len(chunk) == chunk_points:
+            yield str(len(chunk))
+            yield from chunk
+            chunk = []
+
+    if chunk:
+        yield str(len(chunk))
+        yield from chunk
+    yield "0"
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()